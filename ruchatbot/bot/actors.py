@@ -145,13 +145,17 @@ class ActorSay(ActorBase):
                 continue
 
             if session.count_bot_phrase(utterance) == 0:
-                if self.known_answer_policy == 'skip' and utterance[-1] == '?':
-                    # Проверим, что бот еще не знает ответ на этот вопрос:
-                    if bot.does_bot_know_answer(utterance, session, interlocutor):
-                        continue
-
                 new_utterances.append(utterance)
 
+        if self.known_answer_policy == 'skip':
+            # Уберем вопросы, ответ на которые бот уже знает. Все вопросы проверяем за один раз.
+            questions = [utterance for utterance in new_utterances if utterance[-1] == '?']
+            if questions:
+                known_questions = set(question for question, known
+                                      in zip(questions, bot.does_bot_know_answers(questions, session, interlocutor))
+                                      if known)
+                new_utterances = [utterance for utterance in new_utterances if utterance not in known_questions]
+
         uttered = False
         if len(new_utterances) > 0:
             # Выбираем одну из оставшихся фраз.
@@ -10,6 +10,9 @@
 21-05-2020 Полная переработка генеративной модели на одну seq2seq with attention
 27-06-2020 Добавлена вторая экспериментальная модель генерации ответа - шаблонная knn-1
 28-07-2020 Исправление ошибки с потерей tf-сессии
+18-10-2026 Одновременные вызовы модели из разных потоков объединяются в батч (BatchingPredictor)
+18-10-2026 Все группы предпосылок (и несколько вопросов) декодируются seq2seq моделью за один вызов
+18-10-2026 Индекс шаблонов knn-1 модели и заранее рассчитанные множества близких слов вместо word_similarity
 """
 
 import os
@@ -24,6 +27,7 @@ import sentencepiece as spm
 
 # https://github.com/asmekal/keras-monotonic-attention
 from ruchatbot.layers.attention_decoder import AttentionDecoder
+from ruchatbot.utils.batch_predictor import BatchingPredictor
 
 
 class AnswerBuilder(object):
@@ -32,16 +36,28 @@ class AnswerBuilder(object):
         self.trace_enabled = True
         self.model = None
         self.answer_templates = None
+        self.templates_index = None
+        self.template_lines_counts = None
+        self.similar_words = None
+        self.similar_template_words = None
         self.graph = None
+        self.predictor = None
 
-    def load_models(self, models_folder, text_utils):
+    def load_templates(self, models_folder, text_utils):
+        """
+        Загрузка шаблонов knn-1 модели и построение их индекса. Здесь нет tf-сессий, поэтому
+        при запуске нескольких рабочих процессов шаблоны загружаются до fork и разделяются процессами.
+        """
+        with open(os.path.join(models_folder, 'answer_templates.dat'), 'rb') as f:
+            self.answer_templates = pickle.load(f)
+        self.build_templates_index(text_utils)
+
+    def load_models(self, models_folder):
+        """Загрузка нейросетевой seq2seq модели, вызывается в каждом рабочем процессе"""
         self.models_folder = models_folder
 
         self.graph = tf.get_default_graph()
 
-        with open(os.path.join(models_folder, 'answer_templates.dat'), 'rb') as f:
-            self.answer_templates = pickle.load(f)
-
         config_path = os.path.join(models_folder, 'nn_seq2seq_pqa_generator.config')
         with open(config_path, 'r') as f:
             computed_params = json.load(f)
@@ -53,6 +69,7 @@ class AnswerBuilder(object):
             self.model = model_from_json(f.read(), {'AttentionDecoder': AttentionDecoder})
 
         self.model.load_weights(weights_file)
+        self.predictor = BatchingPredictor(self.model, self.graph)
 
         # Токенизатор
         self.bpe_model = spm.SentencePieceProcessor()
@@ -79,6 +96,68 @@ class AnswerBuilder(object):
 
         return False
 
+    @staticmethod
+    def get_template_pos(template_item):
+        # Первым в списке проверяемых тегов идет часть речи, если она проверяется.
+        if template_item[1] and '=' not in template_item[1][0]:
+            return template_item[1][0]
+        return None
+
+    def build_templates_index(self, text_utils):
+        """
+        Шаблон сопоставляется с контекстом (предпосылка и вопрос) только при совпадении числа значимых
+        токенов в каждой фразе, а каждое слово контекста должно совпасть со словом шаблона или быть
+        близким к нему (word_similarity >= 0.90). Поэтому для всех слов шаблонов заранее находим
+        множества близких слов, а шаблоны индексируем по числу токенов в фразах и по первому
+        слову шаблона. Для кандидатов из индекса перед полным сопоставлением сверяются части речи.
+        """
+        template_words = set()
+        for template1, output_template in self.answer_templates:
+            for line in template1:
+                template_words.update(item[0] for item in line)
+
+        self.similar_words = text_utils.find_similar_words(template_words, 0.90)
+
+        # Обратное отображение: словоформа => слова шаблонов, к которым она близка
+        self.similar_template_words = dict()
+        for template_word, words in self.similar_words.items():
+            for word in words:
+                self.similar_template_words.setdefault(word, []).append(template_word)
+
+        self.templates_index = dict()
+        self.template_lines_counts = set()
+        for itemplate, (template1, output_template) in enumerate(self.answer_templates):
+            # Шаблон с лишними фразами сопоставляется только с имеющимися фразами контекста.
+            lines = template1[:2]
+            items = [item for line in lines for item in line]
+            if not items:
+                # пустой шаблон не дает сопоставления
+                continue
+
+            shape = tuple(len(line) for line in lines)
+            pos_signature = tuple(AnswerBuilder.get_template_pos(item) for item in items)
+            self.templates_index.setdefault((shape, items[0][0]), []).append((itemplate, pos_signature))
+            self.template_lines_counts.add(len(lines))
+
+        self.logger.debug('%d answer templates indexed, %d template words', len(self.answer_templates), len(template_words))
+
+    def find_candidate_templates(self, context):
+        candidates = []
+        for nb_lines in self.template_lines_counts:
+            lines = context[:nb_lines]
+            tokens = [token for line in lines for token in line]
+            if not tokens:
+                continue
+
+            shape = tuple(len(line) for line in lines)
+            context_pos = [token[1][0] for token in tokens]
+            for template_word in self.similar_template_words.get(tokens[0][0], []):
+                for itemplate, pos_signature in self.templates_index.get((shape, template_word), []):
+                    if all((pos is None or pos == pos2) for pos, pos2 in zip(pos_signature, context_pos)):
+                        candidates.append(itemplate)
+
+        return sorted(candidates)
+
     def prepare_context_line(self, line, text_utils):
         tokens = text_utils.lemmatize2(line)
         tokens = [(t[0], t[1].split('|'), t[2]) for t in tokens if self.is_important_token2(t)]
@@ -100,14 +179,12 @@ class AnswerBuilder(object):
                     # формы слов совпали буквально
                     if loc is not None:
                         match1[loc] = token[2]
+                elif token[0] in self.similar_words[template_item[0]]:
+                    # близкие векторы слов в шаблоне и фразе
+                    if loc is not None:
+                        match1[loc] = token[2]
                 else:
-                    sim = text_utils.word_similarity(template_item[0], token[0])
-                    if sim >= 0.90:
-                        # близкие векторы слов в шаблоне и фразе
-                        if loc is not None:
-                            match1[loc] = token[2]
-                    else:
-                        return None
+                    return None
 
         return match1
 
@@ -149,7 +226,8 @@ class AnswerBuilder(object):
             premise = premises[0]
             context = [self.prepare_context_line(s, text_utils) for s in (premise, question)]
 
-            for i1, (template1, output_template) in enumerate(self.answer_templates):
+            for i1 in self.find_candidate_templates(context):
+                template1, output_template = self.answer_templates[i1]
                 matching = self.match_support_template(template1, context, text_utils)
                 if matching:
                     out = self.generate_output_by_template(output_template, matching, text_utils)
@@ -159,47 +237,71 @@ class AnswerBuilder(object):
         return None, None
 
     def build_answer_text(self, premise_groups, premise_rels, question, text_utils):
-        # Определяем способ генерации ответа
-        answers = []
-        answer_rels = []
-
-        X = np.zeros((1, self.seq_len), dtype=np.int32)
-
-        question_str = ' '.join(text_utils.tokenize(question))
-        if question_str[-1] != '?':
-            question_str += ' ?'
-
-        for premises, group_rel in zip(premise_groups, premise_rels):
-            # Сначала попробуем точную knn-1 модель
-            answer, answer_rel = self.build_using_knn1(premises, question, text_utils)
-            if answer:
-                answers.append(answer)
-                answer_rels.append(answer_rel)
-            else:
-                # Предпосылки и вопрос объединяем в одну строку.
-                left_parts = []
-                for premise in premises:
-                    s = ' '.join(text_utils.tokenize(premise))
-                    if s[-1] not in '.?!':
-                        s = s + ' .'
-                    left_parts.append(s)
-
-                left_parts.append(question_str)
-                left_str = ' '.join(left_parts)
-                left_tokens = self.bpe_model.EncodeAsPieces(left_str)
-                for itoken, token in enumerate(left_tokens):
-                    X[0, itoken] = self.token2index.get(token, 0)
-
-                with self.graph.as_default():
-                    y_pred = self.model.predict(X, verbose=0)
-
-                y_pred = np.argmax(y_pred[0], axis=-1)
-                tokens = [self.index2token[itok] for itok in y_pred]
-                answer_str = ''.join(tokens).replace('▁', ' ').strip()
-
-                answers.append(answer_str)
-
-                answer_rel = group_rel
-                answer_rels.append(answer_rel)
-
-        return answers, answer_rels
+        return self.build_answer_texts([(premise_groups, premise_rels, question)], text_utils)[0]
+
+    def build_answer_texts(self, queries, text_utils):
+        """
+        Генерация ответов сразу для нескольких вопросов. Группы предпосылок, для которых
+        не сработала knn-1 модель, декодируются seq2seq моделью за один вызов predict.
+        :param queries: список кортежей (premise_groups, premise_rels, question)
+        :return: список кортежей (answers, answer_rels) в том же порядке
+        """
+        results = []
+        pending = []  # (индекс вопроса, индекс ответа, входная строка для seq2seq модели)
+
+        for premise_groups, premise_rels, question in queries:
+            answers = []
+            answer_rels = []
+
+            question_str = ' '.join(text_utils.tokenize(question))
+            if question_str[-1] != '?':
+                question_str += ' ?'
+
+            for premises, group_rel in zip(premise_groups, premise_rels):
+                # Сначала попробуем точную knn-1 модель
+                answer, answer_rel = self.build_using_knn1(premises, question, text_utils)
+                if answer:
+                    answers.append(answer)
+                    answer_rels.append(answer_rel)
+                else:
+                    # Предпосылки и вопрос объединяем в одну строку.
+                    left_parts = []
+                    for premise in premises:
+                        s = ' '.join(text_utils.tokenize(premise))
+                        if s[-1] not in '.?!':
+                            s = s + ' .'
+                        left_parts.append(s)
+
+                    left_parts.append(question_str)
+                    pending.append((len(results), len(answers), ' '.join(left_parts)))
+
+                    # Текст ответа будет подставлен после декодирования.
+                    answers.append(None)
+                    answer_rels.append(group_rel)
+
+            results.append((answers, answer_rels))
+
+        if pending:
+            answer_strs = self.decode_answers([left_str for _, _, left_str in pending])
+            for (iquery, ianswer, _), answer_str in zip(pending, answer_strs):
+                results[iquery][0][ianswer] = answer_str
+
+        return results
+
+    def decode_answers(self, left_strs):
+        # Каждая строка матрицы заполняется с нуля, хвост более длинной строки не попадает в следующую.
+        X = np.zeros((len(left_strs), self.seq_len), dtype=np.int32)
+        for irow, left_str in enumerate(left_strs):
+            left_tokens = self.bpe_model.EncodeAsPieces(left_str)[:self.seq_len]
+            for itoken, token in enumerate(left_tokens):
+                X[irow, itoken] = self.token2index.get(token, 0)
+
+        y_pred = self.predictor.predict(X)
+        y_pred = np.argmax(y_pred, axis=-1)
+
+        answer_strs = []
+        for row in y_pred:
+            tokens = [self.index2token[itok] for itok in row]
+            answer_strs.append(''.join(tokens).replace('▁', ' ').strip())
+
+        return answer_strs
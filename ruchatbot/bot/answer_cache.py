@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Кэш готовых ответов на вопросы, которые не зависят от собеседника.
+
+Популярные вопросы к боту (про его имя, возраст, FAQ и т.д.) задают разные пользователи,
+и для каждого заново выполняются поиск в FAQ, определение достаточности предпосылок,
+подбор релевантного факта и генерация ответа. Если при построении ответа не использовались
+ни факты конкретного собеседника, ни динамические факты (текущее время и т.п.), то ответ
+можно сохранить и выдавать повторно. Ключ включает версии базы фактов и FAQ, поэтому после
+перезагрузки этих файлов старые ответы не используются и вытесняются по LRU.
+"""
+
+import collections
+import threading
+import time
+
+
+class AnswerCache(object):
+    """
+    LRU-кэш с ограничением времени жизни записей и счетчиками обращений.
+    """
+    def __init__(self, max_size=10000, ttl=3600.0):
+        """
+        :param max_size: максимальное число хранимых ответов
+        :param ttl: время жизни записи в секундах
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()  # ключ => (время сохранения, ответы, достоверности)
+        self.lock = threading.Lock()
+        self.nb_hits = 0
+        self.nb_misses = 0
+        self.nb_stored = 0
+        self.nb_uncacheable = 0
+
+    @staticmethod
+    def make_key(bot_id, interpretation, person, facts_version, faq_version):
+        normalized = u' '.join(interpretation.lower().split())
+        return bot_id, normalized, person, facts_version, faq_version
+
+    def get(self, key):
+        """
+        :return: кортеж (ответы, достоверности) или None, если ответа в кэше нет
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if time.time() - entry[0] < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.nb_hits += 1
+                    return list(entry[1]), list(entry[2])
+                del self.entries[key]
+
+            self.nb_misses += 1
+            return None
+
+    def put(self, key, answers, answer_rels):
+        with self.lock:
+            self.entries[key] = (time.time(), tuple(answers), tuple(answer_rels))
+            self.entries.move_to_end(key)
+            self.nb_stored += 1
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def mark_uncacheable(self):
+        """Учет ответов, которые нельзя кэшировать, так как они зависят от собеседника"""
+        with self.lock:
+            self.nb_uncacheable += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        with self.lock:
+            nb_lookups = self.nb_hits + self.nb_misses
+            return {'size': len(self.entries),
+                    'hits': self.nb_hits,
+                    'misses': self.nb_misses,
+                    'stored': self.nb_stored,
+                    'uncacheable': self.nb_uncacheable,
+                    'hit_rate': float(self.nb_hits) / nb_lookups if nb_lookups else 0.0}
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from collections import deque
+from collections import deque, Counter
 
 
 class BaseDialogSession(object):
@@ -8,6 +8,12 @@ class BaseDialogSession(object):
     Хранилище оперативных данных для диалоговой сессии с одним собеседником.
     Персистентность реализуется производными классами.
     """
+
+    # Для скольких последних фраз истории сохраняются результаты анализа (токены, теги).
+    # Интерпретатор и правила обращаются только к последним фразам, у более старых
+    # остается только текст и модальность. Последняя реплика собеседника и последняя
+    # реплика бота не сжимаются никогда, как бы давно они ни были произнесены.
+    ANALYSIS_WINDOW = 3
     def __init__(self, bot_id, interlocutor, facts_storage):
         """
         Инициализация новой диалоговой сессии для нового собеседника.
@@ -21,8 +27,17 @@ class BaseDialogSession(object):
         self.facts_storage = facts_storage
         self.answer_buffer = []
         self.conversation_history = []  # все фразы беседы
+        self.max_history = None  # сколько последних фраз беседы хранить, None - все
+        self.nb_added_phrases = 0  # сколько всего фраз добавлено в историю после ее сброса
+        self.history_epoch = 0  # увеличивается при каждом сбросе истории
+
+        # Индексы по истории беседы, обновляются при добавлении фраз, чтобы частые запросы
+        # к истории не требовали ее просмотра.
+        self.bot_phrase_counts = Counter()  # текст фразы бота => сколько раз бот ее произносил
+        self.bot_phrases = deque()  # (номер фразы в истории, фраза бота)
+        self.interlocutor_phrases = deque()  # (номер фразы в истории, фраза собеседника)
 
-        self.activated_rules = []  # правила-обработчики, сработавшие (рекурсивно) в ходе обработки реплики собеседника
+        self.activated_rules = set()  # правила-обработчики, сработавшие (рекурсивно) в ходе обработки реплики собеседника
 
         self.status = None  # экземпляр производного от RunningDialogStatus класса,
                             # если выполняется вербальная форма или сценарий
@@ -31,6 +46,13 @@ class BaseDialogSession(object):
         self.slots = dict()  # переменные состояния
 
 
+    def __getstate__(self):
+        # Хранилище фактов общее для всех сессий бота и не сериализуется вместе с сессией,
+        # после загрузки сессии его устанавливает фабрика сессий.
+        state = self.__dict__.copy()
+        state['facts_storage'] = None
+        return state
+
     def get_interlocutor(self):
         return self.interlocutor
 
@@ -60,18 +82,82 @@ class BaseDialogSession(object):
 
         # сбрасываем инфу о сработавших правилах, так как явно закончилась обработка предыдущей
         # реплики собеседника.
-        self.activated_rules = []
+        self.activated_rules = set()
 
         if len(self.answer_buffer) == 0:
             return u''
 
         return self.answer_buffer.pop(0)
 
+    def set_max_history(self, max_history):
+        self.max_history = max_history
+        self.trim_history()
+
+    def trim_history(self):
+        if self.max_history is not None and len(self.conversation_history) > self.max_history:
+            nb_removed = len(self.conversation_history) - self.max_history
+            for item in self.conversation_history[:nb_removed]:
+                # Удаляются самые старые фразы, поэтому в индексах они стоят первыми.
+                if item.is_bot_phrase:
+                    self.bot_phrases.popleft()
+                    self.bot_phrase_counts[item.interpretation] -= 1
+                    if self.bot_phrase_counts[item.interpretation] == 0:
+                        del self.bot_phrase_counts[item.interpretation]
+                else:
+                    self.interlocutor_phrases.popleft()
+            del self.conversation_history[:nb_removed]
+
+    def index_phrase(self, seq, interpreted_phrase):
+        if interpreted_phrase.is_bot_phrase:
+            self.bot_phrases.append((seq, interpreted_phrase))
+            self.bot_phrase_counts[interpreted_phrase.interpretation] += 1
+        else:
+            self.interlocutor_phrases.append((seq, interpreted_phrase))
+
+    def set_history(self, phrases):
+        """
+        Замена истории беседы (например, при загрузке сессии из хранилища) с перестроением индексов.
+        Номера фраз отсчитываются так, чтобы последняя фраза имела номер nb_added_phrases-1.
+        """
+        self.conversation_history = list(phrases)
+        self.bot_phrase_counts = Counter()
+        self.bot_phrases = deque()
+        self.interlocutor_phrases = deque()
+        first_seq = self.nb_added_phrases - len(self.conversation_history)
+        for i, item in enumerate(self.conversation_history):
+            self.index_phrase(first_seq + i, item)
+
+        last_bot_phrase = self.get_last_bot_utterance()
+        last_interlocutor_phrase = self.get_last_interlocutor_utterance()
+        for item in self.conversation_history[:-BaseDialogSession.ANALYSIS_WINDOW]:
+            if item is not last_bot_phrase and item is not last_interlocutor_phrase:
+                item.compact()
+        self.trim_history()
+
     def add_phrase_to_history(self, interpreted_phrase):
+        # Предыдущая реплика того же участника перестает быть последней и, если она уже
+        # вне окна анализа, сжимается.
+        if interpreted_phrase.is_bot_phrase:
+            prev_latest = self.bot_phrases[-1] if self.bot_phrases else None
+        else:
+            prev_latest = self.interlocutor_phrases[-1] if self.interlocutor_phrases else None
+
         self.conversation_history.append(interpreted_phrase)
+        self.index_phrase(self.nb_added_phrases, interpreted_phrase)
+        self.nb_added_phrases += 1
+
+        window_start = self.nb_added_phrases - BaseDialogSession.ANALYSIS_WINDOW
+        if prev_latest is not None and prev_latest[0] < window_start:
+            prev_latest[1].compact()
+
+        if len(self.conversation_history) > BaseDialogSession.ANALYSIS_WINDOW:
+            item = self.conversation_history[-BaseDialogSession.ANALYSIS_WINDOW - 1]
+            if item is not self.get_last_bot_utterance() and item is not self.get_last_interlocutor_utterance():
+                item.compact()
+        self.trim_history()
 
     def rule_activated(self, rule):
-        self.activated_rules.append(rule)
+        self.activated_rules.add(rule)
 
     def is_rule_activated(self, rule):
         return rule in self.activated_rules
@@ -83,43 +169,31 @@ class BaseDialogSession(object):
         тому назад была произнесена фраза.
         """
         reslist = []
-        for timegap, item in enumerate(self.conversation_history[::-1]):
-            if not item.is_bot_phrase:
-                if questions and item.is_question:
-                    # добавляем вопрос
-                    reslist.append((item, timegap))
-                elif assertions and not item.is_question:
-                    # добавляем не-вопрос
-                    reslist.append((item, timegap))
-        return reslist[:last_nb]
+        last_seq = self.nb_added_phrases - 1
+        for seq, item in reversed(self.interlocutor_phrases):
+            if len(reslist) >= last_nb:
+                break
+
+            if questions and item.is_question:
+                # добавляем вопрос
+                reslist.append((item, last_seq - seq))
+            elif assertions and not item.is_question:
+                # добавляем не-вопрос
+                reslist.append((item, last_seq - seq))
+        return reslist
 
     def count_bot_phrase(self, phrase_str):
         """Вернет, сколько раз бот уже произносил фразу phrase_str"""
-        n = 0
-        for item in self.conversation_history:
-            if item.is_bot_phrase and item.interpretation == phrase_str:
-                n += 1
-
-        return n
+        return self.bot_phrase_counts.get(phrase_str, 0)
 
     def get_bot_phrases(self):
-        res = []
-        for item in self.conversation_history:
-            if item.is_bot_phrase:
-                res.append(item.interpretation)
-        return res
+        return [item.interpretation for _, item in self.bot_phrases]
 
     def get_last_interlocutor_utterance(self):
-        for item in self.conversation_history[::-1]:
-            if not item.is_bot_phrase:
-                return item
-        return None
+        return self.interlocutor_phrases[-1][1] if self.interlocutor_phrases else None
 
     def get_last_bot_utterance(self):
-        for item in self.conversation_history[::-1]:
-            if item.is_bot_phrase:
-                return item
-        return None
+        return self.bot_phrases[-1][1] if self.bot_phrases else None
 
     def get_last_utterance(self):
         return self.conversation_history[-1] if len(self.conversation_history) > 0 else None
@@ -167,5 +241,7 @@ class BaseDialogSession(object):
         self.slots[slot_name] = slot_value
 
     def reset_history(self):
-        self.conversation_history = []
+        self.nb_added_phrases = 0
+        self.history_epoch += 1
+        self.set_history([])
         self.slots.clear()
@@ -22,6 +22,44 @@ class BaseFactsStorage(object):
         """
         raise NotImplementedError()
 
+    def enumerate_facts_snapshot(self, interlocutor):
+        """
+        Факты для ранжирования моделями.
+        :return: кортеж (список фактов в формате enumerate_facts, ключ списка). Пока состав фактов
+         не меняется, возвращается тот же объект списка с тем же ключом, и модели переиспользуют
+         подготовленные для него индексы (см. phrases_key в RelevancyDetector.get_most_relevant).
+         Ключ None - хранилище не отслеживает изменения, список строится заново.
+        """
+        return list(self.enumerate_facts(interlocutor)), None
+
+    def get_version(self):
+        """
+        Номер версии общих (не привязанных к собеседнику) фактов, меняется при их перезагрузке.
+        Используется в ключах кэша готовых ответов.
+        """
+        return 0
+
+    def has_interlocutor_facts(self, interlocutor):
+        """
+        Есть ли в хранилище приватные факты собеседника. Если хранилище не может
+        это определить, то возвращается True, и ответы собеседнику не кэшируются.
+        """
+        return True
+
+    def is_dynamic_fact(self, fact):
+        """
+        Является ли факт динамическим, то есть меняющимся со временем (текущее время и т.д.)
+        :param fact: кортеж (текст_факта, грамматическое_лицо, уникальная_метка_факта) из enumerate_facts
+        """
+        return True
+
+    def after_fork(self):
+        """
+        Вызывается в рабочем процессе после fork. Хранилища, работающие с базами данных,
+        должны открыть новые соединения вместо унаследованных от родительского процесса.
+        """
+        pass
+
     def enumerate_smalltalk_replicas(self):
         """
         :return: итерируемая последовательность экземпляров класса SmalltalkReplicas.
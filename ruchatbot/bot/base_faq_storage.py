@@ -18,3 +18,15 @@ class BaseFaqStorage(object):
         """
         raise NotImplementedError()
 
+    @abstractmethod
+    def get_questions(self):
+        """Вернет список всех опорных вопросов FAQ"""
+        raise NotImplementedError()
+
+    def get_version(self):
+        """
+        Номер версии содержимого FAQ, меняется при каждой перезагрузке базы.
+        Используется в ключах кэша готовых ответов.
+        """
+        return 0
+
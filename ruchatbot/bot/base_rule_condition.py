@@ -47,6 +47,10 @@ class BaseRuleCondition(object):
     def get_key(self):
         return self.key
 
+    def get_text_etalons(self):
+        """Эталонные тексты, которые условие сравнивает с репликой через check_text"""
+        return []
+
     def check_text(self, input_text, etalon_texts, bot, session, interlocutor, interpreted_phrase, answering_engine):
         if not input_text:
             return False
@@ -137,6 +141,9 @@ class RuleCondition_Text(BaseRuleCondition):
     def get_short_repr(self):
         return 'text etalons[1/{}]="{}" metric={}'.format(len(self.etalons), self.etalons[0], self.metric)
 
+    def get_text_etalons(self):
+        return self.etalons if self.metric == 'synonymy' else []
+
     def check_condition(self, bot, session, interlocutor, interpreted_phrase, answering_engine):
         input_text = interpreted_phrase.interpretation
         f = False
@@ -173,6 +180,9 @@ class RuleCondition_RawText(BaseRuleCondition):
     def get_short_repr(self):
         return 'raw_text etalons[1/{}]="{}"'.format(len(self.etalons), self.etalons[0])
 
+    def get_text_etalons(self):
+        return self.etalons
+
     def check_condition(self, bot, session, interlocutor, interpreted_phrase, answering_engine):
         input_text = interpreted_phrase.raw_phrase
         f = self.check_text(input_text, self.etalons, bot, session, interlocutor, interpreted_phrase, answering_engine)
@@ -196,6 +206,9 @@ class RuleCondition_PrevBotText(BaseRuleCondition):
     def get_short_repr(self):
         return 'prev_bot_text etalons[1/{}]="{}"'.format(len(self.etalons), self.etalons[0])
 
+    def get_text_etalons(self):
+        return self.etalons
+
     def check_condition(self, bot, session, interlocutor, interpreted_phrase, answering_engine):
         b = session.get_last_bot_utterance()
         if b:
@@ -19,3 +19,38 @@ class BaseDialogSessionFactory(object):
         :return: класс, производный от BaseDialogSession
         """
         raise NotImplementedError()
+
+    def get_session(self, bot, interlocutor_id):
+        """
+        Получение объекта сессии для пары бот - собеседник.
+        :param bot: экземпляр класса BotPersonality
+        :param interlocutor_id: уникальный строковый идентификатор собеседника
+        :return: класс, производный от BaseDialogSession
+        """
+        raise NotImplementedError()
+
+    def lock_session(self, bot, interlocutor_id):
+        """
+        Контекстный менеджер для монопольной работы с сессией собеседника на время
+        обработки реплики. Фабрики, хранящие сессии только в памяти процесса, ничего не блокируют.
+        """
+        return NullSessionLock()
+
+    def after_fork(self):
+        """Вызывается в рабочем процессе после fork"""
+        pass
+
+    def store_session(self, session):
+        """
+        Сохранение изменений сессии после обработки реплики. Фабрики, хранящие сессии
+        только в памяти процесса, ничего не делают.
+        """
+        pass
+
+
+class NullSessionLock(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
@@ -127,3 +127,6 @@ class BotPersonality:
 
     def does_bot_know_answer(self, question, session, interlocutor):
         return self.engine.does_bot_know_answer(question, self, session, interlocutor)
+
+    def does_bot_know_answers(self, questions, session, interlocutor):
+        return self.engine.does_bot_know_answers(questions, self, session, interlocutor)
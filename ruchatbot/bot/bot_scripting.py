@@ -232,6 +232,38 @@ class BotScripting(object):
     def get_continuation_rules(self):
         return self.continuation_rules
 
+    def get_text_etalons(self, text_utils):
+        """
+        Эталонные фразы правил, которые сравниваются с репликами моделью синонимичности, в том
+        виде, в каком они передаются в get_most_similar. Детектор синонимичности может заранее
+        вычислить для них векторы.
+        """
+        rules = list(self.insteadof_rules)
+        rules.extend(rule for _, rule in self.story_rules.keyphrase_rules)
+        rules.extend(self.continuation_rules.rules)
+        smalltalk_rules = [self.smalltalk_rules]
+        for scenario in self.scenarios:
+            if scenario.insteadof_rules:
+                rules.extend(scenario.insteadof_rules)
+            if scenario.smalltalk_rules:
+                smalltalk_rules.append(scenario.smalltalk_rules)
+
+        etalons = []
+        for rule in rules:
+            etalons.extend(rule.get_text_etalons())
+        for rules1 in smalltalk_rules:
+            for rule in rules1.enumerate_complex_rules():
+                etalons.extend(rule.condition.get_text_etalons())
+
+        # Условия проверяются в check_text, который сравнивает с репликой нормализованные эталоны.
+        res = [text_utils.wordize_text(etalon) for etalon in etalons]
+
+        # Текстовые smalltalk-правила сопоставляются по тексту условия как есть.
+        for rules1 in smalltalk_rules:
+            res.extend(rule.get_condition_text() for rule in rules1.enumerate_text_rules())
+
+        return res
+
     def reset_usage_stat(self):
         """сбрасываем счетчики использования и т.д., как будто сценарии и правила не срабатывали"""
         for s in self.scenarios:
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Скомпилированная база фактов профиля.
+
+Файл фактов (например, profile_facts_1.dat) заранее прогоняется через NLP-конвейер
+командой ruchatbot/preparation/compile_facts.py, результат сохраняется рядом с исходным
+файлом с расширением .compiled. В нем хранятся канонический текст фактов, токены, леммы,
+тегсеты и id шинглов для моделей градиентного бустинга, а также контрольная сумма
+исходного файла, констант профиля и конфигов моделей. При старте бота файл отображается
+в память, так что лемматизация и разбор строк на сервере не выполняются.
+
+Формат файла: сигнатура, затем сырые данные массивов numpy, затем заголовок в json
+с описанием массивов и в конце 8 байт со смещением заголовка.
+"""
+
+import hashlib
+import io
+import json
+import os
+import struct
+
+import numpy as np
+
+
+COMPILED_FACTS_SIGNATURE = b'RCBFACTS'
+COMPILED_FACTS_VERSION = 1
+
+# Конфиги моделей, признаки которых сохраняются в скомпилированной базе.
+MODEL_CONFIGS = ['lgb_relevancy.config', 'lgb_synonymy.config']
+
+
+def get_compiled_facts_path(facts_path):
+    return facts_path + '.compiled'
+
+
+def calc_facts_checksum(facts_path, constants, models_folder):
+    """
+    Контрольная сумма для проверки актуальности скомпилированной базы: меняется при
+    изменении файла фактов, констант профиля или конфигов моделей (словарей шинглов).
+    """
+    h = hashlib.sha1()
+    h.update(str(COMPILED_FACTS_VERSION).encode('utf-8'))
+    with open(facts_path, 'rb') as f:
+        h.update(f.read())
+    h.update(json.dumps(constants, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    for config_name in MODEL_CONFIGS:
+        config_path = os.path.join(models_folder, config_name)
+        if os.path.exists(config_path):
+            h.update(config_name.encode('utf-8'))
+            with open(config_path, 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+class CompiledFactsBuilder(object):
+    """Накопление данных для записи скомпилированной базы фактов"""
+    def __init__(self):
+        self.string2id = dict()
+        self.strings = []
+        self.facts = []  # (id текста, id лица, id метки)
+        self.tokens = []
+        self.lemmas = []
+        self.tags = []
+        self.shingles = dict()  # id модели => список массивов id шинглов
+
+    def intern(self, s):
+        i = self.string2id.get(s)
+        if i is None:
+            i = len(self.strings)
+            self.string2id[s] = i
+            self.strings.append(s)
+        return i
+
+    def add_fact(self, fact, tokens, lemmas, tags):
+        self.facts.append(tuple(self.intern(s) for s in fact))
+        self.tokens.append([self.intern(s) for s in tokens])
+        self.lemmas.append([self.intern(s) for s in lemmas])
+        self.tags.append([self.intern(s) for s in tags])
+
+    def add_shingles(self, model_id, shingle_ids):
+        self.shingles.setdefault(model_id, []).append(np.asarray(shingle_ids, dtype=np.int32))
+
+    @staticmethod
+    def ragged(seqs, dtype):
+        ptr = np.zeros(len(seqs) + 1, dtype=np.int64)
+        ptr[1:] = np.cumsum([len(seq) for seq in seqs])
+        data = np.concatenate([np.asarray(seq, dtype=dtype) for seq in seqs]) if seqs else np.zeros(0, dtype=dtype)
+        return ptr, data.astype(dtype)
+
+    def save(self, path, checksum):
+        arrays = dict()
+        blobs = [s.encode('utf-8') for s in self.strings]
+        arrays['string_ptr'] = np.zeros(len(blobs) + 1, dtype=np.int64)
+        arrays['string_ptr'][1:] = np.cumsum([len(b) for b in blobs])
+        arrays['strings'] = np.frombuffer(b''.join(blobs), dtype=np.uint8)
+        arrays['facts'] = np.array(self.facts, dtype=np.int32).reshape((len(self.facts), 3))
+        arrays['token_ptr'], arrays['tokens'] = CompiledFactsBuilder.ragged(self.tokens, np.int32)
+        arrays['lemma_ptr'], arrays['lemmas'] = CompiledFactsBuilder.ragged(self.lemmas, np.int32)
+        arrays['tag_ptr'], arrays['tags'] = CompiledFactsBuilder.ragged(self.tags, np.int32)
+
+        models = []
+        for imodel, (model_id, shingle_ids) in enumerate(self.shingles.items()):
+            models.append(model_id)
+            ptr, ids = CompiledFactsBuilder.ragged(shingle_ids, np.int32)
+            arrays['shingle_ptr_{}'.format(imodel)] = ptr
+            arrays['shingles_{}'.format(imodel)] = ids
+
+        header = {'version': COMPILED_FACTS_VERSION,
+                  'checksum': checksum,
+                  'nb_facts': len(self.facts),
+                  'models': models,
+                  'arrays': dict()}
+
+        # Пишем во временный файл, чтобы не испортить базу, которую может читать работающий бот.
+        tmp_path = path + '.tmp'
+        with io.open(tmp_path, 'wb') as f:
+            f.write(COMPILED_FACTS_SIGNATURE)
+            for name, arr in arrays.items():
+                offset = f.tell()
+                if offset % 8:
+                    f.write(b'\0' * (8 - offset % 8))
+                    offset = f.tell()
+                arr = np.ascontiguousarray(arr)
+                f.write(arr.tobytes())
+                header['arrays'][name] = {'offset': offset, 'dtype': arr.dtype.str, 'shape': list(arr.shape)}
+
+            header_offset = f.tell()
+            f.write(json.dumps(header, ensure_ascii=False).encode('utf-8'))
+            f.write(struct.pack('<Q', header_offset))
+        os.replace(tmp_path, path)
+
+
+class CompiledFacts(object):
+    """Чтение скомпилированной базы фактов через отображение файла в память"""
+    def __init__(self):
+        self.path = None
+        self.header = None
+        self.arrays = dict()
+        self.facts = None
+
+    @staticmethod
+    def read_header(path):
+        with io.open(path, 'rb') as f:
+            if f.read(len(COMPILED_FACTS_SIGNATURE)) != COMPILED_FACTS_SIGNATURE:
+                raise RuntimeError(u'File "{}" is not a compiled facts file'.format(path))
+            f.seek(-8, os.SEEK_END)
+            trailer_offset = f.tell()
+            header_offset = struct.unpack('<Q', f.read(8))[0]
+            f.seek(header_offset)
+            return json.loads(f.read(trailer_offset - header_offset).decode('utf-8'))
+
+    @staticmethod
+    def load(path):
+        compiled = CompiledFacts()
+        compiled.path = path
+        compiled.header = CompiledFacts.read_header(path)
+        for name, info in compiled.header['arrays'].items():
+            shape = tuple(info['shape'])
+            if np.prod(shape) == 0:
+                compiled.arrays[name] = np.zeros(shape, dtype=np.dtype(info['dtype']))
+            else:
+                compiled.arrays[name] = np.memmap(path, dtype=np.dtype(info['dtype']), mode='r',
+                                                  offset=info['offset'], shape=shape)
+
+        # Сами факты нужны при каждом запросе, поэтому их тексты декодируем сразу.
+        blob = compiled.arrays['strings'].tobytes()
+        ptr = compiled.arrays['string_ptr'].tolist()
+        compiled.facts = [tuple(blob[ptr[i]:ptr[i + 1]].decode('utf-8') for i in fact)
+                          for fact in compiled.arrays['facts'].tolist()]
+        return compiled
+
+    def get_checksum(self):
+        return self.header['checksum']
+
+    def __len__(self):
+        return self.header['nb_facts']
+
+    def get_string(self, istring):
+        ptr = self.arrays['string_ptr']
+        return self.arrays['strings'][ptr[istring]:ptr[istring + 1]].tobytes().decode('utf-8')
+
+    def get_strings(self, ptr_name, data_name, ifact):
+        ptr = self.arrays[ptr_name]
+        return [self.get_string(i) for i in self.arrays[data_name][ptr[ifact]:ptr[ifact + 1]].tolist()]
+
+    def get_facts(self):
+        """
+        :return: список кортежей (текст_факта, лицо, метка_факта)
+        """
+        return self.facts
+
+    def get_tokens(self, ifact):
+        return self.get_strings('token_ptr', 'tokens', ifact)
+
+    def get_lemmas(self, ifact):
+        return self.get_strings('lemma_ptr', 'lemmas', ifact)
+
+    def get_tags(self, ifact):
+        return self.get_strings('tag_ptr', 'tags', ifact)
+
+    def get_shingle_ids(self, model_id):
+        """
+        Вернет список отсортированных массивов id шинглов фактов для модели model_id
+        (значение model_filename из конфига модели) или None, если таких данных в файле нет.
+        """
+        if model_id not in self.header['models']:
+            return None
+
+        imodel = self.header['models'].index(model_id)
+        ptr = self.arrays['shingle_ptr_{}'.format(imodel)]
+        ids = self.arrays['shingles_{}'.format(imodel)]
+        return [ids[ptr[i]:ptr[i + 1]] for i in range(len(self))]
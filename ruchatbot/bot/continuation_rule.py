@@ -46,13 +46,16 @@ class ContinuationAction:
 
             if session.count_bot_phrase(utterance) == 0:
                 # Такую фразу еще не использовали
-                if utterance[-1] == '?':
-                    # Проверим, что бот еще не знает ответ на этот вопрос:
-                    if bot.does_bot_know_answer(utterance, session, interlocutor):
-                        continue
-
                 new_utterances.append(utterance)
 
+        # Проверим, что бот еще не знает ответы на вопросы. Все вопросы проверяем за один раз.
+        questions = [utterance for utterance in new_utterances if utterance[-1] == '?']
+        if questions:
+            known_questions = set(question for question, known
+                                  in zip(questions, bot.does_bot_know_answers(questions, session, interlocutor))
+                                  if known)
+            new_utterances = [utterance for utterance in new_utterances if utterance not in known_questions]
+
         if len(new_utterances) > 0:
             # Выбираем одну из оставшихся фраз.
             if len(new_utterances) == 1:
@@ -87,6 +90,9 @@ class ContinuationRule(object):
             s = 'ContinuationRule condition={}'.format(str(self.condition))
         return s
 
+    def get_text_etalons(self):
+        return self.condition.get_text_etalons()
+
     def execute(self, bot, session, interlocutor, interpreted_phrase, answering_engine):
         condition_check = self.condition.check_condition(bot, session, interlocutor, interpreted_phrase, answering_engine)
         if condition_check.success:
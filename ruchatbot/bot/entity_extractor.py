@@ -18,6 +18,7 @@ from keras_contrib.losses import crf_loss
 from keras_contrib.metrics import crf_viterbi_accuracy
 
 from ruchatbot.utils.padding_utils import PAD_WORD, lpad_wordseq, rpad_wordseq
+from ruchatbot.utils.batch_predictor import BatchingPredictor
 
 
 class EntityExtractor(object):
@@ -51,16 +52,16 @@ class EntityExtractor(object):
                 model = model_from_json(f.read(), {'CRF': CRF})
 
             model.load_weights(weights_path)
-            self.models[int(index)] = model
-
-        self.X_probe = np.zeros((1, self.max_inputseq_len, self.word_dims), dtype='float32')
+            # Одновременные запросы из разных потоков выполняются одним вызовом модели.
+            self.models[int(index)] = BatchingPredictor(model)
 
         pass
 
     def extract_entity(self, entity_name, phrase, text_utils, embeddings):
         model = self.models[self.entity2index[entity_name]]
 
-        self.X_probe.fill(0)
+        # Входной тензор создается для каждого вызова, так как метод вызывается из нескольких потоков.
+        X_probe = np.zeros((1, self.max_inputseq_len, self.word_dims), dtype='float32')
 
         words = text_utils.tokenize(phrase)
         if self.padding == 'right':
@@ -68,12 +69,12 @@ class EntityExtractor(object):
         else:
             words = lpad_wordseq(words, self.max_inputseq_len)
 
-        embeddings.vectorize_words(self.w2v_filename, words, self.X_probe, 0)
+        embeddings.vectorize_words(self.w2v_filename, words, X_probe, 0)
 
         inputs = dict()
-        inputs['input'] = self.X_probe
+        inputs['input'] = X_probe
 
-        y = model.predict(x=inputs)[0]
+        y = model.predict(inputs)[0]
         predicted_labels = np.argmax(y, axis=-1)
 
         selected_words = [word for word, label in zip(words, predicted_labels) if label == 1]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Индекс FAQ базы для быстрого поиска ответа.
+
+Вопросы собеседников чаще всего дословно или почти дословно (с точностью до регистра,
+пунктуации, пробелов и буквы ё) повторяют опорные вопросы FAQ. Для таких вопросов ответ
+находится по хэшу нормализованного текста без вызова модели синонимичности.
+"""
+
+import re
+
+
+class FaqIndex(object):
+    """
+    Неизменяемый после построения индекс: вопросы, ответы, отображение номера вопроса
+    на номер ответа, хэш нормализованных вопросов и готовый список кандидатов для детектора
+    синонимичности.
+    """
+    def __init__(self, questions, answers):
+        """
+        :param questions: список опорных вопросов
+        :param answers: список ответов той же длины (ответ для каждого вопроса)
+        """
+        self.questions = list(questions)
+        self.answers = []
+        self.question2answer = []
+        answer2id = dict()
+        for answer in answers:
+            answer_id = answer2id.get(answer)
+            if answer_id is None:
+                answer_id = len(self.answers)
+                answer2id[answer] = answer_id
+                self.answers.append(answer)
+            self.question2answer.append(answer_id)
+
+        # Если один и тот же вопрос встречается несколько раз, то используется первое вхождение.
+        self.question2id = dict()
+        self.normalized2id = dict()
+        for iquestion, question in enumerate(self.questions):
+            self.question2id.setdefault(question, iquestion)
+            self.normalized2id.setdefault(FaqIndex.normalize_question(question), iquestion)
+
+        # Кандидаты для детектора синонимичности создаются один раз, а не на каждый запрос.
+        self.candidates = [(question, None, None) for question in self.questions]
+
+    @staticmethod
+    def normalize_question(question):
+        return u' '.join(re.findall(r'\w+', question.lower().replace(u'ё', u'е')))
+
+    def __len__(self):
+        return len(self.questions)
+
+    def get_answer(self, iquestion):
+        return self.answers[self.question2answer[iquestion]]
+
+    def find_exact(self, question):
+        """
+        Поиск опорного вопроса, совпадающего с question после нормализации.
+        :return: номер вопроса или None
+        """
+        return self.normalized2id.get(FaqIndex.normalize_question(question))
+
+    def get_question_id(self, question):
+        return self.question2id[question]
@@ -2,10 +2,23 @@
 """
 Базовый класс для реализации вариантов детектора релевантности и синонимичности,
 использующих градиентный бустинг и разреженные матрицы шинглов.
+
+18-10-2026 Кэширование id шинглов для проверяемых фраз, чтобы не лемматизировать заново всю базу фактов на каждом запросе
+18-10-2026 Матрица признаков для всего батча пар строится сразу в формате CSR вместо поэлементной записи в lil_matrix
+18-10-2026 Опциональный отбор кандидатов по инвертированному индексу шинглов перед ранжированием моделью
+18-10-2026 Пакетная оценка нескольких проверяемых фраз по одному списку предпосылок (get_most_relevant_many)
+18-10-2026 LRU-кэш оценок пар фраз между репликами, модель вызывается только для новых пар
+18-10-2026 Загрузка id шинглов фактов из скомпилированной базы фактов (preload_compiled_facts)
+18-10-2026 Индекс шинглов кэшируется под ключом списка фраз, который передает вызывающий код
 """
 
-from scipy.sparse import lil_matrix
+from collections import OrderedDict
+from scipy.sparse import csr_matrix
+import numpy as np
 import logging
+import threading
+
+from ruchatbot.bot.shingle_index import ShingleIndex
 
 
 class GB_BaseDetector(object):
@@ -24,39 +37,198 @@ class GB_BaseDetector(object):
         # для LightGBM должен быть 'float32'
         self.x_matrix_type = '<<unknown>>'
 
+        # Кэш признаков фраз: текст фразы => отсортированный массив id известных модели шинглов.
+        # Факты профиля, вопросы FAQ и ключевые фразы правил почти не меняются, поэтому
+        # токенизация и лемматизация для них выполняется один раз, а не на каждом запросе.
+        self.phrase2shingle_ids = OrderedDict()
+        self.max_cached_phrases = 100000
+
+        # Двухстадийный поиск: если задано кол-во кандидатов, то моделью ранжируются только
+        # фразы, отобранные по инвертированному индексу шинглов. None - ранжируются все фразы.
+        self.nb_prefilter_candidates = None
+
+        # Индексы для списков фраз (вопросы FAQ, факты): ключ списка, переданный вызывающим кодом =>
+        # (список фраз, ShingleIndex). Индекс годится, пока с ключом передается тот же объект списка.
+        self.phrase_indexes = OrderedDict()
+        self.max_cached_indexes = 16
+
+        # Кэш оценок модели: (проверяемая фраза, предпосылка, id модели) => оценка.
+        # Собеседники постоянно повторяют одни и те же короткие реплики, а база вопросов FAQ
+        # и эталонов правил статична, поэтому повторные пары не надо прогонять через модель.
+        # Размер кэша задается в конфиге модели ключом max_cached_scores, 0 отключает кэш.
+        self.model_id = None
+        self.score_cache = OrderedDict()
+        self.max_cached_scores = 100000
+        self.score_cache_hits = 0
+        self.score_cache_misses = 0
+
+        # Детектор вызывается из нескольких потоков, все обращения к кэшам выполняются под этой блокировкой.
+        self.cache_lock = threading.Lock()
+
     def init_model_params(self, model_config):
         self.xgb_relevancy_shingle2id = model_config['shingle2id']
         self.xgb_relevancy_shingle_len = model_config['shingle_len']
         self.xgb_relevancy_nb_features = model_config['nb_features']
         self.xgb_relevancy_lemmatize = model_config['lemmatize']
+        self.nb_prefilter_candidates = model_config.get('nb_prefilter_candidates')
+        self.max_cached_scores = model_config.get('max_cached_scores', self.max_cached_scores)
+        self.model_id = model_config.get('model_filename')
+
+        # закэшированные признаки получены с прежними shingle_len, lemmatize и shingle2id.
+        with self.cache_lock:
+            self.phrase2shingle_ids.clear()
+            self.phrase_indexes.clear()
+            self.score_cache.clear()
 
     def normalize_qline(self, phrase):
         return phrase.replace(u'?', u' ').replace(u'!', u' ').strip()
 
-    def calc_relevancy1(self, premise, question, text_utils, predictor_func):
-        """Вернет оценку достоверности того, что две заданные фразы релевантны"""
-        X_data = lil_matrix((1, self.xgb_relevancy_nb_features), dtype=self.x_matrix_type)
+    def get_phrase_shingle_ids(self, phrase, text_utils):
+        """
+        Вернет отсортированный массив id шинглов фразы phrase. Неизвестные модели
+        шинглы в векторизацию не попадают, поэтому сразу отбрасываются.
+        Результат запоминается в LRU-кэше, так что повторно пересчитываются
+        только новые или измененные фразы (например, добавленные через store_new_fact).
+        """
+        with self.cache_lock:
+            shingle_ids = self.phrase2shingle_ids.get(phrase)
+            if shingle_ids is not None:
+                self.phrase2shingle_ids.move_to_end(phrase)
+                return shingle_ids
 
         if self.xgb_relevancy_lemmatize:
-            premise_words = text_utils.tokenize(self.normalize_qline(premise))
-            question_words = text_utils.tokenize(self.normalize_qline(question))
+            words = text_utils.lemmatize(self.normalize_qline(phrase))
         else:
-            premise_words = text_utils.lemmatize(self.normalize_qline(premise))
-            question_words = text_utils.lemmatize(self.normalize_qline(question))
+            words = text_utils.tokenize(self.normalize_qline(phrase))
 
-        premise_wx = text_utils.words2str(premise_words)
-        question_wx = text_utils.words2str(question_words)
+        wx = text_utils.words2str(words)
+        ids = set()
+        for shingle in set(text_utils.ngrams(wx, self.xgb_relevancy_shingle_len)):
+            if shingle in self.xgb_relevancy_shingle2id:
+                ids.add(self.xgb_relevancy_shingle2id[shingle])
+            else:
+                self.unknown_shingle(shingle)
 
-        premise_shingles = set(text_utils.ngrams(premise_wx, self.xgb_relevancy_shingle_len))
-        question_shingles = set(text_utils.ngrams(question_wx, self.xgb_relevancy_shingle_len))
+        shingle_ids = np.array(sorted(ids), dtype=np.int32)
+        with self.cache_lock:
+            self.phrase2shingle_ids[phrase] = shingle_ids
+            if len(self.phrase2shingle_ids) > self.max_cached_phrases:
+                self.phrase2shingle_ids.popitem(last=False)
 
-        self.xgb_relevancy_vectorize_sample_x(X_data, 0, premise_shingles, question_shingles,
-                                              self.xgb_relevancy_shingle2id)
+        return shingle_ids
 
-        y_probe = predictor_func(X_data)
-        return y_probe[0]
+    def preload_compiled_facts(self, compiled_facts):
+        """
+        Заносим в кэш id шинглов фактов, посчитанные при компиляции базы фактов для этой модели,
+        чтобы не лемматизировать факты на сервере.
+        """
+        facts_shingle_ids = compiled_facts.get_shingle_ids(self.model_id)
+        if facts_shingle_ids is None:
+            self.logger.warning(u'Compiled facts contain no shingles for model "%s"', self.model_id)
+            return
+
+        with self.cache_lock:
+            for (fact_text, _, _), shingle_ids in zip(compiled_facts.get_facts(), facts_shingle_ids):
+                if len(self.phrase2shingle_ids) >= self.max_cached_phrases:
+                    break
+                self.phrase2shingle_ids[fact_text] = shingle_ids
+
+    def build_shingle_index(self, phrases, text_utils):
+        shingle_ids = []
+        for phrase, _, _ in phrases:
+            if phrase is None or len(phrase) == 0:
+                raise ValueError()
+            shingle_ids.append(self.get_phrase_shingle_ids(phrase, text_utils))
+        return ShingleIndex(shingle_ids)
 
-    def get_most_relevant(self, probe_phrase, phrases, text_utils, predictor_func, nb_results=1):
+    def get_shingle_index(self, phrases, text_utils, phrases_key=None):
+        """
+        Вернет инвертированный индекс шинглов для списка фраз phrases. Если задан ключ списка
+        phrases_key, то индекс строится один раз и переиспользуется, пока с этим ключом передается
+        тот же объект списка. Проверка сводится к сравнению ссылок, так что поиск по большой базе
+        не требует просмотра всего списка на каждом запросе.
+        """
+        if phrases_key is None:
+            return self.build_shingle_index(phrases, text_utils)
+
+        with self.cache_lock:
+            item = self.phrase_indexes.get(phrases_key)
+            if item is not None and item[0] is phrases:
+                self.phrase_indexes.move_to_end(phrases_key)
+                return item[1]
+
+        # Индекс строится без блокировки, одновременно построенные индексы одинаковы.
+        index = self.build_shingle_index(phrases, text_utils)
+        with self.cache_lock:
+            self.phrase_indexes[phrases_key] = (phrases, index)
+            self.phrase_indexes.move_to_end(phrases_key)
+            if len(self.phrase_indexes) > self.max_cached_indexes:
+                self.phrase_indexes.popitem(last=False)
+
+        return index
+
+    def prefilter_phrases(self, question_ids, phrases, text_utils, nb_candidates, phrases_key=None):
+        """
+        Первая стадия поиска: оставляем не более nb_candidates фраз из phrases, имеющих
+        наибольшее пересечение по шинглам с вопросом. Если ни одна фраза не имеет общих
+        шинглов с вопросом, то возвращается исходный список.
+        """
+        if len(phrases) <= nb_candidates:
+            return phrases
+
+        index = self.get_shingle_index(phrases, text_utils, phrases_key)
+        icandidates = index.find_candidates(question_ids, nb_candidates)
+        if len(icandidates) == 0:
+            return phrases
+
+        return [phrases[i] for i in icandidates]
+
+    def get_cached_score(self, key):
+        """
+        Вернет ранее вычисленную оценку для пары фраз или None, если пары нет в кэше.
+        """
+        with self.cache_lock:
+            score = self.score_cache.get(key)
+            if score is None:
+                self.score_cache_misses += 1
+            else:
+                self.score_cache_hits += 1
+                self.score_cache.move_to_end(key)
+            return score
+
+    def store_score(self, key, score):
+        if self.max_cached_scores > 0:
+            with self.cache_lock:
+                self.score_cache[key] = score
+                while len(self.score_cache) > self.max_cached_scores:
+                    self.score_cache.popitem(last=False)
+
+    def get_score_cache_stats(self):
+        """Счетчики попаданий в кэш оценок - для мониторинга и логов"""
+        with self.cache_lock:
+            nb_lookups = self.score_cache_hits + self.score_cache_misses
+            hit_rate = self.score_cache_hits / float(nb_lookups) if nb_lookups else 0.0
+            return {'hits': self.score_cache_hits,
+                    'misses': self.score_cache_misses,
+                    'hit_rate': hit_rate,
+                    'size': len(self.score_cache)}
+
+    def calc_relevancy1(self, premise, question, text_utils, predictor_func):
+        """Вернет оценку достоверности того, что две заданные фразы релевантны"""
+        key = (question, premise, self.model_id)
+        score = self.get_cached_score(key)
+        if score is None:
+            premise_ids = self.get_phrase_shingle_ids(premise, text_utils)
+            question_ids = self.get_phrase_shingle_ids(question, text_utils)
+            X_data = self.xgb_relevancy_vectorize_batch([premise_ids], [question_ids])
+
+            y_probe = predictor_func(X_data)
+            score = y_probe[0]
+            self.store_score(key, score)
+
+        return score
+
+    def get_most_relevant(self, probe_phrase, phrases, text_utils, predictor_func, nb_results=1, phrases_key=None):
         """
         Поиск наиболее релевантной предпосыл(ки|ок) или ближайшего синонима с помощью одной из моделей,
         использующей градиентный бустинг (XGBoost, LightGBM).
@@ -67,48 +239,71 @@ class GB_BaseDetector(object):
         :param predictor_func - функция, которая принимает X_data с векторизацией пар фраз и возвращает результат модели
         :param nb_results - кол-во возвращаемых результатов, по умолчанию возвращается одна
          наиболее релевантная запись
+        :param phrases_key - ключ списка phrases для кэширования индекса шинглов, см. get_shingle_index
 
         :return если nb_results=1, то вернется кортеж с двумя полями ('текст лучшей предпосылки', оценка_релевантности),
         в противном случае возвращается кортеж с двумя полями - список предпосылок, отсортированный по убыванию
         релевантности и список соответствующих релевантностей.
         """
 
-        # НАЧАЛО ОТЛАДКИ
-        #phrases = []
-        #phrases.append((u'меня зовут кеша', None, None))
-        # КОНЕЦ ОТЛАДКИ
-
-        nb_answers = len(phrases)
-        X_data = lil_matrix((nb_answers, self.xgb_relevancy_nb_features), dtype=self.x_matrix_type)
-
-        # Единственный вопрос готовим заранее
-        if self.xgb_relevancy_lemmatize:
-            question_words = text_utils.lemmatize(self.normalize_qline(probe_phrase))
-        else:
-            question_words = text_utils.tokenize(self.normalize_qline(probe_phrase))
-
-        question_wx = text_utils.words2str(question_words)
-        question_shingles = set(text_utils.ngrams(question_wx, self.xgb_relevancy_shingle_len))
-
-        # все предпосылки из текущей базы фактов векторизуем в один тензор, чтобы
-        # прогнать его через классификатор разом.
-        for ipremise, (premise, premise_person, phrase_code) in enumerate(phrases):
-            if premise is None or len(premise) == 0:
-                raise ValueError()
-
-            if self.xgb_relevancy_lemmatize:
-                premise_words = text_utils.lemmatize(self.normalize_qline(premise))
-            else:
-                premise_words = text_utils.tokenize(self.normalize_qline(premise))
-
-            premise_wx = text_utils.words2str(premise_words)
-            premise_shingles = set(text_utils.ngrams(premise_wx, self.xgb_relevancy_shingle_len))
+        return self.get_most_relevant_many([probe_phrase], phrases, text_utils, predictor_func, nb_results, phrases_key)[0]
 
-            self.xgb_relevancy_vectorize_sample_x(X_data, ipremise, premise_shingles, question_shingles,
-                                                  self.xgb_relevancy_shingle2id)
-
-        y_probe = predictor_func(X_data)
+    def get_most_relevant_many(self, probe_phrases, phrases, text_utils, predictor_func, nb_results=1, phrases_key=None):
+        """
+        Пакетный вариант get_most_relevant для нескольких проверяемых фраз и одного списка предпосылок.
+        Предпосылки векторизуются однажды, все пары проверяемая_фраза*предпосылка оцениваются
+        одним вызовом predictor_func.
 
+        :param probe_phrases - список юникодных строк-вопросов
+        :return список результатов для каждой фразы из probe_phrases в том же формате, что
+         у метода get_most_relevant
+        """
+        # Оценки пар, уже встречавшихся в прошлых репликах, берем из кэша. Все остальные
+        # пары вопрос-предпосылка собираем в один тензор, чтобы прогнать его через классификатор разом.
+        probe_candidates = []
+        probe_scores = []
+        miss_keys = []
+        miss_slots = []
+        premises_ids = []
+        questions_ids = []
+        for probe_phrase in probe_phrases:
+            question_ids = self.get_phrase_shingle_ids(probe_phrase, text_utils)
+
+            candidates = phrases
+            if self.nb_prefilter_candidates:
+                candidates = self.prefilter_phrases(question_ids, phrases, text_utils,
+                                                    max(self.nb_prefilter_candidates, nb_results), phrases_key)
+
+            # Фразы, отсеянные предварительным отбором, уже проверены при построении индекса.
+            scores = np.zeros(len(candidates))
+            for icandidate, (premise, _, _) in enumerate(candidates):
+                if premise is None or len(premise) == 0:
+                    raise ValueError()
+
+                key = (probe_phrase, premise, self.model_id)
+                score = self.get_cached_score(key)
+                if score is None:
+                    miss_keys.append(key)
+                    miss_slots.append((scores, icandidate))
+                    premises_ids.append(self.get_phrase_shingle_ids(premise, text_utils))
+                    questions_ids.append(question_ids)
+                else:
+                    scores[icandidate] = score
+
+            probe_candidates.append(candidates)
+            probe_scores.append(scores)
+
+        if miss_keys:
+            X_data = self.xgb_relevancy_vectorize_batch(premises_ids, questions_ids)
+            y_probe = predictor_func(X_data)
+            for key, (scores, icandidate), score in zip(miss_keys, miss_slots, y_probe):
+                scores[icandidate] = score
+                self.store_score(key, score)
+
+        return [self.select_best(candidates, scores, nb_results)
+                for candidates, scores in zip(probe_candidates, probe_scores)]
+
+    def select_best(self, phrases, y_probe, nb_results):
         reslist = []
         for ipremise, (premise, premise_person, phrase_code) in enumerate(phrases):
             sim = y_probe[ipremise]
@@ -117,8 +312,6 @@ class GB_BaseDetector(object):
         # сортируем результаты в порядке убывания релевантности.
         reslist = sorted(reslist, key=lambda z: -z[1])
 
-        best_premise = ''
-        best_rels = None
         if nb_results == 1:
             # возвращаем единственную запись с максимальной релевантностью.
             best_premise = reslist[0][0]
@@ -126,7 +319,7 @@ class GB_BaseDetector(object):
             return best_premise, best_rel
         else:
             # возвращаем заданное кол-во наиболее релевантных записей.
-            n = min(nb_results, nb_answers)
+            n = min(nb_results, len(reslist))
             best_premises = [reslist[i][0] for i in range(n)]
             best_rels = [reslist[i][1] for i in range(n)]
             return best_premises, best_rels
@@ -135,35 +328,42 @@ class GB_BaseDetector(object):
         # self.logger.error(u'Shingle "{}" is unknown'.format(shingle))
         pass
 
-    def xgb_relevancy_vectorize_sample_x(self, X_data, idata,
-                                         premise_shingles, question_shingles,
-                                         shingle2id):
-        # для внутреннего использования - векторизация предпосылки и вопроса.
-        ps = set(premise_shingles)
-        qs = set(question_shingles)
-        common_shingles = ps & qs
-        notmatched_ps = ps - qs
-        notmatched_qs = qs - ps
-
-        nb_shingles = len(shingle2id)
-
-        icol = 0
-        for shingle in common_shingles:
-            if shingle not in shingle2id:
-                self.unknown_shingle(shingle)
-            else:
-                X_data[idata, icol + shingle2id[shingle]] = True
-
-        icol += nb_shingles
-        for shingle in notmatched_ps:
-            if shingle not in shingle2id:
-                self.unknown_shingle(shingle)
-            else:
-                X_data[idata, icol + shingle2id[shingle]] = True
-
-        icol += nb_shingles
-        for shingle in notmatched_qs:
-            if shingle not in shingle2id:
-                self.unknown_shingle(shingle)
-            else:
-                X_data[idata, icol + shingle2id[shingle]] = True
+    def xgb_relevancy_vectorize_batch(self, premises_ids, questions_ids):
+        """
+        Векторизация батча пар предпосылка-вопрос, заданных массивами id шинглов.
+        Матрица признаков собирается сразу в виде массивов indices/indptr/data для csr_matrix:
+        первые nb_shingles столбцов - общие шинглы, затем шинглы только предпосылки,
+        затем шинглы только вопроса.
+
+        :param premises_ids - список отсортированных массивов id шинглов предпосылок
+        :param questions_ids - список такой же длины с массивами id шинглов вопросов
+        :return scipy.sparse.csr_matrix размером (кол-во пар, nb_features)
+        """
+        nb_shingles = len(self.xgb_relevancy_shingle2id)
+        nb_rows = len(premises_ids)
+
+        p_lens = np.fromiter((len(ids) for ids in premises_ids), dtype=np.int64, count=nb_rows)
+        q_lens = np.fromiter((len(ids) for ids in questions_ids), dtype=np.int64, count=nb_rows)
+        p_rows = np.repeat(np.arange(nb_rows, dtype=np.int64), p_lens)
+        q_rows = np.repeat(np.arange(nb_rows, dtype=np.int64), q_lens)
+        p_ids = np.concatenate(premises_ids).astype(np.int64) if nb_rows else np.zeros(0, dtype=np.int64)
+        q_ids = np.concatenate(questions_ids).astype(np.int64) if nb_rows else np.zeros(0, dtype=np.int64)
+
+        # Составной ключ (строка, шингл) позволяет выполнить пересечение и разность множеств
+        # шинглов для всех пар одним вызовом.
+        p_keys = p_rows * nb_shingles + p_ids
+        q_keys = q_rows * nb_shingles + q_ids
+        p_in_q = np.isin(p_keys, q_keys, assume_unique=True)
+        q_in_p = np.isin(q_keys, p_keys, assume_unique=True)
+
+        rows = np.concatenate((p_rows[p_in_q], p_rows[~p_in_q], q_rows[~q_in_p]))
+        cols = np.concatenate((p_ids[p_in_q], nb_shingles + p_ids[~p_in_q], 2*nb_shingles + q_ids[~q_in_p]))
+
+        # Стабильная сортировка по номеру строки сохраняет возрастание номеров столбцов внутри строки.
+        order = np.argsort(rows, kind='stable')
+        indices = cols[order].astype(np.int32)
+        indptr = np.zeros(nb_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=nb_rows), out=indptr[1:])
+        data = np.ones(len(indices), dtype=self.x_matrix_type)
+
+        return csr_matrix((data, indices, indptr), shape=(nb_rows, self.xgb_relevancy_nb_features))
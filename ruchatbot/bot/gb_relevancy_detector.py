@@ -33,11 +33,21 @@ class GB_RelevancyDetector(RelevancyDetector):
         self.engine.x_matrix_type = self.x_matrix_type
         self.engine.init_model_params(model_config)
 
+    def preload_compiled_facts(self, compiled_facts):
+        self.engine.preload_compiled_facts(compiled_facts)
+
     def calc_relevancy1(self, premise, question, text_utils):
         return self.engine.calc_relevancy1(premise, question, text_utils,
                                            predictor_func=lambda X_data: self.predict_by_model(X_data))
 
-    def get_most_relevant(self, probe_phrase, phrases, text_utils, nb_results=1):
+    def get_most_relevant(self, probe_phrase, phrases, text_utils, nb_results=1, phrases_key=None):
         return self.engine.get_most_relevant(probe_phrase, phrases, text_utils,
                                              predictor_func=lambda X_data: self.predict_by_model(X_data),
-                                             nb_results=nb_results)
+                                             nb_results=nb_results,
+                                             phrases_key=phrases_key)
+
+    def get_most_relevant_many(self, probe_phrases, phrases, text_utils, nb_results=1, phrases_key=None):
+        return self.engine.get_most_relevant_many(probe_phrases, phrases, text_utils,
+                                                  predictor_func=lambda X_data: self.predict_by_model(X_data),
+                                                  nb_results=nb_results,
+                                                  phrases_key=phrases_key)
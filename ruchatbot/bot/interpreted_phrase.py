@@ -1,19 +1,73 @@
 # -*- coding: utf-8 -*-
+"""
+18-10-2026 Компактное представление: __slots__, интернирование повторяющихся строк (интенты,
+           токены, тегсеты, леммы), сброс тяжелых полей для старых фраз истории, сериализация кортежем.
+"""
+
+import sys
 
 from ruchatbot.bot.modality_detector import ModalityDetector
 
 
+def intern_strings(items):
+    return tuple((sys.intern(s) if type(s) is str else s) for s in items)
+
+
 class InterpretedPhrase:
+    # Экземпляры хранятся в истории каждой сессии, поэтому без __dict__.
+    __slots__ = ('is_bot_phrase', 'raw_phrase', 'interpretation', '_raw_tokens', 'is_question',
+                 'is_imperative', '_intents', 'person', '_tags')
+
     def __init__(self, raw_phrase):
         self.is_bot_phrase = False
         self.raw_phrase = raw_phrase
         self.interpretation = raw_phrase
-        self.raw_tokens = None
+        self._raw_tokens = None
         self.is_question = None
         self.is_imperative = None
-        self.intents = None
+        self._intents = None
         self.person = None
-        self.tags = None
+        self._tags = None
+
+    @property
+    def raw_tokens(self):
+        return self._raw_tokens
+
+    @raw_tokens.setter
+    def raw_tokens(self, raw_tokens):
+        self._raw_tokens = None if raw_tokens is None else intern_strings(raw_tokens)
+
+    @property
+    def intents(self):
+        return self._intents
+
+    @intents.setter
+    def intents(self, intents):
+        self._intents = None if intents is None else intern_strings(intents)
+
+    @property
+    def tags(self):
+        return self._tags
+
+    @tags.setter
+    def tags(self, tags):
+        # Элементы - кортежи (слово, тегсет, лемма), тегсеты и леммы сильно повторяются.
+        self._tags = None if tags is None else tuple(intern_strings(tag) for tag in tags)
+
+    def compact(self):
+        """
+        Сброс результатов анализа, которые нужны только для свежих фраз (правилам и интерпретатору).
+        Вызывается для фраз, вышедших за пределы контекстного окна истории диалога.
+        """
+        self._raw_tokens = None
+        self._tags = None
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in InterpretedPhrase.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(InterpretedPhrase.__slots__, state):
+            setattr(self, name, value)
 
     def set_modality(self, modality, person):
         self.person = person
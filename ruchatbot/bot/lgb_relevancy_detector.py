@@ -2,14 +2,17 @@
 """
 28-07-2020 Преобразование входной матрицы в scipy.sparse.csr_matrix перед вызовом predict, чтобы не вылезало
            уродливое предупреждение UserWarning: Converting data to scipy sparse matrix.
+18-10-2026 Входная матрица сразу строится движком в формате csr_matrix, преобразование больше не нужно.
+18-10-2026 Опциональное вычисление деревьев через SparseBinaryForest, включается в конфиге
+           модели ключом "inference": "sparse_forest".
 """
 
 import json
 import os
 import logging
 import lightgbm
-import scipy
 
+from ruchatbot.bot.sparse_forest import SparseBinaryForest
 from ruchatbot.bot.gb_relevancy_detector import GB_RelevancyDetector
 
 
@@ -22,6 +25,7 @@ class LGB_RelevancyDetector(GB_RelevancyDetector):
         super(LGB_RelevancyDetector, self).__init__()
         self.logger = logging.getLogger('LGB_RelevancyDetector')
         self.x_matrix_type = 'float32'
+        self.sparse_forest = None
 
     def load(self, models_folder):
         self.logger.info('Loading LGB_RelevancyDetector model files')
@@ -34,6 +38,15 @@ class LGB_RelevancyDetector(GB_RelevancyDetector):
         self.logger.info(u'Loading LightGBM model from {}'.format(model_filepath))
         self.lgb_relevancy = lightgbm.Booster(model_file=model_filepath)
 
+        # Для бинарных признаков шинглов деревья можно вычислять без lightgbm, проверяя только
+        # активные признаки каждой строки.
+        if model_config.get('inference', 'lightgbm') == 'sparse_forest':
+            self.logger.info(u'Exporting LightGBM trees to SparseBinaryForest')
+            self.sparse_forest = SparseBinaryForest.from_booster(self.lgb_relevancy)
+
     def predict_by_model(self, X_data):
-        y_pred = self.lgb_relevancy.predict(scipy.sparse.csr_matrix(X_data))
+        if self.sparse_forest is not None:
+            return self.sparse_forest.predict(X_data)
+
+        y_pred = self.lgb_relevancy.predict(X_data)
         return y_pred
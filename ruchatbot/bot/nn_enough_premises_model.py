@@ -11,6 +11,7 @@ import tensorflow as tf  # 13-05-2019
 
 
 from ruchatbot.bot.enough_premises_model import EnoughPremisesModel
+from ruchatbot.utils.batch_predictor import BatchingPredictor
 
 
 class NN_EnoughPremisesModel(EnoughPremisesModel):
@@ -50,46 +51,44 @@ class NN_EnoughPremisesModel(EnoughPremisesModel):
 
         self.graph = tf.get_default_graph() # эксперимент с багом 13-05-2019
 
+        # Одновременные запросы из разных потоков выполняются одним вызовом модели.
+        self.predictor = BatchingPredictor(self.model, self.graph)
+
         # начало отладки
         #self.model.summary()
         # конец отладки
 
         self.w2v_filename = os.path.basename(self.w2v_path)
 
-        self.Xn_probe = []
+    def is_enough(self, premise_str_list, question_str, text_utils):
+        assert(len(premise_str_list) <= self.max_nb_premises)
+        assert(len(question_str) > 0)
+
+        # Входные тензоры создаются для каждого вызова, так как метод вызывается из нескольких потоков.
+        Xn_probe = []
         for _ in range(self.max_nb_premises+1):
             x = np.zeros((1, self.max_inputseq_len, self.word_dims), dtype=np.float32)
-            self.Xn_probe.append(x)
+            Xn_probe.append(x)
 
-        self.inputs = dict()
+        inputs = dict()
         for ipremise in range(self.max_nb_premises):
-            self.inputs['premise{}'.format(ipremise)] = self.Xn_probe[ipremise]
-        self.inputs['question'] = self.Xn_probe[self.max_nb_premises]
+            inputs['premise{}'.format(ipremise)] = Xn_probe[ipremise]
+        inputs['question'] = Xn_probe[self.max_nb_premises]
 
-    def is_enough(self, premise_str_list, question_str, text_utils):
-        assert(len(premise_str_list) <= self.max_nb_premises)
-        assert(len(question_str) > 0)
+        # Заполняем входные тензоры векторами слов предпосылок и вопроса.
+        pad_func = text_utils.rpad_wordseq if self.padding == 'right' else text_utils.lpad_wordseq
+        premises_words = [pad_func(text_utils.tokenize(premise), self.max_inputseq_len) for premise in premise_str_list]
+        question_words = pad_func(text_utils.tokenize(question_str), self.max_inputseq_len)
 
-        # Очищаем содержимое входных тензоров от результатов предыдущего расчета
-        for i in range(self.max_nb_premises+1):
-            self.Xn_probe[i].fill(0)
+        # Векторы новых слов из всех фраз строим одним вызовом модели wordchar2vector.
+        text_utils.word_embeddings.build_oov_vectors([word for words in premises_words for word in words] + question_words)
 
-        # Заполняем входные тензоры векторами слов предпосылок и вопроса.
-        for ipremise, premise in enumerate(premise_str_list):
-            if self.padding == 'right':
-                words = text_utils.rpad_wordseq(text_utils.tokenize(premise), self.max_inputseq_len)
-            else:
-                words = text_utils.lpad_wordseq(text_utils.tokenize(premise), self.max_inputseq_len)
-            text_utils.word_embeddings.vectorize_words(self.w2v_filename, words, self.Xn_probe[ipremise], 0)
-
-        if self.padding == 'right':
-            words = text_utils.rpad_wordseq(text_utils.tokenize(question_str), self.max_inputseq_len)
-        else:
-            words = text_utils.lpad_wordseq(text_utils.tokenize(question_str), self.max_inputseq_len)
-        text_utils.word_embeddings.vectorize_words(self.w2v_filename, words, self.Xn_probe[self.max_nb_premises], 0)
-
-        with self.graph.as_default():
-            y = self.model.predict(x=self.inputs)[0]
+        for ipremise, words in enumerate(premises_words):
+            text_utils.word_embeddings.vectorize_words(self.w2v_filename, words, Xn_probe[ipremise], 0)
+
+        text_utils.word_embeddings.vectorize_words(self.w2v_filename, question_words, Xn_probe[self.max_nb_premises], 0)
+
+        y = self.predictor.predict(inputs)[0]
 
         p_enough = y[0]
         return p_enough
@@ -7,6 +7,8 @@
 07-06-2020 Полная переделка на новую модель интерпретации (seq2seq with attention)
 20-06-2020 Добавка шаблонной модели knn-1
 28-07-2020 Исправление ошибки с потерей tf-сессии
+18-10-2026 Одновременные вызовы модели из разных потоков объединяются в батч (BatchingPredictor)
+18-10-2026 Индекс шаблонов knn-1 модели, полное сопоставление выполняется только для кандидатов из индекса
 """
 
 import os
@@ -26,6 +28,7 @@ import sentencepiece as spm
 from ruchatbot.layers.attention_decoder import AttentionDecoder
 
 from ruchatbot.bot.base_utterance_interpreter2 import BaseUtteranceInterpreter2
+from ruchatbot.utils.batch_predictor import BatchingPredictor
 
 
 class Sample(object):
@@ -45,7 +48,9 @@ class NN_InterpreterNew2(BaseUtteranceInterpreter2):
         self.token2index = None
         self.seq_len = None
         self.templates = None
+        self.templates_index = None
         self.graph = None
+        self.predictor = None
 
     def load(self, models_folder):
         self.logger.info('Loading NN_InterpreterNew2 model files')
@@ -55,6 +60,7 @@ class NN_InterpreterNew2(BaseUtteranceInterpreter2):
         # Эталонные экземпляры для knn-1 модели
         with open(os.path.join(models_folder, 'interpreter_templates2.bin'), 'rb') as f:
             self.templates = pickle.load(f)
+        self.build_templates_index()
 
         # Файлы нейросетевой модели интерпретации
         with open(os.path.join(models_folder, 'nn_seq2seq_interpreter.config'), 'r') as f:
@@ -68,6 +74,7 @@ class NN_InterpreterNew2(BaseUtteranceInterpreter2):
                 self.model = model_from_json(f.read(), {'AttentionDecoder': AttentionDecoder})
 
             self.model.load_weights(weights_file)
+            self.predictor = BatchingPredictor(self.model, self.graph)
 
             self.bpe_model = spm.SentencePieceProcessor()
             rc = self.bpe_model.Load(os.path.join(models_folder, bpe_model_name + '.model'))
@@ -82,6 +89,42 @@ class NN_InterpreterNew2(BaseUtteranceInterpreter2):
 
         super(NN_InterpreterNew2, self).load(models_folder)
 
+    @staticmethod
+    def get_template_shape(lines):
+        return tuple(len(line) for line in lines)
+
+    def build_templates_index(self):
+        """
+        Шаблон может сопоставиться только с контекстом, у которого такое же число фраз и такое же
+        число значимых токенов в каждой фразе, а токены, проверяемые в шаблоне буквально, должны
+        совпасть со словоформами контекста. Поэтому шаблоны индексируются по числу токенов в
+        фразах и по одному из буквальных токенов: ключ (shape, номер фразы, позиция токена, словоформа).
+        Шаблоны без буквальных токенов попадают в список с ключом (shape, None).
+        В списках хранятся порядковые номера шаблонов, чтобы сохранить приоритет шаблонов
+        при нескольких сопоставлениях.
+        """
+        self.templates_index = dict()
+        for itemplate, template in enumerate(self.templates):
+            lines = template[0]
+            shape = NN_InterpreterNew2.get_template_shape(lines)
+            key = (shape, None)
+            for iline, line in enumerate(lines):
+                literal_pos = next((pos for pos, item in enumerate(line) if item[1] is None), None)
+                if literal_pos is not None:
+                    key = (shape, iline, literal_pos, line[literal_pos][0])
+                    break
+
+            self.templates_index.setdefault(key, []).append(itemplate)
+
+    def find_candidate_templates(self, context):
+        shape = NN_InterpreterNew2.get_template_shape(context)
+        candidates = list(self.templates_index.get((shape, None), []))
+        for iline, line in enumerate(context):
+            for pos, token in enumerate(line):
+                candidates.extend(self.templates_index.get((shape, iline, pos, token[0]), []))
+
+        return sorted(candidates)
+
     def vectorize_samples(self, samples, text_utils):
         nb_samples = len(samples)
         X1 = np.zeros((nb_samples, self.seq_len), dtype=np.int32)
@@ -192,7 +235,8 @@ class NN_InterpreterNew2(BaseUtteranceInterpreter2):
 
         # Сначала пробуем knn-1 модель, ищем подходящий шаблон
         context2 = [self.prepare_context_line(s, text_utils) for s in phrases]
-        for it, template in enumerate(self.templates):
+        for it in self.find_candidate_templates(context2):
+            template = self.templates[it]
             matching = self.match_template(template[0], context2)
             if matching:
                 # теперь собираем выходную строку, используя сопоставленные ключевые слова и шаблон
@@ -204,8 +248,7 @@ class NN_InterpreterNew2(BaseUtteranceInterpreter2):
             samples = [Sample(context_phrases, short_phrase)]
             X_data = self.vectorize_samples(samples, text_utils)
 
-            with self.graph.as_default():
-                y_pred = self.model.predict(x=X_data, verbose=0)
+            y_pred = self.predictor.predict(X_data)
 
             y_pred = np.argmax(y_pred[0], axis=-1)
             tokens = [self.index2token[itok] for itok in y_pred]
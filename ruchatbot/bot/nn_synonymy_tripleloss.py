@@ -1,15 +1,20 @@
 # -*- coding: utf-8 -*-
+"""
+18-10-2026 Векторы эталонных фраз хранятся в PhraseVectorsIndex, при поиске моделью кодируется только пробная фраза.
+18-10-2026 Индекс содержит только статичные эталонные фразы, векторы прочих фраз хранятся в ограниченном LRU-кэше
+"""
 
 import json
 import os
 import logging
-import itertools
-import operator
+import threading
+import collections
 import numpy as np
 
 from keras.models import model_from_json
 
-from synonymy_detector import SynonymyDetector
+from ruchatbot.bot.synonymy_detector import SynonymyDetector
+from ruchatbot.bot.phrase_vectors_index import PhraseVectorsIndex
 
 
 class NN_SynonymyTripleLoss(SynonymyDetector):
@@ -20,6 +25,14 @@ class NN_SynonymyTripleLoss(SynonymyDetector):
     def __init__(self):
         super(NN_SynonymyTripleLoss, self).__init__()
         self.logger = logging.getLogger('NN_SynonymyTripleLoss')
+        self.index = PhraseVectorsIndex()
+        self.index_path = None
+        self.weights_signature = None
+
+        # Векторы фраз, которых нет в индексе (реплики бота, факты собеседника и т.д.)
+        self.phrase2vector = collections.OrderedDict()
+        self.max_cached_vectors = 10000
+        self.cache_lock = threading.Lock()
 
     def load(self, models_folder):
         self.logger.info('Loading NN_SynonymyTripleLoss model files')
@@ -33,6 +46,8 @@ class NN_SynonymyTripleLoss(SynonymyDetector):
             self.model = model_from_json(f.read())
 
         self.model.load_weights(weights_path)
+        st = os.stat(weights_path)
+        self.weights_signature = [os.path.basename(weights_path), st.st_size, int(st.st_mtime)]
 
         self.max_wordseq_len = self.model_config['max_wordseq_len']
         self.w2v_path = self.model_config['w2v_path']
@@ -43,6 +58,14 @@ class NN_SynonymyTripleLoss(SynonymyDetector):
 
         self.w2v_filename = os.path.basename(self.w2v_path)
 
+        # Заранее посчитанные векторы эталонных фраз, если они были сохранены через save_index
+        self.index_path = os.path.join(models_folder, 'nn_synonymy_tripleloss.index')
+        self.index = PhraseVectorsIndex()
+        if PhraseVectorsIndex.exists(self.index_path):
+            if not self.index.load(self.index_path, self.weights_signature):
+                # Модель переобучена, векторы будут вычислены заново в precompute.
+                self.index = PhraseVectorsIndex()
+
     @staticmethod
     def v_cosine(a, b):
         denom = (np.linalg.norm(a) * np.linalg.norm(b))
@@ -51,50 +74,98 @@ class NN_SynonymyTripleLoss(SynonymyDetector):
         else:
             return 0
 
-    def get_most_similar(self, probe_phrase, phrases, text_utils, word_embeddings, nb_results=1):
-        assert(nb_results > 0)
-        assert(len(probe_phrase) != 0)
-
-        # начало отладки
-        # phrases = [(u'как тебя зовут', 0), (u'сварить зеленый чай', 0)]
-        # конец отладки
-
-        all_phrases = list(itertools.chain(map(operator.itemgetter(0), phrases), [probe_phrase]))
-        nb_phrases = len(all_phrases)
+    def encode_phrases(self, phrases, text_utils):
+        """
+        Вычисляем моделью векторы для списка фраз за один вызов predict.
+        """
+        nb_phrases = len(phrases)
         X_data = np.zeros((nb_phrases, self.max_wordseq_len, self.word_dims), dtype=np.float32)
         pad_func = text_utils.lpad_wordseq if self.padding == 'left' else text_utils.rpad_wordseq
 
-        for iphrase, phrase in enumerate(all_phrases):
+        for iphrase, phrase in enumerate(phrases):
             words = pad_func(text_utils.tokenize(phrase), self.max_wordseq_len)
-            word_embeddings.vectorize_words(self.w2v_filename, words, X_data, iphrase)
-
-        y_pred = self.model.predict(x=X_data, verbose=0)
-
-        # Теперь для каждой фразы мы знаем вектор
-        phrase2v = dict()
-        for i in range(nb_phrases):
-            phrase = all_phrases[i]
-            v = y_pred[i]
-            phrase2v[phrase] = v
-
-        # Можем оценить близость введенной фразы к каждой из эталонных фраз из списка
-        phrase_rels = []
-        v1 = phrase2v[probe_phrase]
-        for phrase2 in phrases:
-            v2 = phrase2v[phrase2[0]]
-            rel = NN_SynonymyTripleLoss.v_cosine(v1, v2)
-            phrase_rels.append((phrase2[0], rel))
-
-        phrase_rels = sorted(phrase_rels, key=lambda z: -z[1])
-
-        if nb_results == 1:
-            # возвращаем единственную запись с максимальной похожестью.
-            best_premise = phrase_rels[0][0]
-            best_rel = phrase_rels[0][1]
-            return best_premise, best_rel
+            text_utils.word_embeddings.vectorize_words(self.w2v_filename, words, X_data, iphrase)
+
+        return self.model.predict(x=X_data, verbose=0)
+
+    def add_to_index(self, phrases, text_utils):
+        """
+        Добавляем в индекс векторы фраз, которых там еще нет.
+        :return кол-во добавленных фраз
+        """
+        new_phrases = list(set(phrase for phrase in phrases if phrase not in self.index))
+        if new_phrases:
+            self.index.add(new_phrases, self.encode_phrases(new_phrases, text_utils))
+        return len(new_phrases)
+
+    def precompute(self, phrases, text_utils):
+        """
+        Векторы вопросов FAQ, эталонов правил и ключевых фраз историй вычисляются один раз
+        и сохраняются рядом с моделью, при следующем запуске индекс просто отображается в память.
+        """
+        if self.add_to_index(phrases, text_utils) > 0:
+            self.index.save(self.index_path, self.weights_signature)
+
+    def get_most_similar(self, probe_phrase, phrases, text_utils, nb_results=1, phrases_key=None):
+        return self.get_most_similar_many([probe_phrase], phrases, text_utils, nb_results)[0]
+
+    def get_most_similar_many(self, probe_phrases, phrases, text_utils, nb_results=1, phrases_key=None):
+        assert(nb_results > 0)
+        assert(all(len(probe_phrase) != 0 for probe_phrase in probe_phrases))
+
+        if not phrases:
+            # Сравнивать не с чем, модель не вызываем.
+            empty_result = (None, 0.0) if nb_results == 1 else ([], [])
+            return [empty_result for _ in probe_phrases]
+
+        # Векторы эталонов берутся из индекса, векторы прочих фраз - из LRU-кэша. Пробные фразы
+        # и фразы, которых нет ни там, ни там, кодируются моделью за один вызов predict.
+        phrase_texts = [phrase[0] for phrase in phrases]
+        rows = self.index.get_rows(phrase_texts)
+        is_missing = rows < 0
+        if not is_missing.any():
+            probe_vectors = self.encode_phrases(probe_phrases, text_utils)
+            similarities = self.index.calc_similarities(probe_vectors, rows)
         else:
-            # возвращаем заданное кол-во наиболее похожих записей.
-            n = min(nb_results, nb_results)
-            best_premises = [phrase_rels[i][0] for i in range(n)]
-            best_rels = [phrase_rels[i][1] for i in range(n)]
-            return best_premises, best_rels
+            missing_texts = [phrase for phrase, missing in zip(phrase_texts, is_missing) if missing]
+            missing_vectors = dict()
+            with self.cache_lock:
+                for phrase in missing_texts:
+                    v = self.phrase2vector.get(phrase)
+                    if v is not None:
+                        self.phrase2vector.move_to_end(phrase)
+                        missing_vectors[phrase] = v
+
+            new_texts = list(set(phrase for phrase in missing_texts if phrase not in missing_vectors))
+            vectors = self.encode_phrases(probe_phrases + new_texts, text_utils)
+            probe_vectors = vectors[:len(probe_phrases)]
+            if new_texts:
+                new_vectors = PhraseVectorsIndex.normalize(vectors[len(probe_phrases):])
+                with self.cache_lock:
+                    for phrase, v in zip(new_texts, new_vectors):
+                        missing_vectors[phrase] = v
+                        self.phrase2vector[phrase] = v
+                    while len(self.phrase2vector) > self.max_cached_vectors:
+                        self.phrase2vector.popitem(last=False)
+
+            phrase_vectors = np.zeros((len(phrase_texts), probe_vectors.shape[1]), dtype=np.float32)
+            if not is_missing.all():
+                phrase_vectors[~is_missing] = self.index.get_vectors(rows[~is_missing])
+            phrase_vectors[is_missing] = np.array([missing_vectors[phrase] for phrase in missing_texts])
+            similarities = np.dot(PhraseVectorsIndex.normalize(probe_vectors), phrase_vectors.T)
+
+        results = []
+        for phrase_sims in similarities:
+            top = PhraseVectorsIndex.select_top(phrase_sims, nb_results)
+            if nb_results == 1:
+                # возвращаем единственную запись с максимальной похожестью.
+                results.append((phrase_texts[top[0]], phrase_sims[top[0]]))
+            else:
+                # возвращаем заданное кол-во наиболее похожих записей.
+                results.append(([phrase_texts[i] for i in top], [phrase_sims[i] for i in top]))
+
+        return results
+
+    def calc_synonymy2(self, phrase1, phrase2, text_utils):
+        v1, v2 = self.encode_phrases([phrase1, phrase2], text_utils)
+        return NN_SynonymyTripleLoss.v_cosine(v1, v2)
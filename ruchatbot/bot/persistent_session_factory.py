@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Фабрика сессий, хранящая состояние диалогов во внешнем хранилище (см. session_store.py),
+общем для нескольких процессов бота. Это позволяет обслуживать собеседников несколькими
+процессами за балансировщиком без привязки собеседника к процессу.
+"""
+
+import pickle
+import threading
+
+from ruchatbot.bot.simple_dialog_session_factory import SimpleDialogSessionFactory
+from ruchatbot.bot.running_scenario import RunningScenario
+from ruchatbot.bot.running_form_status import RunningFormStatus
+
+
+class SessionSnapshot(object):
+    """Сохраненное в хранилище состояние сессии, с которым сравнивается текущее при записи"""
+    def __init__(self):
+        self.version = None
+        self.history_epoch = 0
+        self.nb_phrases = 0
+        self.slots = None
+        self.status = None
+        self.answer_buffer = None
+
+
+class PersistentDialogSessionFactory(SimpleDialogSessionFactory):
+    """
+    Сессия загружается из хранилища при первом обращении к ней в процессе, а если ее изменил
+    другой процесс - загружается повторно. После обработки реплики в хранилище записываются
+    только изменившиеся части: новые фразы истории, слоты, стек сценариев и форм, буфер ответов.
+    Обработка реплик одного собеседника сериализуется блокировкой lock_session - как между
+    потоками процесса, так и между процессами через хранилище.
+    """
+    def __init__(self, store, max_sessions=100000, session_ttl=24*3600.0, max_history=200):
+        """
+        :param store: экземпляр класса, производного от BaseSessionStore
+        """
+        super(PersistentDialogSessionFactory, self).__init__(max_sessions, session_ttl, max_history)
+        self.store = store
+        self.snapshots = dict()  # ключ сессии => SessionSnapshot
+        self.session_locks = dict()  # ключ сессии => [RLock, глубина захвата, число ожидающих и владеющих потоков]
+        self.set_session_loader(self.load_session)
+        self.add_eviction_handler(self.forget_session)
+
+    def after_fork(self):
+        self.store.after_fork()
+
+    def lock_session(self, bot, interlocutor_id):
+        return SessionLock(self, SimpleDialogSessionFactory.get_session_key(bot.get_bot_id(), interlocutor_id))
+
+    def get_session(self, bot, interlocutor_id):
+        session_key = SimpleDialogSessionFactory.get_session_key(bot.get_bot_id(), interlocutor_id)
+        if session_key in self.sessions:
+            snapshot = self.snapshots.get(session_key)
+            stored_version = snapshot.version if snapshot is not None else None
+            if self.store.get_version(session_key) != stored_version:
+                # Сессию изменил другой процесс, загрузим ее заново.
+                with self.lock:
+                    self.sessions.pop(session_key, None)
+                    self.snapshots.pop(session_key, None)
+
+        return super(PersistentDialogSessionFactory, self).get_session(bot, interlocutor_id)
+
+    def forget_session(self, session_key, session):
+        # Состояние сессии уже записано в хранилище в store_session.
+        self.snapshots.pop(session_key, None)
+
+    def load_session(self, session_key, bot, interlocutor_id):
+        data = self.store.load(session_key, self.max_history)
+        if data is None:
+            return None
+
+        session = self.create_session(bot, interlocutor_id)
+        session.history_epoch = data['history_epoch']
+        session.nb_added_phrases = data['nb_phrases']
+        session.set_history([pickle.loads(phrase) for phrase in data['history']])
+        if data['slots']:
+            session.slots = pickle.loads(data['slots'])
+        if data['answer_buffer']:
+            session.answer_buffer = pickle.loads(data['answer_buffer'])
+        if data['status']:
+            status, deferred_items = pickle.loads(data['status'])
+            session.status = PersistentDialogSessionFactory.decode_status(bot, status)
+            for item in deferred_items:
+                item = PersistentDialogSessionFactory.decode_status(bot, item)
+                if item is not None:
+                    session.deferred_running_items.append(item)
+
+        snapshot = SessionSnapshot()
+        snapshot.version = data['version']
+        snapshot.history_epoch = data['history_epoch']
+        snapshot.nb_phrases = data['nb_phrases']
+        snapshot.slots = data['slots']
+        snapshot.status = data['status']
+        snapshot.answer_buffer = data['answer_buffer']
+        self.snapshots[session_key] = snapshot
+        return session
+
+    def store_session(self, session):
+        session_key = SimpleDialogSessionFactory.get_session_key(session.bot_id, session.interlocutor)
+        snapshot = self.snapshots.get(session_key)
+        if snapshot is None:
+            snapshot = SessionSnapshot()
+
+        changes = dict()
+        nb_stored = snapshot.nb_phrases
+        if session.history_epoch != snapshot.history_epoch:
+            # История была сброшена.
+            changes['history_epoch'] = session.history_epoch
+            nb_stored = 0
+
+        nb_new = min(session.nb_added_phrases - nb_stored, len(session.conversation_history))
+        if nb_new > 0:
+            first_seq = session.nb_added_phrases - nb_new
+            changes['new_phrases'] = [(first_seq + i, pickle.dumps(phrase, pickle.HIGHEST_PROTOCOL))
+                                      for i, phrase in enumerate(session.conversation_history[-nb_new:])]
+
+        status = (PersistentDialogSessionFactory.encode_status(session.status),
+                  [PersistentDialogSessionFactory.encode_status(item) for item in session.deferred_running_items])
+        parts = {'slots': pickle.dumps(session.slots, pickle.HIGHEST_PROTOCOL),
+                 'status': pickle.dumps(status, pickle.HIGHEST_PROTOCOL),
+                 'answer_buffer': pickle.dumps(session.answer_buffer, pickle.HIGHEST_PROTOCOL)}
+        for part, value in parts.items():
+            if value != getattr(snapshot, part):
+                changes[part] = value
+
+        if not changes:
+            return
+
+        new_snapshot = SessionSnapshot()
+        new_snapshot.version = self.store.save(session_key, changes)
+        new_snapshot.history_epoch = session.history_epoch
+        new_snapshot.nb_phrases = session.nb_added_phrases
+        new_snapshot.slots = parts['slots']
+        new_snapshot.status = parts['status']
+        new_snapshot.answer_buffer = parts['answer_buffer']
+        self.snapshots[session_key] = new_snapshot
+
+    @staticmethod
+    def encode_status(status):
+        """
+        Сценарии и формы принадлежат правилам бота, поэтому в хранилище записываются
+        только их имена и состояние выполнения.
+        """
+        if isinstance(status, RunningScenario):
+            return 'scenario', status.get_name(), status.current_step_index, status.passed_steps
+        elif isinstance(status, RunningFormStatus):
+            current_field = status.current_field.name if status.current_field else None
+            return 'form', status.get_name(), status.phrases, status.fields, current_field
+        else:
+            return None
+
+    @staticmethod
+    def decode_status(bot, data):
+        if data is None or not bot.has_scripting():
+            return None
+
+        scripting = bot.get_scripting()
+        if data[0] == 'scenario':
+            _, name, current_step_index, passed_steps = data
+            for scenario in scripting.scenarios:
+                if scenario.get_name() == name:
+                    status = RunningScenario(scenario, current_step_index)
+                    status.passed_steps = passed_steps
+                    return status
+        elif data[0] == 'form':
+            _, name, phrases, fields, current_field = data
+            for form in scripting.forms:
+                if form.get_name() == name:
+                    field = None
+                    if current_field is not None:
+                        field = next((f for f in form.fields if f.name == current_field), None)
+                    status = RunningFormStatus(form, phrases[0], fields, field)
+                    status.phrases = phrases
+                    return status
+
+        return None
+
+
+class SessionLock(object):
+    """
+    Захват сессии на время обработки реплики. Повторный захват в том же потоке допускается,
+    хранилище захватывается и освобождается только на внешнем уровне.
+    """
+    def __init__(self, factory, session_key):
+        self.factory = factory
+        self.session_key = session_key
+
+    def __enter__(self):
+        with self.factory.lock:
+            item = self.factory.session_locks.get(self.session_key)
+            if item is None:
+                item = [threading.RLock(), 0, 0]
+                self.factory.session_locks[self.session_key] = item
+            item[2] += 1
+
+        item[0].acquire()
+        item[1] += 1
+        if item[1] == 1:
+            try:
+                self.factory.store.lock(self.session_key)
+            except Exception:
+                # Например, SessionLockTimeout - сессию занимает другой процесс.
+                item[1] -= 1
+                self.release(item)
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        item = self.factory.session_locks[self.session_key]
+        item[1] -= 1
+        if item[1] == 0:
+            self.factory.store.unlock(self.session_key)
+        self.release(item)
+        return False
+
+    def release(self, item):
+        with self.factory.lock:
+            item[2] -= 1
+            if item[2] == 0:
+                del self.factory.session_locks[self.session_key]
+            item[0].release()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Индекс векторов фраз для нейросетевых детекторов синонимичности (NN_SynonymyTripleLoss).
+
+Векторы вопросов FAQ, эталонов правил и ключевых фраз историй вычисляются моделью один раз
+и хранятся нормированными, так что косинусная близость сводится к скалярному произведению.
+Сохраненный индекс состоит из двух файлов: матрицы векторов .npy, которая при загрузке
+отображается в память, и .json со списком фраз в том же порядке, что и строки матрицы,
+и сигнатурой модели, которой вычислены векторы.
+"""
+
+import json
+import os
+import logging
+
+import numpy as np
+
+
+class PhraseVectorsIndex(object):
+    def __init__(self):
+        self.logger = logging.getLogger('PhraseVectorsIndex')
+        self.phrase2row = dict()
+        self.phrases = []
+
+        # Векторы загруженного индекса (np.memmap) и векторы фраз, добавленных после загрузки.
+        self.base_vectors = None
+        self.nb_base = 0
+        self.extra_vectors = None
+        self.nb_extra = 0
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def __contains__(self, phrase):
+        return phrase in self.phrase2row
+
+    @staticmethod
+    def get_filepaths(path_prefix):
+        return path_prefix + '.npy', path_prefix + '.json'
+
+    @staticmethod
+    def exists(path_prefix):
+        return all(os.path.exists(p) for p in PhraseVectorsIndex.get_filepaths(path_prefix))
+
+    @staticmethod
+    def normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0.0] = 1.0
+        return vectors / norms
+
+    def load(self, path_prefix, signature=None):
+        """
+        :param signature: сигнатура текущей модели; если индекс сохранен другой моделью, то он не загружается
+        :return: True, если индекс загружен
+        """
+        vectors_path, phrases_path = PhraseVectorsIndex.get_filepaths(path_prefix)
+
+        with open(phrases_path, 'r') as f:
+            data = json.load(f)
+
+        # В индексах старого формата сохранен только список фраз.
+        stored_signature = data.get('signature') if isinstance(data, dict) else None
+        if signature is not None and stored_signature != signature:
+            self.logger.info(u'Phrase vectors "%s" were computed by another model, ignoring them', vectors_path)
+            return False
+
+        self.logger.info(u'Loading phrase vectors from "%s"', vectors_path)
+        phrases = data['phrases'] if isinstance(data, dict) else data
+
+        self.base_vectors = np.load(vectors_path, mmap_mode='r')
+        if self.base_vectors.shape[0] != len(phrases):
+            raise RuntimeError(u'Phrase vectors index "{}" is inconsistent: {} vectors for {} phrases'.format(
+                path_prefix, self.base_vectors.shape[0], len(phrases)))
+
+        self.nb_base = len(phrases)
+        self.extra_vectors = None
+        self.nb_extra = 0
+        self.phrases = phrases
+        self.phrase2row = dict((phrase, row) for row, phrase in enumerate(phrases))
+        return True
+
+    def save(self, path_prefix, signature=None):
+        vectors_path, phrases_path = PhraseVectorsIndex.get_filepaths(path_prefix)
+        self.logger.info(u'Storing %d phrase vectors to "%s"', len(self.phrases), vectors_path)
+
+        # Пишем во временные файлы и подменяем старые, чтобы не испортить отображенную в память матрицу.
+        vectors = self.get_vectors(np.arange(len(self.phrases)))
+        with open(vectors_path + '.tmp', 'wb') as f:
+            np.save(f, vectors)
+        with open(phrases_path + '.tmp', 'w') as f:
+            json.dump({'signature': signature, 'phrases': self.phrases}, f, ensure_ascii=False)
+        os.replace(vectors_path + '.tmp', vectors_path)
+        os.replace(phrases_path + '.tmp', phrases_path)
+
+    def add(self, phrases, vectors):
+        """
+        Добавляем в индекс фразы с их векторами, полученными моделью. Фразы, уже
+        имеющиеся в индексе, пропускаются.
+        """
+        vectors = PhraseVectorsIndex.normalize(vectors)
+        for phrase, v in zip(phrases, vectors):
+            if phrase in self.phrase2row:
+                continue
+
+            if self.extra_vectors is None:
+                self.extra_vectors = np.zeros((16, len(v)), dtype=np.float32)
+            elif self.nb_extra == self.extra_vectors.shape[0]:
+                self.extra_vectors = np.concatenate((self.extra_vectors, np.zeros_like(self.extra_vectors)))
+
+            self.extra_vectors[self.nb_extra] = v
+            self.phrase2row[phrase] = self.nb_base + self.nb_extra
+            self.phrases.append(phrase)
+            self.nb_extra += 1
+
+    def get_rows(self, phrases):
+        """
+        Вернет массив номеров строк индекса для фраз, -1 для фраз, которых в индексе нет.
+        """
+        return np.array([self.phrase2row.get(phrase, -1) for phrase in phrases], dtype=np.int64)
+
+    def get_dim(self):
+        if self.base_vectors is not None:
+            return self.base_vectors.shape[1]
+        if self.extra_vectors is not None:
+            return self.extra_vectors.shape[1]
+        return 0
+
+    def get_vectors(self, rows):
+        if len(rows) == 0:
+            return np.zeros((0, self.get_dim()), dtype=np.float32)
+        if self.nb_extra == 0:
+            return np.asarray(self.base_vectors[rows])
+        if self.nb_base == 0:
+            return self.extra_vectors[rows]
+
+        vectors = np.zeros((len(rows), self.extra_vectors.shape[1]), dtype=np.float32)
+        is_base = rows < self.nb_base
+        vectors[is_base] = self.base_vectors[rows[is_base]]
+        vectors[~is_base] = self.extra_vectors[rows[~is_base] - self.nb_base]
+        return vectors
+
+    def calc_similarities(self, probe_vectors, rows):
+        """
+        Косинусная близость нормированных векторов probe_vectors к фразам индекса в строках rows.
+        :return матрица размером (кол-во проб, len(rows))
+        """
+        if len(rows) == 0:
+            return np.zeros((len(probe_vectors), 0), dtype=np.float32)
+        return np.dot(PhraseVectorsIndex.normalize(probe_vectors), self.get_vectors(rows).T)
+
+    @staticmethod
+    def select_top(similarities, nb_results):
+        """
+        Номера nb_results наибольших значений в порядке убывания. Полная сортировка
+        не нужна, достаточно argpartition и сортировки отобранных элементов.
+        """
+        n = min(nb_results, len(similarities))
+        if n < len(similarities):
+            top = np.argpartition(-similarities, n - 1)[:n]
+        else:
+            top = np.arange(n)
+        return top[np.argsort(-similarities[top], kind='stable')]
@@ -1,10 +1,17 @@
 # -*- coding: utf-8 -*-
+"""
+18-10-2026 Поиск ответа через FaqIndex: точные совпадения вопросов находятся по хэшу без вызова модели
+18-10-2026 Опциональная перезагрузка измененного файла FAQ без рестарта (hot_reload)
+18-10-2026 Номер версии базы для кэша готовых ответов
+"""
 
 import logging
 import io
 
 from ruchatbot.bot.base_faq_storage import BaseFaqStorage
+from ruchatbot.bot.faq_index import FaqIndex
 from ruchatbot.utils.constant_replacer import replace_constant
+from ruchatbot.utils.file_watcher import FileWatcher
 
 
 class PlainFileFaqStorage(BaseFaqStorage):
@@ -12,79 +19,161 @@ class PlainFileFaqStorage(BaseFaqStorage):
     Реализация хранилища FAQ на базе простого текстового файла без разметки.
     См. пример https://github.com/Koziev/chatbot/blob/master/data/faq2.txt
     """
-    def __init__(self, path, constants, text_utils):
+    def __init__(self, path, constants, text_utils, hot_reload=False):
+        """
+        :param hot_reload: при изменении файла FAQ перезагружать его без рестарта бота
+        """
         self.path = path
         self.loaded = False
         self.questions = []
         self.answers = []
+        self.index = None
+        self.version = 0
+        self.parsed_entries = dict()  # сырые строки записи => (вопросы, ответ)
+        self.watcher = FileWatcher(path) if hot_reload else None
         self.constants = constants
         self.text_utils = text_utils
         self.logger = logging.getLogger('PlainFileFaqStorage')
 
     def __load_entries(self):
         if not self.loaded:
+            if self.watcher:
+                self.watcher.mark_loaded()
+            self.reload()
             self.loaded = True
-            self.logger.info(u'Start loading QA entries from "%s"', self.path)
-            with io.open(self.path, 'r', encoding='utf-8') as rdr:
-                for line in rdr:
-                    line = line.strip()
-                    if len(line) > 0:
-                        if line[0] == u'#':
-                            # строки с комментариями начинаются с #
-                            continue
-                        elif line.startswith(u'Q:'):
-                            # Может быть один или несколько вариантов вопросов для одного ответа.
-                            # Строки вопросов начинаются с паттерна "Q:"
-
-                            alt_questions = []
-                            question = line.replace(u'Q:', u'').strip()
-                            assert(len(question) > 0)
-                            alt_questions.append(question)
-
-                            answer_lines = []
-
-                            for line in rdr:
-                                if line.startswith(u'Q:'):
-                                    question = line.replace(u'Q:', u'').strip()
-                                    question = replace_constant(question, self.constants, self.text_utils)
-                                    assert (len(question) > 0)
-                                    alt_questions.append(question)
-                                else:
-                                    answer_lines.append(line.replace(u'A:', u'').strip())
-                                    break
-
-                            # Теперь считываем все строки до первой пустой, считая
-                            # их строками ответа
-                            for line2 in rdr:
-                                line2 = line2.strip()
-                                if len(line2) == 0:
-                                    break
-                                else:
-                                    answer_lines.append(line2.replace(u'A:', u'').strip())
-
-                            answer = u' '.join(answer_lines)
-                            answer = replace_constant(answer, self.constants, self.text_utils)
-                            assert(len(answer) > 0)
-
-                            if answer.startswith('---'):
-                                # для удобства отладки демо-faq'ов, где ответы прописаны как --------
-                                answer = u'<<<<dummy answer for>>> ' + question
-
-                            for question in alt_questions:
-                                self.questions.append(question)
-                                self.answers.append(answer)
-
-            self.logger.info(u'{} QA entries loaded from {}'.format(len(self.questions), self.path))
+        elif self.watcher and self.watcher.try_acquire_change():
+            # Файл изменился. Перезагрузку выполняет только один поток, остальные
+            # продолжают работать со старым индексом до его подмены.
+            reloaded = False
+            try:
+                self.reload()
+                reloaded = True
+            except Exception as ex:
+                self.logger.error(u'Could not reload QA entries from "%s": %s', self.path, ex)
+            finally:
+                self.watcher.release_change(reloaded)
+
+    def read_raw_entries(self):
+        """
+        Читаем из файла записи FAQ в виде кортежей (строки вопросов, строки ответа) без обработки.
+        """
+        raw_entries = []
+        with io.open(self.path, 'r', encoding='utf-8') as rdr:
+            for line in rdr:
+                line = line.strip()
+                if len(line) > 0:
+                    if line[0] == u'#':
+                        # строки с комментариями начинаются с #
+                        continue
+                    elif line.startswith(u'Q:'):
+                        # Может быть один или несколько вариантов вопросов для одного ответа.
+                        # Строки вопросов начинаются с паттерна "Q:"
+                        question_lines = [line]
+                        answer_lines = []
+
+                        for line in rdr:
+                            if line.startswith(u'Q:'):
+                                question_lines.append(line)
+                            else:
+                                answer_lines.append(line)
+                                break
+
+                        # Теперь считываем все строки до первой пустой, считая
+                        # их строками ответа
+                        for line2 in rdr:
+                            line2 = line2.strip()
+                            if len(line2) == 0:
+                                break
+                            else:
+                                answer_lines.append(line2)
+
+                        raw_entries.append((tuple(question_lines), tuple(answer_lines)))
+
+        return raw_entries
+
+    def parse_entry(self, question_lines, answer_lines):
+        """
+        :return: кортеж (список вариантов вопроса, текст ответа)
+        """
+        alt_questions = []
+        question = question_lines[0].replace(u'Q:', u'').strip()
+        assert(len(question) > 0)
+        alt_questions.append(question)
+
+        for line in question_lines[1:]:
+            question = line.replace(u'Q:', u'').strip()
+            question = replace_constant(question, self.constants, self.text_utils)
+            assert (len(question) > 0)
+            alt_questions.append(question)
+
+        answer = u' '.join(line.replace(u'A:', u'').strip() for line in answer_lines)
+        answer = replace_constant(answer, self.constants, self.text_utils)
+        assert(len(answer) > 0)
+
+        if answer.startswith('---'):
+            # для удобства отладки демо-faq'ов, где ответы прописаны как --------
+            answer = u'<<<<dummy answer for>>> ' + question
+
+        return alt_questions, answer
+
+    def reload(self):
+        """
+        Загрузка (или перезагрузка измененного) файла. Заново обрабатываются только новые
+        и измененные записи, тексты остальных записей не меняются, поэтому их признаки
+        остаются в кэшах моделей. Новый индекс подменяет старый одним присваиванием, так
+        что параллельные запросы видят либо старое, либо новое состояние базы целиком.
+        """
+        self.logger.info(u'Start loading QA entries from "%s"', self.path)
+        questions = []
+        answers = []
+        parsed_entries = dict()
+        nb_parsed = 0
+        for raw_entry in self.read_raw_entries():
+            entry = self.parsed_entries.get(raw_entry)
+            if entry is None:
+                entry = self.parse_entry(*raw_entry)
+                nb_parsed += 1
+            parsed_entries[raw_entry] = entry
+
+            alt_questions, answer = entry
+            for question in alt_questions:
+                questions.append(question)
+                answers.append(answer)
+
+        self.index = FaqIndex(questions, answers)
+        self.questions = questions
+        self.answers = answers
+        self.parsed_entries = parsed_entries
+        self.version += 1
+        self.logger.info(u'{} QA entries loaded from {}, {} entries parsed'.format(len(questions), self.path, nb_parsed))
+
+    def get_version(self):
+        self.__load_entries()
+        return self.version
+
+    def get_questions(self):
+        self.__load_entries()
+        return self.index.questions
 
     def get_most_similar(self, question_str, similarity_detector, text_utils):
         assert question_str
         self.__load_entries()
 
+        index = self.index
+
+        # Вопрос дословно (с точностью до регистра и пунктуации) совпадает с одним из опорных.
+        question_index = index.find_exact(question_str)
+        if question_index is not None:
+            return index.get_answer(question_index), 1.0, index.questions[question_index]
+
+        # Список кандидатов подменяется вместе с индексом при перезагрузке файла, так что модель
+        # может держать подготовленный для него индекс шинглов под постоянным ключом.
         question2 = u' '.join(text_utils.tokenize(question_str))
         best_question, best_rel = similarity_detector.get_most_similar(question2,
-                                                                       [(s, None, None) for s in self.questions],
+                                                                       index.candidates,
                                                                        text_utils,
-                                                                       nb_results=1)
-        question_index = self.questions.index(best_question)
-        best_answer = self.answers[question_index]
+                                                                       nb_results=1,
+                                                                       phrases_key=('faq', self.path))
+        question_index = index.get_question_id(best_question)
+        best_answer = index.get_answer(question_index)
         return best_answer, best_rel, best_question
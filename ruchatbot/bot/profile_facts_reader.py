@@ -1,11 +1,21 @@
 # -*- coding: utf-8 -*-
+"""
+18-10-2026 Опциональная перезагрузка измененного файла фактов без рестарта бота (hot_reload)
+18-10-2026 Версия фактов профиля и признак наличия новых фактов для кэша готовых ответов
+18-10-2026 Готовый список фактов с ключом для кэширования индексов в моделях (enumerate_facts_snapshot)
+"""
 
 import io
 import itertools
 import logging
+import os
+import threading
+from collections import OrderedDict
 
 from ruchatbot.bot.simple_facts_storage import SimpleFactsStorage
+from ruchatbot.bot.compiled_facts import CompiledFacts, get_compiled_facts_path, calc_facts_checksum
 from ruchatbot.utils.constant_replacer import replace_constant
+from ruchatbot.utils.file_watcher import FileWatcher
 
 
 class ProfileFactsReader(SimpleFactsStorage):
@@ -14,43 +24,150 @@ class ProfileFactsReader(SimpleFactsStorage):
     таким образом персистентность не реализована.
     """
 
-    def __init__(self, text_utils, profile_path, constants):
+    def __init__(self, text_utils, profile_path, constants, models_folder=None, hot_reload=False):
         """
         :param text_utils: экземпляр класса TextUtils
         :param profile_path: путь к текстовому файлу с фактами
+        :param models_folder: каталог с моделями; если задан, то при наличии актуальной
+         скомпилированной базы фактов (см. compile_facts.py) она загружается вместо разбора текста.
+        :param hot_reload: при изменении файла фактов перезагружать его без рестарта бота
         """
         super(ProfileFactsReader, self).__init__(text_utils)
         self.text_utils = text_utils
         self.profile_path = profile_path
         self.profile_facts = None
+        self.profile_version = 0
         self.constants = constants
+        self.models_folder = models_folder
+        self.compiled_facts = None
         self.new_facts = []
+        self.parsed_lines = dict()  # (строка файла, раздел) => факт
+        self.watcher = FileWatcher(profile_path) if hot_reload else None
+
+        # Собранные списки фактов для enumerate_facts_snapshot: ключ списка => список
+        self.facts_snapshots = OrderedDict()
+        self.max_facts_snapshots = 16
+        self.snapshots_lock = threading.Lock()
 
     def load_profile(self):
-        logger = logging.getLogger('ProfileFactsReader')
         if self.profile_facts is None:
-            logger.info(u'Loading profile facts from "%s"', self.profile_path)
-            self.profile_facts = []
-            with io.open(self.profile_path, 'r', encoding='utf=8') as rdr:
-                current_section = None
-                for line in rdr:
-                    line = line.strip()
-                    if line:
-                        if line.startswith('#'):
-                            if line.startswith('##'):
-                                current_section = line[line.index(':')+1:].strip()
-                                if current_section not in ('1s', '2s', '3'):
-                                    msg = u'Unknown profile section {}'.format(current_section)
-                                    raise RuntimeError(msg)
-                            else:
-                                # Строки с одним # считаем комментариями.
-                                continue
+            if self.watcher:
+                self.watcher.mark_loaded()
+            self.reload_profile()
+        elif self.watcher and self.watcher.try_acquire_change():
+            # Файл изменился. Перезагрузку выполняет только один поток, остальные
+            # продолжают работать со старым списком фактов до его подмены.
+            reloaded = False
+            try:
+                self.reload_profile()
+                reloaded = True
+            except Exception as ex:
+                logging.getLogger('ProfileFactsReader').error(u'Could not reload profile facts from "%s": %s',
+                                                              self.profile_path, ex)
+            finally:
+                self.watcher.release_change(reloaded)
+
+    def reload_profile(self):
+        """
+        Загрузка фактов из скомпилированной базы, если она актуальна, или из текстового файла.
+        Новый список фактов подменяет старый одним присваиванием.
+        """
+        logger = logging.getLogger('ProfileFactsReader')
+        compiled_path = get_compiled_facts_path(self.profile_path)
+        if self.models_folder and os.path.exists(compiled_path):
+            checksum = calc_facts_checksum(self.profile_path, self.constants, self.models_folder)
+            if CompiledFacts.read_header(compiled_path)['checksum'] == checksum:
+                logger.info(u'Loading compiled profile facts from "%s"', compiled_path)
+                compiled_facts = CompiledFacts.load(compiled_path)
+                self.compiled_facts = compiled_facts
+                self.profile_facts = compiled_facts.get_facts()
+                self.profile_version += 1
+                return
+            else:
+                logger.warning(u'Compiled facts "%s" are out of date, run compile_facts.py', compiled_path)
+
+        self.compiled_facts = None
+        self.profile_facts = self.parse_profile()
+        self.profile_version += 1
+
+    def get_version(self):
+        self.load_profile()
+        return self.profile_version
+
+    def enumerate_facts_snapshot(self, interlocutor):
+        self.load_profile()
+        return self.get_facts_snapshot(tuple(self.new_facts))
+
+    def get_facts_snapshot(self, head_facts):
+        """
+        Список из фактов head_facts, фактов профиля и динамических фактов. Список профиля при
+        перезагрузке подменяется целиком, поэтому его состав определяется ссылкой на него и номером
+        версии, а немногочисленные новые и динамические факты входят в ключ как есть. Вычисление
+        ключа не зависит от размера профиля.
+        """
+        profile_facts = self.profile_facts
+        dynamic_facts = self.enumerate_dynamic_facts()
+        key = ('facts', self.profile_version, id(profile_facts), head_facts, dynamic_facts)
+        with self.snapshots_lock:
+            facts = self.facts_snapshots.get(key)
+            if facts is not None:
+                self.facts_snapshots.move_to_end(key)
+                return facts, key
+
+        facts = list(itertools.chain(head_facts, profile_facts, dynamic_facts))
+        with self.snapshots_lock:
+            self.facts_snapshots[key] = facts
+            if len(self.facts_snapshots) > self.max_facts_snapshots:
+                self.facts_snapshots.popitem(last=False)
+
+        return facts, key
+
+    def has_interlocutor_facts(self, interlocutor):
+        # Новые факты хранятся в общем списке без привязки к собеседнику.
+        return len(self.new_facts) > 0
+
+    def get_compiled_facts(self):
+        """Вернет экземпляр CompiledFacts, если факты профиля загружены из скомпилированной базы"""
+        self.load_profile()
+        return self.compiled_facts
+
+    def parse_profile(self):
+        """
+        Разбор текстового файла с фактами.
+        :return: список кортежей (текст_факта, лицо, метка_факта)
+        """
+        logger = logging.getLogger('ProfileFactsReader')
+        logger.info(u'Loading profile facts from "%s"', self.profile_path)
+        profile_facts = []
+        parsed_lines = dict()
+        with io.open(self.profile_path, 'r', encoding='utf=8') as rdr:
+            current_section = None
+            for line in rdr:
+                line = line.strip()
+                if line:
+                    if line.startswith('#'):
+                        if line.startswith('##'):
+                            current_section = line[line.index(':')+1:].strip()
+                            if current_section not in ('1s', '2s', '3'):
+                                msg = u'Unknown profile section {}'.format(current_section)
+                                raise RuntimeError(msg)
                         else:
-                            assert(current_section)
+                            # Строки с одним # считаем комментариями.
+                            continue
+                    else:
+                        assert(current_section)
+                        # Строки, не изменившиеся с прошлой загрузки файла, повторно не обрабатываем.
+                        key = (line, current_section)
+                        fact = self.parsed_lines.get(key)
+                        if fact is None:
                             canonized_line = self.text_utils.canonize_text(line)
                             canonized_line = replace_constant(canonized_line, self.constants, self.text_utils)
-                            self.profile_facts.append((canonized_line, current_section, u''))
-            logger.debug(u'%d facts loaded from "%s"', len(self.profile_facts), self.profile_path)
+                            fact = (canonized_line, current_section, u'')
+                        parsed_lines[key] = fact
+                        profile_facts.append(fact)
+        self.parsed_lines = parsed_lines
+        logger.debug(u'%d facts loaded from "%s"', len(profile_facts), self.profile_path)
+        return profile_facts
 
     def reset_added_facts(self):
         self.new_facts = []
@@ -60,9 +177,7 @@ class ProfileFactsReader(SimpleFactsStorage):
         self.load_profile()
 
         # родительский класс добавит факты о текущем времени и т.д.
-        parent_facts = list(super(ProfileFactsReader, self).enumerate_facts(interlocutor))
-
-        for f in itertools.chain(self.new_facts, self.profile_facts, parent_facts):
+        for f in itertools.chain(self.new_facts, self.profile_facts, self.enumerate_dynamic_facts()):
             yield f
 
     def store_new_fact(self, interlocutor, fact, unique):
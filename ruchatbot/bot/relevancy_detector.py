@@ -14,12 +14,33 @@ class RelevancyDetector(ModelApplicator):
         pass
 
     @abstractmethod
-    def get_most_relevant(self, probe_phrase, phrases, text_utils, nb_results=1):
+    def get_most_relevant(self, probe_phrase, phrases, text_utils, nb_results=1, phrases_key=None):
+        """
+        :param phrases_key: ключ, под которым модель может кэшировать данные, подготовленные для списка
+         phrases (например, индекс шинглов). Данные переиспользуются, пока с этим ключом передается тот
+         же объект списка, поэтому список нельзя менять на месте. None - ничего не кэшируется.
+        """
         raise NotImplemented()
 
+    def get_most_relevant_many(self, probe_phrases, phrases, text_utils, nb_results=1, phrases_key=None):
+        """
+        Поиск наиболее релевантных предпосылок сразу для нескольких вопросов.
+        Возвращается список результатов get_most_relevant для каждого вопроса из probe_phrases.
+        Производные классы могут переопределить метод, чтобы оценивать все пары одним вызовом модели.
+        """
+        return [self.get_most_relevant(probe_phrase, phrases, text_utils, nb_results=nb_results, phrases_key=phrases_key)
+                for probe_phrase in probe_phrases]
+
     @abstractmethod
     def calc_relevancy1(self, premise, question, text_utils):
         raise NotImplemented()
 
+    def preload_compiled_facts(self, compiled_facts):
+        """
+        Использовать заранее вычисленные признаки фактов из скомпилированной базы (см. CompiledFacts).
+        По умолчанию ничего не делает.
+        """
+        pass
+
     def get_w2v_path(self):
         return None
@@ -43,6 +43,11 @@ class ScriptingRule(object):
     def execute(self, bot, session, interlocutor, interpreted_phrase, answering_engine):
         raise NotImplementedError()
 
+    @abstractmethod
+    def get_text_etalons(self):
+        """Эталонные тексты условий правила, сравниваемые с репликой моделью синонимичности"""
+        raise NotImplementedError()
+
 
 class ScriptingRuleIf(ScriptingRule):
     def __init__(self, yaml_node, constants, text_utils):
@@ -65,6 +70,9 @@ class ScriptingRuleIf(ScriptingRule):
             s = 'ScriptingRuleIf condition={}'.format(str(self.condition))
         return s
 
+    def get_text_etalons(self):
+        return self.condition.get_text_etalons()
+
     def execute(self, bot, session, interlocutor, interpreted_phrase, answering_engine):
         """Вернет True, если правило сформировало ответную реплику."""
         condition_check = self.condition.check_condition(bot, session, interlocutor, interpreted_phrase, answering_engine)
@@ -110,6 +118,11 @@ class ScriptingRuleSwitch(ScriptingRule):
         else:
             return str(self.condition1)
 
+    def get_text_etalons(self):
+        etalons = list(self.condition1.get_text_etalons())
+        for case_handler in self.case_handlers:
+            etalons.extend(case_handler.get_text_etalons())
+        return etalons
 
     def execute(self, bot, session, interlocutor, interpreted_phrase, answering_engine):
         condition_check = self.condition1.check_condition(bot, session, interlocutor, interpreted_phrase, answering_engine)
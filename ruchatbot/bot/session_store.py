@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилища состояния диалоговых сессий для PersistentDialogSessionFactory.
+
+Хранилище работает с уже сериализованными частями сессии (байтовыми строками) и не знает
+об устройстве самой сессии, поэтому для работы через сервер ключ-значение достаточно
+реализовать интерфейс BaseSessionStore.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class SessionLockTimeout(Exception):
+    """Сессию не удалось захватить за отведенное время - ее занимает другой процесс"""
+    pass
+
+
+class BaseSessionStore(object):
+    """
+    Интерфейс хранилища сессий. Части сессии: история диалога (последовательность фраз с
+    номерами seq), а также slots, status и answer_buffer - сериализованные значения,
+    которые перезаписываются целиком.
+    """
+    def __init__(self):
+        pass
+
+    def after_fork(self):
+        """Вызывается в рабочем процессе после fork, чтобы открыть собственные соединения"""
+        pass
+
+    def lock(self, session_key):
+        """
+        Захват сессии для обработки реплики. Пока сессия захвачена, другие процессы
+        ждут в lock() ее освобождения.
+        :raises SessionLockTimeout: сессия не освободилась за отведенное время, вызывающий
+         код должен ответить собеседнику, что бот занят, а не обрабатывать реплику без захвата.
+        """
+        raise NotImplementedError()
+
+    def unlock(self, session_key):
+        raise NotImplementedError()
+
+    def get_version(self, session_key):
+        """
+        :return: номер версии сохраненного состояния или None, если сессии в хранилище нет
+        """
+        raise NotImplementedError()
+
+    def load(self, session_key, max_history):
+        """
+        :param max_history: сколько последних фраз истории загрузить, None - все
+        :return: None, если сессии в хранилище нет, иначе словарь с ключами version, history_epoch,
+         nb_phrases (общее число фраз в истории), history (список сериализованных фраз),
+         slots, status, answer_buffer
+        """
+        raise NotImplementedError()
+
+    def save(self, session_key, changes):
+        """
+        Запись изменившихся частей сессии.
+        :param changes: словарь, в котором могут быть ключи slots, status, answer_buffer,
+         history_epoch (при сбросе истории вся сохраненная история удаляется) и
+         new_phrases - список кортежей (seq, сериализованная фраза) для добавления в историю
+        :return: новый номер версии
+        """
+        raise NotImplementedError()
+
+
+class SQLiteSessionStore(BaseSessionStore):
+    """
+    Хранилище сессий в базе SQLite, которую могут использовать несколько процессов на одной машине.
+    """
+    def __init__(self, db_path, lock_timeout=30.0, lease_time=60.0, max_stored_history=1000):
+        """
+        :param db_path: путь к файлу базы, создается при необходимости
+        :param lock_timeout: сколько секунд ждать освобождения сессии другим процессом
+        :param lease_time: через сколько секунд захват сессии снимается, если захвативший процесс упал.
+         Пока процесс работает, захваченные им сессии продлеваются фоновым потоком, так что долгая
+         обработка реплики не теряет захват.
+        :param max_stored_history: сколько последних фраз истории сессии хранить в базе
+        """
+        super(SQLiteSessionStore, self).__init__()
+        self.logger = logging.getLogger('SQLiteSessionStore')
+        self.db_path = db_path
+        self.lock_timeout = lock_timeout
+        self.lease_time = lease_time
+        self.max_stored_history = max_stored_history
+        self.owner = str(uuid.uuid4())
+        self.held_keys = set()  # сессии, захваченные этим процессом
+        self.renew_thread = None
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        self.logger.info(u'Opening sessions database "%s"', db_path)
+        self.db_lock = threading.Lock()
+        self.parent_conn = None
+        self.conn = self.connect()
+        self.conn.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                          'session_key TEXT PRIMARY KEY, '
+                          'version INTEGER NOT NULL, '
+                          'history_epoch INTEGER NOT NULL, '
+                          'nb_phrases INTEGER NOT NULL, '
+                          'slots BLOB, '
+                          'status BLOB, '
+                          'answer_buffer BLOB)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS history ('
+                          'session_key TEXT NOT NULL, '
+                          'seq INTEGER NOT NULL, '
+                          'phrase BLOB NOT NULL, '
+                          'PRIMARY KEY (session_key, seq))')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS locks ('
+                          'session_key TEXT PRIMARY KEY, '
+                          'owner TEXT NOT NULL, '
+                          'expires REAL NOT NULL)')
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.lock_timeout, check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def after_fork(self):
+        # Унаследованное соединение не используем и не закрываем, у процесса должен быть свой владелец захватов.
+        self.parent_conn = self.conn
+        self.db_lock = threading.Lock()
+        self.conn = self.connect()
+        self.owner = str(uuid.uuid4())
+        # Поток продления захватов не переживает fork, в рабочем процессе он запускается заново.
+        self.held_keys = set()
+        self.renew_thread = None
+
+    def close(self):
+        with self.db_lock:
+            self.conn.close()
+
+    def lock(self, session_key):
+        deadline = time.time() + self.lock_timeout
+        while True:
+            now = time.time()
+            with self.db_lock:
+                self.conn.execute('BEGIN IMMEDIATE')
+                try:
+                    self.conn.execute('DELETE FROM locks WHERE session_key=? AND expires<?', (session_key, now))
+                    cur = self.conn.execute('INSERT OR IGNORE INTO locks (session_key, owner, expires) VALUES (?, ?, ?)',
+                                            (session_key, self.owner, now + self.lease_time))
+                    acquired = cur.rowcount > 0
+                    self.conn.execute('COMMIT')
+                except Exception:
+                    self.conn.execute('ROLLBACK')
+                    raise
+
+            if acquired:
+                with self.db_lock:
+                    self.held_keys.add(session_key)
+                    if self.renew_thread is None:
+                        self.renew_thread = threading.Thread(target=self.renew_leases, name='SQLiteSessionStore.renew')
+                        self.renew_thread.daemon = True
+                        self.renew_thread.start()
+                return
+
+            if now > deadline:
+                # Обработка реплики без захвата испортила бы сессию, которую сейчас меняет другой процесс.
+                self.logger.warning(u'Could not lock session "%s" in %g sec', session_key, self.lock_timeout)
+                raise SessionLockTimeout(session_key)
+
+            time.sleep(0.02)
+
+    def unlock(self, session_key):
+        with self.db_lock:
+            self.held_keys.discard(session_key)
+            self.conn.execute('DELETE FROM locks WHERE session_key=? AND owner=?', (session_key, self.owner))
+
+    def renew_leases(self):
+        """Фоновое продление захватов сессий, которые этот процесс еще обрабатывает"""
+        while True:
+            time.sleep(self.lease_time / 3.0)
+            try:
+                with self.db_lock:
+                    held_keys = list(self.held_keys)
+                    if held_keys:
+                        expires = time.time() + self.lease_time
+                        self.conn.executemany('UPDATE locks SET expires=? WHERE session_key=? AND owner=?',
+                                              [(expires, session_key, self.owner) for session_key in held_keys])
+            except Exception as ex:
+                self.logger.error(u'Could not renew session locks: %s', ex)
+
+    def get_version(self, session_key):
+        with self.db_lock:
+            row = self.conn.execute('SELECT version FROM sessions WHERE session_key=?', (session_key,)).fetchone()
+        return row[0] if row else None
+
+    def load(self, session_key, max_history):
+        with self.db_lock:
+            self.conn.execute('BEGIN')
+            try:
+                row = self.conn.execute('SELECT version, history_epoch, nb_phrases, slots, status, answer_buffer '
+                                        'FROM sessions WHERE session_key=?', (session_key,)).fetchone()
+                if row is None:
+                    return None
+
+                if max_history is None:
+                    history = self.conn.execute('SELECT phrase FROM history WHERE session_key=? ORDER BY seq',
+                                                (session_key,)).fetchall()
+                else:
+                    history = self.conn.execute('SELECT phrase FROM history WHERE session_key=? '
+                                                'ORDER BY seq DESC LIMIT ?', (session_key, max_history)).fetchall()
+                    history = history[::-1]
+            finally:
+                self.conn.execute('COMMIT')
+
+        version, history_epoch, nb_phrases, slots, status, answer_buffer = row
+        return {'version': version,
+                'history_epoch': history_epoch,
+                'nb_phrases': nb_phrases,
+                'history': [bytes(phrase) for phrase, in history],
+                'slots': slots,
+                'status': status,
+                'answer_buffer': answer_buffer}
+
+    def save(self, session_key, changes):
+        with self.db_lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute('SELECT version, history_epoch, nb_phrases FROM sessions WHERE session_key=?',
+                                        (session_key,)).fetchone()
+                if row is None:
+                    version, history_epoch, nb_phrases = 0, 0, 0
+                    self.conn.execute('INSERT INTO sessions (session_key, version, history_epoch, nb_phrases) '
+                                      'VALUES (?, 0, 0, 0)', (session_key,))
+                else:
+                    version, history_epoch, nb_phrases = row
+
+                if 'history_epoch' in changes and changes['history_epoch'] != history_epoch:
+                    history_epoch = changes['history_epoch']
+                    nb_phrases = 0
+                    self.conn.execute('DELETE FROM history WHERE session_key=?', (session_key,))
+
+                new_phrases = changes.get('new_phrases')
+                if new_phrases:
+                    self.conn.executemany('INSERT OR REPLACE INTO history (session_key, seq, phrase) VALUES (?, ?, ?)',
+                                          [(session_key, seq, sqlite3.Binary(phrase)) for seq, phrase in new_phrases])
+                    nb_phrases = max(nb_phrases, new_phrases[-1][0] + 1)
+                    if self.max_stored_history is not None:
+                        self.conn.execute('DELETE FROM history WHERE session_key=? AND seq<?',
+                                          (session_key, nb_phrases - self.max_stored_history))
+
+                for part in ('slots', 'status', 'answer_buffer'):
+                    if part in changes:
+                        self.conn.execute('UPDATE sessions SET {}=? WHERE session_key=?'.format(part),
+                                          (sqlite3.Binary(changes[part]), session_key))
+
+                version += 1
+                self.conn.execute('UPDATE sessions SET version=?, history_epoch=?, nb_phrases=? WHERE session_key=?',
+                                  (version, history_epoch, nb_phrases, session_key))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+        return version
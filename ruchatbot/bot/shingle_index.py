@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Инвертированный индекс шинглов для быстрого отбора кандидатов перед ранжированием
+фраз моделями градиентного бустинга (см. GB_BaseDetector.get_most_relevant).
+По идее аналогичен preparation/corpus_searcher.CorpusSearcher, но работает
+с id шинглов, которые уже посчитаны для фраз детектором.
+"""
+
+import numpy as np
+
+
+class ShingleIndex(object):
+    """
+    Индекс id шингла => номера фраз, в которых этот шингл встречается.
+    Отбор кандидатов затрагивает только списки фраз для шинглов пробной
+    фразы, поэтому его стоимость растет медленнее, чем размер базы.
+    """
+    def __init__(self, phrases_ids):
+        """
+        :param phrases_ids: список отсортированных массивов id шинглов для индексируемых фраз
+        """
+        self.nb_phrases = len(phrases_ids)
+        self.phrase_lens = np.fromiter((len(ids) for ids in phrases_ids), dtype=np.int64, count=self.nb_phrases)
+        self.shingle2phrases = dict()
+
+        if self.phrase_lens.sum() > 0:
+            all_ids = np.concatenate(phrases_ids)
+            all_phrases = np.repeat(np.arange(self.nb_phrases, dtype=np.int64), self.phrase_lens)
+            order = np.argsort(all_ids, kind='stable')
+            all_ids = all_ids[order]
+            all_phrases = all_phrases[order]
+            shingle_ids, starts = np.unique(all_ids, return_index=True)
+            for shingle_id, iphrases in zip(shingle_ids.tolist(), np.split(all_phrases, starts[1:])):
+                self.shingle2phrases[shingle_id] = iphrases
+
+    def __len__(self):
+        return self.nb_phrases
+
+    def find_candidates(self, probe_ids, nb_candidates):
+        """
+        Отбираем не более nb_candidates фраз с наибольшим коэффициентом Жаккара
+        по шинглам с пробной фразой. Фразы без общих шинглов не возвращаются.
+
+        :param probe_ids: массив id шинглов пробной фразы
+        :param nb_candidates: сколько кандидатов вернуть
+        :return: отсортированный по возрастанию массив номеров отобранных фраз
+        """
+        postings = [self.shingle2phrases[i] for i in probe_ids.tolist() if i in self.shingle2phrases]
+        if not postings:
+            return np.zeros(0, dtype=np.int64)
+
+        iphrases, overlaps = np.unique(np.concatenate(postings), return_counts=True)
+        if len(iphrases) > nb_candidates:
+            jaccard = overlaps / (self.phrase_lens[iphrases] + len(probe_ids) - overlaps).astype(np.float32)
+            top = np.argpartition(-jaccard, nb_candidates - 1)[:nb_candidates]
+            iphrases = np.sort(iphrases[top])
+
+        return iphrases
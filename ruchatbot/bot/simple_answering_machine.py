@@ -20,7 +20,7 @@ from ruchatbot.bot.interpreted_phrase import InterpretedPhrase
 from ruchatbot.bot.nn_enough_premises_model import NN_EnoughPremisesModel
 # from nn_synonymy_detector import NN_SynonymyDetector
 from ruchatbot.bot.lgb_synonymy_detector import LGB_SynonymyDetector
-# from nn_synonymy_tripleloss import NN_SynonymyTripleLoss
+# from ruchatbot.bot.nn_synonymy_tripleloss import NN_SynonymyTripleLoss
 from ruchatbot.bot.jaccard_synonymy_detector import Jaccard_SynonymyDetector
 #from ruchatbot.bot.nn_interpreter import NN_Interpreter
 from ruchatbot.bot.nn_interpreter_new2 import NN_InterpreterNew2
@@ -37,6 +37,7 @@ from ruchatbot.bot.p2q_relevancy_lgb import P2Q_Relevancy_LGB
 from ruchatbot.bot.paraphraser import Paraphraser
 from ruchatbot.bot.actors import substitute_bound_variables, SayingPhrase
 from ruchatbot.bot.discourse import Discourse
+from ruchatbot.bot.answer_cache import AnswerCache
 
 
 class InsteadofRuleResult(object):
@@ -100,6 +101,9 @@ class SimpleAnsweringMachine(BaseAnsweringMachine):
         self.min_premise_relevancy = 0.6
         self.min_faq_relevancy = 0.7
 
+        # Готовые ответы на вопросы, не зависящие от собеседника.
+        self.answer_cache = AnswerCache()
+
     def get_text_utils(self):
         return self.text_utils
 
@@ -111,7 +115,12 @@ class SimpleAnsweringMachine(BaseAnsweringMachine):
         _, tail = os.path.split(old_filepath)
         return os.path.join(models_folder, tail)
 
-    def load_models(self, data_folder, models_folder, constants):
+    def load_models(self, data_folder, models_folder, constants, load_nn_models=True):
+        """
+        :param load_nn_models: False - отложить загрузку нейросетевых (keras) моделей до вызова
+         load_nn_models. Используется при запуске нескольких рабочих процессов: прочие модели
+         загружаются до fork и разделяются процессами, а tf-сессии создаются в каждом процессе.
+        """
         self.logger.info(u'Loading models from "%s"', models_folder)
         self.models_folder = models_folder
 
@@ -146,10 +155,6 @@ class SimpleAnsweringMachine(BaseAnsweringMachine):
         self.synonymy_detector.load(models_folder)
         # self.synonymy_detector = Jaccard_SynonymyDetector()
 
-        # Интерпретатор для раскрытия анафоры, заполнения гэппинга, эллипсиса и т.д.
-        self.interpreter = NN_InterpreterNew2()
-        self.interpreter.load(models_folder)
-
         #self.req_interpretation = NN_ReqInterpretation()
         self.req_interpretation = LGB_ReqInterpretation()
         self.req_interpretation.load(models_folder)
@@ -157,14 +162,6 @@ class SimpleAnsweringMachine(BaseAnsweringMachine):
         self.p2q_relevancy = P2Q_Relevancy_LGB()
         self.p2q_relevancy.load(models_folder)
 
-        # Определение достаточности набора предпосылок для ответа на вопрос
-        self.enough_premises = NN_EnoughPremisesModel()
-        self.enough_premises.load(models_folder)
-
-        # Комплексная модель (группа моделей) для генерации текста ответа
-        self.answer_builder = AnswerBuilder()
-        self.answer_builder.load_models(models_folder, self.text_utils)
-
         # Генеративная грамматика для формирования реплик
         self.replica_grammar = None
         #self.replica_grammar = GenerativeGrammarEngine()
@@ -187,16 +184,38 @@ class SimpleAnsweringMachine(BaseAnsweringMachine):
         self.intent_detector = IntentDetector()
         self.intent_detector.load(models_folder)
 
-        self.entity_extractor = EntityExtractor()
-        self.entity_extractor.load(models_folder)
-
         self.jsyndet = Jaccard_SynonymyDetector()
 
         self.paraphraser = Paraphraser()
         self.paraphraser.load(models_folder)
 
+        # Комплексная модель (группа моделей) для генерации текста ответа. Шаблоны knn-1 модели
+        # и их индекс строятся здесь, seq2seq модель загружается в load_nn_models.
+        self.answer_builder = AnswerBuilder()
+        self.answer_builder.load_templates(models_folder, self.text_utils)
+
+        if load_nn_models:
+            self.load_nn_models()
+
         self.logger.debug('All models loaded')
 
+    def load_nn_models(self):
+        """Загрузка нейросетевых моделей, см. параметр load_nn_models в load_models"""
+        models_folder = self.models_folder
+
+        # Интерпретатор для раскрытия анафоры, заполнения гэппинга, эллипсиса и т.д.
+        self.interpreter = NN_InterpreterNew2()
+        self.interpreter.load(models_folder)
+
+        # Определение достаточности набора предпосылок для ответа на вопрос
+        self.enough_premises = NN_EnoughPremisesModel()
+        self.enough_premises.load(models_folder)
+
+        self.answer_builder.load_models(models_folder)
+
+        self.entity_extractor = EntityExtractor()
+        self.entity_extractor.load(models_folder)
+
     def extract_entity(self, entity_name, phrase_str):
         return self.entity_extractor.extract_entity(entity_name, phrase_str, self.text_utils, self.text_utils.word_embeddings)
 
@@ -212,15 +231,20 @@ class SimpleAnsweringMachine(BaseAnsweringMachine):
         :param interlocutor: строковый идентификатор собеседника.
         :return: строка реплики, которую скажет бот.
         """
-        session = self.get_session(bot, interlocutor)
-        if bot.has_scripting():
-            phrase = bot.scripting.start_conversation(self, session)
-            if phrase is not None:
-                self.say(bot, session, phrase)
+        with self.session_factory.lock_session(bot, interlocutor):
+            session = self.get_session(bot, interlocutor)
+            if bot.has_scripting():
+                phrase = bot.scripting.start_conversation(self, session)
+                if phrase is not None:
+                    self.say(bot, session, phrase)
+            self.session_factory.store_session(session)
 
     def get_session_factory(self):
         return self.session_factory
 
+    def set_session_factory(self, session_factory):
+        self.session_factory = session_factory
+
     def is_question(self, phrase):
         modality, person = self.modality_model.get_modality(phrase, self.text_utils, self.word_embeddings)
         return modality == ModalityDetector.question
@@ -456,38 +480,50 @@ class SimpleAnsweringMachine(BaseAnsweringMachine):
 
     def does_bot_know_answer(self, question, bot, session, interlocutor):
         """Вернет true, если бот знает ответ на вопрос question"""
-        memory_phrases = list(bot.facts.enumerate_facts(interlocutor))
-        best_premise, best_rel = self.relevancy_detector.get_most_relevant(question,
-                                                                           memory_phrases,
-                                                                           self.text_utils,
-                                                                           nb_results=1)
-        return best_rel >= self.min_premise_relevancy
+        return self.does_bot_know_answers([question], bot, session, interlocutor)[0]
+
+    def does_bot_know_answers(self, questions, bot, session, interlocutor):
+        """Для каждого вопроса из списка questions вернет true, если бот знает ответ на него"""
+        if not questions:
+            return []
+
+        # Все вопросы проверяем по базе фактов одним вызовом модели.
+        memory_phrases, facts_key = bot.facts.enumerate_facts_snapshot(interlocutor)
+        results = self.relevancy_detector.get_most_relevant_many(questions,
+                                                                 memory_phrases,
+                                                                 self.text_utils,
+                                                                 nb_results=1,
+                                                                 phrases_key=facts_key)
+        return [best_rel >= self.min_premise_relevancy for best_premise, best_rel in results]
 
     def find_premise(self, question, bot, session, interlocutor):
-        memory_phrases = list(bot.facts.enumerate_facts(interlocutor))
+        memory_phrases, facts_key = bot.facts.enumerate_facts_snapshot(interlocutor)
         best_premise, best_rel = self.relevancy_detector.get_most_relevant(question,
                                                                            memory_phrases,
                                                                            self.text_utils,
-                                                                           nb_results=1)
+                                                                           nb_results=1,
+                                                                           phrases_key=facts_key)
         return best_premise if best_rel >= self.min_premise_relevancy else None
 
     def find_similar_fact(self, fact_str, bot, session, interlocutor):
-        memory_phrases = list(bot.facts.enumerate_facts(interlocutor))
+        memory_phrases, facts_key = bot.facts.enumerate_facts_snapshot(interlocutor)
         best_fact, best_sim = self.synonymy_detector.get_most_similar(fact_str,
                                                                       memory_phrases,
                                                                       self.text_utils,
-                                                                      nb_results=1)
+                                                                      nb_results=1,
+                                                                      phrases_key=facts_key)
         if best_sim >= self.synonymy_detector.get_threshold():
             return best_fact
         else:
             return None
 
     def find_contradictory_fact(self, fact_str, bot, session, interlocutor):
-        memory_phrases = list(bot.facts.enumerate_facts(interlocutor))
+        memory_phrases, facts_key = bot.facts.enumerate_facts_snapshot(interlocutor)
         best_premise, best_rel = self.relevancy_detector.get_most_relevant(fact_str,
                                                                            memory_phrases,
                                                                            self.text_utils,
-                                                                           nb_results=1)
+                                                                           nb_results=1,
+                                                                           phrases_key=facts_key)
         if best_rel >= self.min_premise_relevancy:
             # Есть релевантный файл.
             # Попробуем сгенерировать ответ.
@@ -511,17 +547,26 @@ class SimpleAnsweringMachine(BaseAnsweringMachine):
 
     def bot_replica_already_uttered(self, bot, session, phrase):
         """Проверяем, была ли такая же или синонимичная реплика уже сказана ботом ранее"""
-        found_same_replica = session.count_bot_phrase(phrase) > 0
-        if not found_same_replica:
-            # В точности такой же реплики не было, но надо проверить на перефразировки.
+        return self.bot_replicas_already_uttered(bot, session, [phrase])[0]
+
+    def bot_replicas_already_uttered(self, bot, session, phrases):
+        """Для каждой реплики из списка phrases проверяем, была ли такая же или синонимичная реплика уже сказана ботом ранее"""
+        found_same_replicas = [session.count_bot_phrase(phrase) > 0 for phrase in phrases]
+
+        # Для реплик, которые в точности ранее не произносились, надо проверить перефразировки.
+        probe_indeces = [i for i, found in enumerate(found_same_replicas) if not found]
+        if len(probe_indeces) > 0:
             bot_phrases = [(f, None, None) for f in session.get_bot_phrases()]
             if len(bot_phrases) > 0:
-                best_phrase, best_rel = self.synonymy_detector.get_most_similar(phrase, bot_phrases,
-                                                                                self.text_utils,
-                                                                                nb_results=1)
-                if best_rel >= self.synonymy_detector.get_threshold():
-                    found_same_replica = True
-        return found_same_replica
+                results = self.synonymy_detector.get_most_similar_many([phrases[i] for i in probe_indeces],
+                                                                       bot_phrases,
+                                                                       self.text_utils,
+                                                                       nb_results=1)
+                for i, (best_phrase, best_rel) in zip(probe_indeces, results):
+                    if best_rel >= self.synonymy_detector.get_threshold():
+                        found_same_replicas[i] = True
+
+        return found_same_replicas
 
     def generate_with_generative_grammar(self, bot, session, interlocutor, phrase, base_weight):
         if not bot.generative_smalltalk_enabled:
@@ -720,17 +765,26 @@ class SimpleAnsweringMachine(BaseAnsweringMachine):
                                                    'assertion(1)'))
         else:
             # Текст формируемой реплики указан буквально.
+            replicas = []
             for replica in rule.answers:
                 if condition_matching_results:
                     replica = substitute_bound_variables(SayingPhrase(replica), condition_matching_results, self.text_utils)
-
-                if not self.bot_replica_already_uttered(bot, session, replica):
+                replicas.append(replica)
+
+            # Проверки на повтор и на знание ответа делаем сразу для всех реплик правила,
+            # чтобы не гонять модели по отдельности для каждой реплики.
+            already_uttered = self.bot_replicas_already_uttered(bot, session, replicas)
+            questions = [replica for replica, uttered in zip(replicas, already_uttered)
+                         if not uttered and replica[-1] == u'?']
+            known_questions = set(question for question, known
+                                  in zip(questions, self.does_bot_know_answers(questions, bot, session, interlocutor))
+                                  if known)
+
+            for replica, uttered in zip(replicas, already_uttered):
+                if not uttered:
                     # проверить, если f является репликой-ответом: знает
                     # ли бот ответ на этот вопрос.
-                    good_replica = True
-                    if replica[-1] == u'?':
-                        if self.does_bot_know_answer(replica, bot, session, interlocutor):
-                            good_replica = False
+                    good_replica = replica not in known_questions
 
                     if good_replica:
                         discourse_rel = self.calc_discourse_relevance(replica, session)
@@ -852,18 +906,29 @@ class SimpleAnsweringMachine(BaseAnsweringMachine):
         return None
 
     def cancel_all_running_items(self, bot, interlocutor):
-        session = self.get_session(bot, interlocutor)
-        #session.get_status()
-        session.cancel_all_running_items()
+        with self.session_factory.lock_session(bot, interlocutor):
+            session = self.get_session(bot, interlocutor)
+            #session.get_status()
+            session.cancel_all_running_items()
+            self.session_factory.store_session(session)
 
     def reset_session(self, bot, interlocutor):
-        session = self.get_session(bot, interlocutor)
-        session.reset_history()
+        with self.session_factory.lock_session(bot, interlocutor):
+            session = self.get_session(bot, interlocutor)
+            session.reset_history()
+            self.session_factory.store_session(session)
 
     def reset_usage_stat(self):
         self.paraphraser.reset_usage_stat()
 
     def push_phrase(self, bot, interlocutor, phrase, internal_issuer=False, force_question_answering=False):
+        # Реплики одного собеседника обрабатываются строго по очереди, после обработки
+        # изменения сессии сохраняются (для фабрик с внешним хранилищем сессий).
+        with self.session_factory.lock_session(bot, interlocutor):
+            self.push_phrase0(bot, interlocutor, phrase, internal_issuer, force_question_answering)
+            self.session_factory.store_session(self.get_session(bot, interlocutor))
+
+    def push_phrase0(self, bot, interlocutor, phrase, internal_issuer, force_question_answering):
         self.logger.info(u'push_phrase interlocutor="%s" phrase="%s"', interlocutor, phrase)
         question = self.text_utils.canonize_text(phrase)
         if question == u'#traceon':
@@ -1211,6 +1276,35 @@ class SimpleAnsweringMachine(BaseAnsweringMachine):
         return self.premise_not_found.generate_answer(phrase, bot, text_utils)
 
     def build_answers0(self, session, bot, interlocutor, interpreted_phrase):
+        # Если у собеседника нет приватных фактов, то ответ мог быть уже построен для другого собеседника.
+        cache_key = None
+        if not bot.facts.has_interlocutor_facts(interlocutor):
+            faq_version = bot.faq.get_version() if bot.faq else 0
+            cache_key = AnswerCache.make_key(bot.get_bot_id(), interpreted_phrase.interpretation,
+                                             interpreted_phrase.person, bot.facts.get_version(), faq_version)
+            cached = self.answer_cache.get(cache_key)
+            if cached is not None:
+                if self.trace_enabled:
+                    self.logger.debug(u'Cached answer for question="%s"', interpreted_phrase.interpretation)
+                return cached
+
+        answers, answer_rels, cacheable = self.build_answers_uncached(session, bot, interlocutor, interpreted_phrase)
+        if cache_key is not None and cacheable:
+            self.answer_cache.put(cache_key, answers, answer_rels)
+        else:
+            self.answer_cache.mark_uncacheable()
+
+        return answers, answer_rels
+
+    def get_answer_cache_stats(self):
+        return self.answer_cache.get_stats()
+
+    def build_answers_uncached(self, session, bot, interlocutor, interpreted_phrase):
+        """
+        Построение ответа на вопрос.
+        :return: кортеж (ответы, достоверности, признак возможности кэширования). Ответ можно
+         кэшировать, если он не зависит от истории диалога, фактов собеседника и динамических фактов.
+        """
         if self.trace_enabled:
             self.logger.debug(u'Question to process="%s"', interpreted_phrase.interpretation)
 
@@ -1226,6 +1320,7 @@ class SimpleAnsweringMachine(BaseAnsweringMachine):
         answers = []
         answer_rels = []
         best_rels = None
+        cacheable = True
 
         # Нужна ли предпосылка, чтобы ответить на вопрос?
         # Используем модель, которая вернет вероятность того, что
@@ -1244,12 +1339,19 @@ class SimpleAnsweringMachine(BaseAnsweringMachine):
             best_rels = answer_rels
         else:
             # определяем наиболее релевантную предпосылку
-            memory_phrases = list(bot.facts.enumerate_facts(interlocutor))
+            memory_phrases, facts_key = bot.facts.enumerate_facts_snapshot(interlocutor)
 
             best_premises, best_rels = self.relevancy_detector.get_most_relevant(interpreted_phrase.interpretation,
                                                                                  memory_phrases,
                                                                                  self.text_utils,
-                                                                                 nb_results=3)
+                                                                                 nb_results=3,
+                                                                                 phrases_key=facts_key)
+            # Динамичность определяется по тем же фактам, по которым выбирались предпосылки:
+            # повторный перебор фактов мог бы попасть уже на следующую минуту.
+            dynamic_premises = set(fact[0] for fact in memory_phrases if bot.facts.is_dynamic_fact(fact))
+            if any((premise in dynamic_premises) for premise in best_premises):
+                cacheable = False
+
             if self.trace_enabled:
                 if best_rels[0] >= self.min_premise_relevancy:
                     self.logger.info(u'Best premise is "%s" with relevancy=%f', best_premises[0], best_rels[0])
@@ -1290,6 +1392,7 @@ class SimpleAnsweringMachine(BaseAnsweringMachine):
 
                 if len(answers) == 0:
                     # Попробуем использовать 2 последних утверждения собеседника как предпосылки.
+                    cacheable = False
                     last_h_entries = session.get_interlocutor_phrases(questions=False, assertions=True, last_nb=2)
                     if len(last_h_entries) == 2:
                         last_h_phrases = [z[0] for z in last_h_entries]
@@ -1317,6 +1420,7 @@ class SimpleAnsweringMachine(BaseAnsweringMachine):
 
         if len(answers) == 0:
             # Не удалось найти предпосылку для формирования ответа.
+            cacheable = False
 
             # Попробуем обработать вопрос правилами.
             if self.premise_not_found.get_noanswer_rules():
@@ -1337,7 +1441,7 @@ class SimpleAnsweringMachine(BaseAnsweringMachine):
                 answers.append(answer)
                 answer_rels.append(1.0)
 
-        return answers, answer_rels
+        return answers, answer_rels, cacheable
 
     def build_answers(self, session, bot, interlocutor, interpreted_phrase):
         answers, answer_confidenses = self.build_answers0(session, bot, interlocutor, interpreted_phrase)
@@ -1352,8 +1456,11 @@ class SimpleAnsweringMachine(BaseAnsweringMachine):
         return answers
 
     def pop_phrase(self, bot, interlocutor):
-        session = self.get_session(bot, interlocutor)
-        return session.extract_from_buffer()
+        with self.session_factory.lock_session(bot, interlocutor):
+            session = self.get_session(bot, interlocutor)
+            phrase = session.extract_from_buffer()
+            self.session_factory.store_session(session)
+            return phrase
 
     def get_session(self, bot, interlocutor):
         return self.session_factory.get_session(bot, interlocutor)
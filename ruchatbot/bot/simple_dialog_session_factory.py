@@ -1,4 +1,13 @@
 # -*- coding: utf-8 -*-
+"""
+18-10-2026 Ограничение числа живых сессий (LRU), вытеснение неактивных сессий по таймауту,
+           ограничение длины хранимой в памяти истории, обработчики вытеснения сессий.
+"""
+
+import collections
+import logging
+import threading
+import time
 
 from ruchatbot.bot.base_session_factory import BaseDialogSessionFactory
 from ruchatbot.bot.simple_dialog_session import SimpleDialogSession
@@ -7,20 +16,116 @@ from ruchatbot.bot.simple_dialog_session import SimpleDialogSession
 class SimpleDialogSessionFactory(BaseDialogSessionFactory):
     """
     Простейшее хранилище сессий диалога между ботами и собеседниками.
+
+    Сессии хранятся в памяти в порядке последнего обращения. Если число сессий превышает
+    max_sessions, или к сессии не обращались дольше session_ttl секунд, то она вытесняется.
+    Вытесненная сессия передается обработчикам, зарегистрированным через add_eviction_handler,
+    которые могут, например, сохранить ее на диск. При следующем обращении собеседника
+    сессия запрашивается у загрузчика (см. set_session_loader), а если его нет или он ничего
+    не вернул - создается новая.
     """
-    def __init__(self):
+    def __init__(self, max_sessions=100000, session_ttl=24*3600.0, max_history=200):
+        """
+        :param max_sessions: максимальное число сессий в памяти, None - без ограничения
+        :param session_ttl: через сколько секунд бездействия сессия вытесняется, None - никогда
+        :param max_history: сколько последних фраз диалога хранится в сессии, None - все
+        """
         super(SimpleDialogSessionFactory, self).__init__()
-        self.sessions = dict()
+        self.logger = logging.getLogger('SimpleDialogSessionFactory')
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.max_history = max_history
+        self.sessions = collections.OrderedDict()  # ключ сессии => (время последнего обращения, сессия)
+        self.lock = threading.RLock()
+        self.eviction_handlers = []
+        self.session_loader = None
+        self.nb_evicted = 0
+
+    def add_eviction_handler(self, handler):
+        """
+        :param handler: функция handler(session_key, session), вызывается для каждой вытесняемой сессии
+        """
+        self.eviction_handlers.append(handler)
+
+    def set_session_loader(self, loader):
+        """
+        :param loader: функция loader(session_key, bot, interlocutor_id), возвращающая ранее
+         вытесненную сессию или None
+        """
+        self.session_loader = loader
+
+    @staticmethod
+    def get_session_key(bot_id, interlocutor_id):
+        return bot_id + '|' + interlocutor_id
+
+    def create_session(self, bot, interlocutor_id):
+        return SimpleDialogSession(bot.get_bot_id(), interlocutor_id, bot.facts)
 
     def get_session(self, bot, interlocutor_id):
         assert(interlocutor_id is not None and len(interlocutor_id) != 0)
         assert(bot is not None)
 
-        session_key = bot.get_bot_id() + '|' + interlocutor_id
+        session_key = SimpleDialogSessionFactory.get_session_key(bot.get_bot_id(), interlocutor_id)
+        now = time.time()
+
+        with self.lock:
+            item = self.sessions.get(session_key)
+            if item is not None:
+                session = item[1]
+                self.sessions[session_key] = (now, session)
+                self.sessions.move_to_end(session_key)
+            else:
+                session = None
+                if self.session_loader:
+                    session = self.session_loader(session_key, bot, interlocutor_id)
+                    if session is not None:
+                        session.facts_storage = bot.facts
+
+                if session is None:
+                    # Создаем новую сессию для этой пары бота и пользователя
+                    session = self.create_session(bot, interlocutor_id)
+
+                session.set_max_history(self.max_history)
+                self.sessions[session_key] = (now, session)
+
+            self.evict_sessions(now)
+
+        return session
+
+    def evict_sessions(self, now=None):
+        """
+        Вытеснение сессий, неактивных дольше session_ttl, и самых давних сессий сверх max_sessions.
+        Сессии упорядочены по времени обращения, поэтому проверяются только самые старые.
+        """
+        if now is None:
+            now = time.time()
+
+        evicted = []
+        with self.lock:
+            while self.sessions:
+                session_key, (last_access, session) = next(iter(self.sessions.items()))
+                overflow = self.max_sessions is not None and len(self.sessions) > self.max_sessions
+                expired = self.session_ttl is not None and now - last_access > self.session_ttl
+                if not overflow and not expired:
+                    break
+
+                del self.sessions[session_key]
+                evicted.append((session_key, session))
+
+            self.nb_evicted += len(evicted)
 
-        if session_key not in self.sessions:
-            # Создаем новую сессию для этой пары бота и пользователя
-            self.sessions[session_key] = SimpleDialogSession(bot.get_bot_id(), interlocutor_id, bot.facts)
+            # Обработчики вызываются под блокировкой, чтобы сохраняемую сессию нельзя было
+            # одновременно запросить через загрузчик.
+            for session_key, session in evicted:
+                for handler in self.eviction_handlers:
+                    try:
+                        handler(session_key, session)
+                    except Exception as ex:
+                        self.logger.error(u'Eviction handler failed for session "%s": %s', session_key, ex)
 
-        return self.sessions[session_key]
+    def __len__(self):
+        return len(self.sessions)
 
+    def get_stats(self):
+        with self.lock:
+            return {'sessions': len(self.sessions), 'evicted': self.nb_evicted}
@@ -2,6 +2,7 @@
 """
 29.06.2020 Добавлены динамические факты "current_day_month" со строкой типа "сегодня 29 июня" и
            "current_year" со строкой типа "сейчас 2020 год"
+18-10-2026 Динамические факты строятся один раз на каждую минуту и хранятся отдельно (enumerate_dynamic_facts)
 """
 
 
@@ -20,6 +21,11 @@ class SimpleFactsStorage(BaseFactsStorage):
        методом enumerate_facts.
     """
 
+    # Метки динамических фактов, которые строит build_dynamic_facts
+    DYNAMIC_FACT_IDS = frozenset(['current_day_of_week', 'yesterday_day_of_week', 'tomorrow_day_of_week',
+                                  'current_season', 'current_month', 'current_time',
+                                  'current_day_month', 'current_year'])
+
     def __init__(self, text_utils):
         """
         :param text_utils: экземпляр класса TextUtils
@@ -27,6 +33,9 @@ class SimpleFactsStorage(BaseFactsStorage):
         super(SimpleFactsStorage, self).__init__()
         self.text_utils = text_utils
 
+        # (метка минуты, кортеж динамических фактов)
+        self.dynamic_facts = None
+
     def reset_added_facts(self):
         pass
 
@@ -34,12 +43,40 @@ class SimpleFactsStorage(BaseFactsStorage):
         return []
 
     def enumerate_facts(self, interlocutor):
+        return self.enumerate_dynamic_facts()
+
+    def has_interlocutor_facts(self, interlocutor):
+        return False
+
+    def is_dynamic_fact(self, fact):
+        return fact[2] in SimpleFactsStorage.DYNAMIC_FACT_IDS
+
+    def enumerate_dynamic_facts(self):
+        """
+        Динамические факты (день недели, время года, текущее время etc) меняются не чаще
+        раза в минуту, поэтому строим их один раз для каждой минуты и отдаем готовый кортеж.
+        Тексты фактов остаются теми же объектами в пределах минуты, так что их признаки
+        в моделях берутся из кэшей, а пересчитываются только действительно изменившиеся факты.
+        """
+        now = datetime.datetime.now()
+        bucket = (now.year, now.month, now.day, now.hour, now.minute)
+        cached = self.dynamic_facts
+        if cached is None or cached[0] != bucket:
+            cached = (bucket, tuple(self.build_dynamic_facts(now)))
+            self.dynamic_facts = cached
+        return cached[1]
+
+    def build_dynamic_facts(self, now):
+        """
+        :param now: момент времени, для которого строятся факты
+        :return: список кортежей (текст_факта, лицо, метка_факта)
+        """
         memory_phrases = []
 
         # Добавляем динамические факты
         # ==== День недели ====
         dwos = 'понедельник вторник среда четверг пятница суббота воскресенье'.split()
-        today = datetime.datetime.today()
+        today = now
         s = dwos[today.weekday()]
         memory_phrases.append(('сегодня ' + s, '3', 'current_day_of_week'))
 
@@ -58,7 +95,7 @@ class SimpleFactsStorage(BaseFactsStorage):
 
 
         # === Время года ===
-        cur_month = datetime.datetime.now().month
+        cur_month = now.month
         season = {12: u'зима', 1: u'зима', 2: u'зима',
                   3: u'весна', 4: u'весна', 5: u'весна',
                   6: u'лето', 7: u'лето', 8: u'лето',
@@ -72,8 +109,8 @@ class SimpleFactsStorage(BaseFactsStorage):
         memory_phrases.append((u'сейчас ' + month, '3', 'current_month'))
 
         # Добавляем текущее время с точностью до минуты
-        current_minute = datetime.datetime.now().minute
-        current_hour = datetime.datetime.now().hour
+        current_minute = now.minute
+        current_hour = now.hour
         current_time = u'Сейчас ' + str(current_hour)
         if 20 >= current_hour >= 5:
             current_time += u' часов '
@@ -95,7 +132,7 @@ class SimpleFactsStorage(BaseFactsStorage):
         memory_phrases.append((current_time, '3', 'current_time'))
 
         # Текущая дата в формате "29 июня"
-        cur_day = datetime.datetime.now().day
+        cur_day = now.day
         month_gen = {1: u'января', 2: u'февраля', 3: u'марта',
                      4: u'апреля', 5: u'мая', 6: u'июня', 7: u'июля',
                      8: u'августа', 9: u'сентября', 10: u'октября', 11: u'ноября', 12: u'декабря'}[cur_month]
@@ -104,10 +141,6 @@ class SimpleFactsStorage(BaseFactsStorage):
         # Текущий год
         memory_phrases.append(('сейчас {} год'.format(today.year), '3', 'current_year'))
 
-        # возвращаем список фактов (потом надо переделать на выдачу по мере чтения из файла и
-        # генерации через yield).
-        #for f in memory_phrases:
-        #    yield f
         return memory_phrases
 
     def store_new_fact(self, interlocutor, fact, unique):
@@ -52,6 +52,9 @@ class SmalltalkComplexCondition(SmalltalkBaseCondition):
     def get_key(self):
         return self.condition.get_key()
 
+    def get_text_etalons(self):
+        return self.condition.get_text_etalons()
+
     def __repr__(self):
         return self.condition.get_short_repr()
 
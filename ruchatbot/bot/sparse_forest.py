@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Вычисление ансамбля деревьев LightGBM для разреженных бинарных признаков шинглов.
+
+Признаки в моделях релевантности и синонимичности принимают только значения 0 и 1,
+причем в каждой строке единиц всего несколько десятков из многих тысяч. Поэтому
+для каждого узла заранее известно, в какую ветку он отправит 0 и в какую 1, и
+обход деревьев сводится к схеме QuickScorer: каждый активный признак строки
+"выключает" листья у тех узлов, где единица уходит вправо, а выходной лист дерева -
+самый левый из оставшихся. Проверяются только активные id признаков строки, плотная
+матрица не строится.
+"""
+
+import numpy as np
+
+
+class SparseBinaryForest(object):
+    """
+    Ансамбль деревьев, выгруженный из lightgbm.Booster в плоские массивы numpy.
+    Результат predict совпадает с lightgbm.Booster.predict для матриц из нулей и единиц.
+    """
+    def __init__(self):
+        self.nb_trees = 0
+        self.nb_features = 0
+        self.feature_ptr = None  # для признака f записи его узлов лежат в диапазоне feature_ptr[f]:feature_ptr[f+1]
+        self.node_trees = None  # номер дерева для узла
+        self.node_masks = None  # битовая маска листьев, которые остаются возможными при активном признаке узла
+        self.leaf_ptr = None  # смещение листьев дерева в leaf_values
+        self.leaf_values = None
+        self.average_output = False
+        self.sigmoid = None  # None для регрессии, иначе параметр сигмоиды бинарной классификации
+
+    @staticmethod
+    def from_booster(booster):
+        """
+        Выгружаем деревья из обученной модели. Для неподдерживаемых моделей (мультикласс,
+        категориальные признаки, деревья больше чем на 64 листа) выбрасывается NotImplementedError.
+        """
+        model = booster.dump_model()
+
+        if model['num_tree_per_iteration'] != 1:
+            raise NotImplementedError('Multiclass LightGBM models are not supported')
+
+        forest = SparseBinaryForest()
+        forest.nb_features = model['max_feature_idx'] + 1
+        forest.average_output = bool(model.get('average_output', False))
+
+        objective = model['objective'].split()
+        if objective[0] == 'binary':
+            forest.sigmoid = 1.0
+            for param in objective[1:]:
+                if param.startswith('sigmoid:'):
+                    forest.sigmoid = float(param.split(':')[1])
+        elif objective[0] == 'cross_entropy':
+            forest.sigmoid = 1.0
+        elif objective[0].startswith('regression') or objective[0] in ('huber', 'fair', 'quantile', 'mape'):
+            forest.sigmoid = None
+        else:
+            raise NotImplementedError('LightGBM objective "{}" is not supported'.format(model['objective']))
+
+        node_features = []
+        node_trees = []
+        node_masks = []
+        leaf_values = []
+        leaf_ptr = [0]
+
+        for itree, tree_info in enumerate(model['tree_info']):
+            tree_leaves = []
+            tree_nodes = []
+            forest._export_node(tree_info['tree_structure'], tree_leaves, tree_nodes)
+            if len(tree_leaves) > 64:
+                raise NotImplementedError('Trees with more than 64 leaves are not supported')
+
+            for feature, leaf_from, leaf_to in tree_nodes:
+                # Активный признак отправляет обход вправо, поэтому листья левого поддерева
+                # с номерами leaf_from..leaf_to-1 становятся недостижимыми.
+                mask = ((1 << 64) - 1) ^ (((1 << (leaf_to - leaf_from)) - 1) << leaf_from)
+                node_features.append(feature)
+                node_trees.append(itree)
+                node_masks.append(mask)
+
+            leaf_values.extend(tree_leaves)
+            leaf_ptr.append(len(leaf_values))
+
+        forest.nb_trees = len(model['tree_info'])
+        forest.leaf_values = np.array(leaf_values, dtype=np.float64)
+        forest.leaf_ptr = np.array(leaf_ptr, dtype=np.int64)
+
+        node_features = np.array(node_features, dtype=np.int64)
+        order = np.argsort(node_features, kind='stable')
+        forest.node_trees = np.array(node_trees, dtype=np.int64)[order]
+        forest.node_masks = np.array(node_masks, dtype=np.uint64)[order]
+        forest.feature_ptr = np.zeros(forest.nb_features + 1, dtype=np.int64)
+        np.cumsum(np.bincount(node_features, minlength=forest.nb_features), out=forest.feature_ptr[1:])
+
+        return forest
+
+    def _export_node(self, node, tree_leaves, tree_nodes):
+        """
+        Рекурсивно нумеруем листья слева направо. Ветки узла упорядочиваем так, чтобы
+        нулевое значение признака всегда шло влево; в tree_nodes попадают только узлы,
+        в которых единица уходит вправо, вместе с диапазоном листьев их левого поддерева.
+        """
+        if 'leaf_value' in node:
+            tree_leaves.append(node['leaf_value'])
+            return
+
+        if node['decision_type'] != '<=':
+            raise NotImplementedError('Categorical splits are not supported')
+
+        threshold = node['threshold']
+        if node['missing_type'] == 'Zero':
+            # Нули в такой ветке считаются пропусками и уходят по default_left
+            zero_left = node['default_left']
+        else:
+            zero_left = 0.0 <= threshold
+        one_left = 1.0 <= threshold
+
+        if zero_left:
+            zero_child, one_child = node['left_child'], node['right_child']
+        else:
+            zero_child, one_child = node['right_child'], node['left_child']
+
+        if zero_left == one_left:
+            # Результат узла не зависит от значения признака
+            self._export_node(zero_child, tree_leaves, tree_nodes)
+        else:
+            leaf_from = len(tree_leaves)
+            self._export_node(zero_child, tree_leaves, tree_nodes)
+            tree_nodes.append((node['split_feature'], leaf_from, len(tree_leaves)))
+            self._export_node(one_child, tree_leaves, tree_nodes)
+
+    def predict_raw(self, X_data):
+        """
+        :param X_data: scipy.sparse.csr_matrix из нулей и единиц
+        :return: сырые (до сигмоиды) выходы ансамбля для строк матрицы
+        """
+        nb_rows = X_data.shape[0]
+        masks = np.full(nb_rows * self.nb_trees, np.uint64((1 << 64) - 1), dtype=np.uint64)
+
+        # Учитываем только ненулевые ячейки строк. Id признаков, которых модель не видела
+        # при обучении, в деревьях не встречаются.
+        indices = X_data.indices.astype(np.int64)
+        rows = np.repeat(np.arange(nb_rows, dtype=np.int64), np.diff(X_data.indptr))
+        active = (indices < self.nb_features) & (X_data.data != 0)
+        indices = indices[active]
+        rows = rows[active]
+
+        starts = self.feature_ptr[indices]
+        counts = self.feature_ptr[indices + 1] - starts
+        nb_hits = int(counts.sum())
+        if nb_hits > 0:
+            # Для каждой пары (строка, активный признак) выбираем все узлы этого признака.
+            offsets = np.cumsum(counts) - counts
+            inodes = np.repeat(starts - offsets, counts) + np.arange(nb_hits, dtype=np.int64)
+            keys = np.repeat(rows, counts) * self.nb_trees + self.node_trees[inodes]
+            order = np.argsort(keys, kind='stable')
+            keys = keys[order]
+            hit_masks = self.node_masks[inodes[order]]
+            uniq_keys, key_starts = np.unique(keys, return_index=True)
+            masks[uniq_keys] = np.bitwise_and.reduceat(hit_masks, key_starts)
+
+        # Выходной лист - младший установленный бит маски.
+        lowest_bit = masks & (~masks + np.uint64(1))
+        ileaf = np.frexp(lowest_bit.astype(np.float64))[1].astype(np.int64) - 1
+        ileaf = ileaf.reshape(nb_rows, self.nb_trees) + self.leaf_ptr[:-1]
+        y = self.leaf_values[ileaf].sum(axis=1)
+        if self.average_output and self.nb_trees > 0:
+            y /= self.nb_trees
+        return y
+
+    def predict(self, X_data):
+        y = self.predict_raw(X_data)
+        if self.sigmoid is not None:
+            y = 1.0 / (1.0 + np.exp(-self.sigmoid * y))
+        return y
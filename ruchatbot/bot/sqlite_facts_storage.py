@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилище фактов, в котором новые факты, полученные в диалоге, сохраняются в базе SQLite
+отдельно для каждого собеседника. Статические факты профиля загружаются из файла один раз
+и общие для всех собеседников (см. ProfileFactsReader).
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+
+from ruchatbot.bot.profile_facts_reader import ProfileFactsReader
+
+
+class SQLiteFactsStorage(ProfileFactsReader):
+    """
+    Факты собеседника хранятся в таблице facts с индексом по (interlocutor, fact_id), поэтому
+    чтение и замена уникальных фактов не зависят от того, сколько фактов накопили другие собеседники.
+    """
+
+    def __init__(self, text_utils, profile_path, constants, db_path, models_folder=None, hot_reload=False):
+        """
+        :param db_path: путь к файлу базы SQLite, создается при необходимости
+        """
+        super(SQLiteFactsStorage, self).__init__(text_utils, profile_path, constants, models_folder, hot_reload)
+        self.logger = logging.getLogger('SQLiteFactsStorage')
+        self.db_path = db_path
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        self.logger.info(u'Opening facts database "%s"', db_path)
+        self.lock = threading.Lock()
+        self.parent_conn = None
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS facts ('
+                              'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                              'interlocutor TEXT NOT NULL, '
+                              'fact_id TEXT NOT NULL, '
+                              'fact_text TEXT NOT NULL, '
+                              'person TEXT NOT NULL)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS facts_interlocutor_fact_id ON facts (interlocutor, fact_id)')
+
+    def after_fork(self):
+        # Соединение SQLite, унаследованное от родительского процесса, нельзя ни использовать, ни закрывать.
+        self.parent_conn = self.conn
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def reset_added_facts(self):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM facts')
+
+    def enumerate_interlocutor_facts(self, interlocutor):
+        """
+        Факты, добавленные в ходе диалога с собеседником, в порядке добавления.
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT fact_text, person, fact_id FROM facts WHERE interlocutor=? ORDER BY id',
+                                     (interlocutor,)).fetchall()
+        return [tuple(row) for row in rows]
+
+    def has_interlocutor_facts(self, interlocutor):
+        with self.lock:
+            row = self.conn.execute('SELECT 1 FROM facts WHERE interlocutor=? LIMIT 1', (interlocutor,)).fetchone()
+        return row is not None
+
+    def enumerate_facts_snapshot(self, interlocutor):
+        self.load_profile()
+        return self.get_facts_snapshot(tuple(self.enumerate_interlocutor_facts(interlocutor)))
+
+    def enumerate_facts(self, interlocutor):
+        # Загрузим факты из профиля, если еще не загрузили.
+        self.load_profile()
+
+        for f in self.enumerate_interlocutor_facts(interlocutor):
+            yield f
+
+        for f in self.profile_facts:
+            yield f
+
+        # факты о текущем времени и т.д.
+        for f in self.enumerate_dynamic_facts():
+            yield f
+
+    def store_new_fact(self, interlocutor, fact, unique):
+        fact_text, person, fact_id = fact
+        with self.lock, self.conn:
+            if unique:
+                # Факт с меткой fact_id заменяется, а не добавляется еще раз. Поиск идет по индексу.
+                cur = self.conn.execute('UPDATE facts SET fact_text=?, person=? WHERE interlocutor=? AND fact_id=?',
+                                        (fact_text, person, interlocutor, fact_id))
+                if cur.rowcount > 0:
+                    return
+
+            self.conn.execute('INSERT INTO facts (interlocutor, fact_id, fact_text, person) VALUES (?, ?, ?, ?)',
+                              (interlocutor, fact_id, fact_text, person))
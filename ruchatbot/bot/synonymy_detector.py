@@ -15,12 +15,40 @@ class SynonymyDetector(ModelApplicator):
     def __init__(self):
         super(SynonymyDetector, self).__init__()
 
-    def get_most_similar(self, probe_phrase, phrases, text_utils, nb_results=1):
+    def get_most_similar(self, probe_phrase, phrases, text_utils, nb_results=1, phrases_key=None):
+        """
+        :param phrases_key: ключ, под которым модель может кэшировать данные, подготовленные для списка
+         phrases, см. RelevancyDetector.get_most_relevant
+        """
         raise NotImplementedError()
 
+    def get_most_similar_many(self, probe_phrases, phrases, text_utils, nb_results=1, phrases_key=None):
+        """
+        Поиск ближайших синонимов сразу для нескольких фраз.
+        Возвращается список результатов get_most_similar для каждой фразы из probe_phrases.
+        Производные классы могут переопределить метод, чтобы оценивать все пары одним вызовом модели.
+        """
+        return [self.get_most_similar(probe_phrase, phrases, text_utils, nb_results=nb_results, phrases_key=phrases_key)
+                for probe_phrase in probe_phrases]
+
     def calc_synonymy2(self, phrase1, phrase2, text_utils):
         raise NotImplementedError()
 
+    def precompute(self, phrases, text_utils):
+        """
+        Заранее подготовить данные модели для статичных эталонных фраз (вопросы FAQ, ключевые
+        фразы историй, эталоны в условиях правил), с которыми потом будут сравниваться реплики собеседника.
+        По умолчанию ничего не делает.
+        """
+        pass
+
+    def preload_compiled_facts(self, compiled_facts):
+        """
+        Использовать заранее вычисленные признаки фактов из скомпилированной базы (см. CompiledFacts).
+        По умолчанию ничего не делает.
+        """
+        pass
+
     def get_threshold(self):
         """
         Возвращаемая моделью оценка синонимичности часто нужна не только для выбора лучшего
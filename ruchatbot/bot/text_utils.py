@@ -62,10 +62,18 @@ class TextUtils(object):
         self.lemmatizer = rulemma.Lemmatizer()
         self.word_embeddings = None
 
-    def load_embeddings(self, w2v_dir, wc2v_dir):
+    def load_embeddings(self, w2v_dir, wc2v_dir, load_nn_models=True, oov_vectors_path=None):
+        """
+        :param load_nn_models: False - отложить загрузку нейросетевой модели wordchar2vector
+         до вызова load_nn_models (например, до запуска рабочих процессов сервиса).
+        :param oov_vectors_path: файл, в котором сохраняются векторы новых слов, построенные wordchar2vector
+        """
         # Загрузка векторных словарей
         self.word_embeddings = WordEmbeddings()
-        self.word_embeddings.load_models(w2v_dir)
+        self.nn_models_folder = w2v_dir
+        self.oov_vectors_path = oov_vectors_path
+        if load_nn_models:
+            self.load_nn_models()
 
         p = os.path.join(wc2v_dir, 'wc2v.kv')
         self.word_embeddings.load_wc2v_model(p)
@@ -73,6 +81,9 @@ class TextUtils(object):
         p = os.path.join(w2v_dir, 'w2v.kv')
         self.word_embeddings.load_w2v_model(p)
 
+    def load_nn_models(self):
+        self.word_embeddings.load_models(self.nn_models_folder, self.oov_vectors_path)
+
     def load_dictionaries(self, data_folder, models_folder):
         self.lemmatizer.load()
 
@@ -232,3 +243,6 @@ class TextUtils(object):
 
     def word_similarity(self, word1, word2):
         return self.word_embeddings.word_similarity(word1, word2)
+
+    def find_similar_words(self, words, min_similarity):
+        return self.word_embeddings.find_similar_words(words, min_similarity)
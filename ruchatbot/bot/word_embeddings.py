@@ -1,6 +1,13 @@
 # -*- coding: utf-8 -*-
+"""
+Векторные модели слов (w2v и посимвольные векторы wordchar2vector) для нейросетевых моделей чатбота.
+
+18-10-2026 Объединенная матрица векторов [w2v | wc2v] для слов словаря wc2v: векторизация фраз
+           выполняется выборкой строк матрицы по номерам слов
+"""
 
 import os
+import json
 import gensim
 import logging
 import numpy as np
@@ -19,20 +26,25 @@ class WordEmbeddings(object):
     def __init__(self):
         self.wc2v = None
         self.wc2v_dims = None
+        self.wc2v_path = None
         self.w2v = dict()
         self.w2v_dims = dict()
+        self.word2row = None  # слово из словаря wc2v => номер строки в объединенных матрицах
+        self.fused_vectors = dict()  # имя файла w2v => объединенная матрица векторов [w2v | wc2v]
+        self.fused_w2v_norms = dict()  # имя файла w2v => нормы w2v-частей строк, 0 для слов без w2v вектора
         self.wordchar2vector_model = None
         self.logger = logging.getLogger('WordEmbeddings')
 
-    def load_models(self, models_folder):
+    def load_models(self, models_folder, oov_vectors_path=None):
         """
         Загружаются нейросетевые модели, позволяющие сгенерировать
         вектор нового слова. Для самых частотных слов готовые вектора
         рассчитаны заранее и сохранены в файле, поэтому они будут
         обработаны объектом self.wc2v.
+        :param oov_vectors_path: файл для сохранения векторов новых слов между запусками
         """
         self.wordchar2vector_model = Wordchar2VectorModel()
-        self.wordchar2vector_model.load(models_folder)
+        self.wordchar2vector_model.load(models_folder, oov_vectors_path)
 
     def load_wc2v_model(self, wc2v_path):
         self.logger.info(u'Loading wordchar2vector from "%s"', wc2v_path)
@@ -41,6 +53,8 @@ class WordEmbeddings(object):
         else:
             self.wc2v = gensim.models.KeyedVectors.load_word2vec_format(wc2v_path, binary=False)
         self.wc2v_dims = len(self.wc2v.vectors[0])
+        self.wc2v_path = wc2v_path
+        self.word2row = dict((word, irow) for irow, word in enumerate(WordEmbeddings.get_vocabulary(self.wc2v)))
 
     def load_w2v_model(self, w2v_path):
         w2v_filename = os.path.basename(w2v_path)
@@ -56,9 +70,147 @@ class WordEmbeddings(object):
             self.w2v[w2v_filename] = w2v
             self.w2v_dims[w2v_filename] = len(w2v.vectors[0])
 
+            if self.wc2v is not None:
+                self.load_fused_vectors(w2v_path)
+
+    @staticmethod
+    def get_vocabulary(kv):
+        # Список слов в порядке строк матрицы векторов, в gensim 4 атрибут переименован.
+        return kv.index_to_key if hasattr(kv, 'index_to_key') else kv.index2word
+
+    def load_fused_vectors(self, w2v_path):
+        """
+        Объединенная матрица строится один раз и сохраняется рядом с файлом w2v, затем отображается
+        в память, так что рабочие процессы бота разделяют ее через page cache. Строки матрицы
+        соответствуют словам wc2v, для слов без w2v вектора первая часть строки нулевая.
+        """
+        w2v_filename = os.path.basename(w2v_path)
+        w2v = self.w2v[w2v_filename]
+        w2v_dims = self.w2v_dims[w2v_filename]
+
+        base_path = os.path.join(os.path.dirname(w2v_path), 'fused_' + os.path.splitext(w2v_filename)[0])
+        fused_path = base_path + '.npy'
+        norms_path = base_path + '.norms.npy'
+        signature_path = base_path + '.json'
+
+        signature = dict()
+        for name, path in (('w2v', w2v_path), ('wc2v', self.wc2v_path)):
+            st = os.stat(path)
+            signature[name] = [os.path.basename(path), st.st_size, int(st.st_mtime)]
+
+        if os.path.exists(signature_path) and os.path.exists(fused_path) and os.path.exists(norms_path):
+            with open(signature_path, 'r') as f:
+                if json.load(f) == signature:
+                    self.fused_vectors[w2v_filename] = np.load(fused_path, mmap_mode='r')
+                    self.fused_w2v_norms[w2v_filename] = np.load(norms_path, mmap_mode='r')
+                    return
+
+        self.logger.info(u'Building fused vectors matrix "%s"', fused_path)
+        nb_rows = len(self.word2row)
+        shape = (nb_rows, w2v_dims + self.wc2v_dims)
+
+        # Старые файлы могут быть отображены в память другими процессами бота, поэтому новая
+        # матрица пишется во временные файлы, которые потом атомарно заменяют старые.
+        tmp_suffix = '.tmp{}'.format(os.getpid())
+        try:
+            fused = np.lib.format.open_memmap(fused_path + tmp_suffix, mode='w+', dtype=np.float32, shape=shape)
+        except (IOError, OSError) as ex:
+            self.logger.warning(u'Could not create "%s", fused matrix is kept in memory: %s', fused_path, ex)
+            fused_path = None
+            fused = np.zeros(shape, dtype=np.float32)
+
+        w2v_rows = dict((word, irow) for irow, word in enumerate(WordEmbeddings.get_vocabulary(w2v)))
+        norms = np.zeros(nb_rows, dtype=np.float32)
+        wc2v_vocab = WordEmbeddings.get_vocabulary(self.wc2v)
+        chunk_size = 65536
+        for start in range(0, nb_rows, chunk_size):
+            end = min(start + chunk_size, nb_rows)
+            fused[start:end, w2v_dims:] = self.wc2v.vectors[start:end]
+
+            src_rows = np.array([w2v_rows.get(word, -1) for word in wc2v_vocab[start:end]], dtype=np.int64)
+            mask = src_rows >= 0
+            if mask.any():
+                v = np.asarray(w2v.vectors[src_rows[mask]], dtype=np.float32)
+                dst_rows = np.nonzero(mask)[0] + start
+                fused[dst_rows, :w2v_dims] = v
+                norms[dst_rows] = np.linalg.norm(v, axis=1)
+
+        if fused_path is None:
+            self.fused_vectors[w2v_filename] = fused
+            self.fused_w2v_norms[w2v_filename] = norms
+            return
+
+        fused.flush()
+        del fused
+        with open(norms_path + tmp_suffix, 'wb') as f:
+            np.save(f, norms)
+        with open(signature_path + tmp_suffix, 'w') as f:
+            json.dump(signature, f)
+
+        # Сигнатура заменяется последней, чтобы она не подтверждала еще не замененную матрицу.
+        os.replace(fused_path + tmp_suffix, fused_path)
+        os.replace(norms_path + tmp_suffix, norms_path)
+        os.replace(signature_path + tmp_suffix, signature_path)
+
+        self.fused_vectors[w2v_filename] = np.load(fused_path, mmap_mode='r')
+        self.fused_w2v_norms[w2v_filename] = np.load(norms_path, mmap_mode='r')
+
+    def build_oov_vectors(self, words):
+        """
+        Векторы всех слов, которых нет в wc2v, строятся одним вызовом модели wordchar2vector
+        и кэшируются. Вызывается перед векторизацией нескольких фраз.
+        """
+        oov_words = [word for word in words if word != PAD_WORD and word not in self.wc2v]
+        if oov_words:
+            return self.wordchar2vector_model.build_vectors(oov_words)
+        return []
+
     def vectorize_words(self, w2v_filename, words, X_batch, irow):
+        self.vectorize_batch(w2v_filename, [words], X_batch, irow)
+
+    def vectorize_batch(self, w2v_filename, word_seqs, X_batch, start_row=0):
+        """
+        Заполнение строк X_batch начиная с start_row векторами слов из списка фраз word_seqs.
+        Векторы слов из словаря wc2v берутся из объединенной матрицы одной выборкой по номерам строк.
+        """
+        fused = self.fused_vectors.get(w2v_filename)
+        if fused is None:
+            for iseq, words in enumerate(word_seqs):
+                self.vectorize_words0(w2v_filename, words, X_batch, start_row + iseq)
+            return
+
+        rows = []
+        positions = []
+        oov_positions = []
+        for iseq, words in enumerate(word_seqs):
+            for iword, word in enumerate(words):
+                if word != PAD_WORD:
+                    row = self.word2row.get(word)
+                    if row is not None:
+                        rows.append(row)
+                        positions.append((start_row + iseq, iword))
+                    else:
+                        oov_positions.append((start_row + iseq, iword, word))
+
+        if rows:
+            ix = np.array(positions, dtype=np.int64)
+            X_batch[ix[:, 0], ix[:, 1]] = fused[np.array(rows, dtype=np.int64)]
+
+        if oov_positions:
+            # Слов нет в wc2v, их векторы строит модель wordchar2vector.
+            w2v = self.w2v[w2v_filename]
+            w2v_dims = self.w2v_dims[w2v_filename]
+            oov_vectors = self.build_oov_vectors([word for _, _, word in oov_positions])
+            for (irow, iword, word), v in zip(oov_positions, oov_vectors):
+                if word in w2v:
+                    X_batch[irow, iword, :w2v_dims] = w2v[word]
+                X_batch[irow, iword, w2v_dims:] = v
+
+    def vectorize_words0(self, w2v_filename, words, X_batch, irow):
         w2v = self.w2v[w2v_filename]
         w2v_dims = self.w2v_dims[w2v_filename]
+        oov_words = [word for word in words if word != PAD_WORD and word not in self.wc2v]
+        oov_vectors = dict(zip(oov_words, self.build_oov_vectors(oov_words)))
         for iword, word in enumerate(words):
             if word != PAD_WORD:
                 if word in w2v:
@@ -66,9 +218,15 @@ class WordEmbeddings(object):
                 if word in self.wc2v:
                     X_batch[irow, iword, w2v_dims:] = self.wc2v[word]
                 else:
-                    X_batch[irow, iword, w2v_dims:] = self.wordchar2vector_model.build_vector(word)
+                    X_batch[irow, iword, w2v_dims:] = oov_vectors[word]
 
     def vectorize_word1(self, w2v_filename, word):
+        fused = self.fused_vectors.get(w2v_filename)
+        if fused is not None:
+            row = self.word2row.get(word)
+            if row is not None:
+                return np.array(fused[row])
+
         w2v = self.w2v[w2v_filename]
         w2v_dims = self.w2v_dims[w2v_filename]
         v = np.zeros((self.wc2v_dims+w2v_dims), dtype=np.float32)
@@ -82,8 +240,51 @@ class WordEmbeddings(object):
         return v
 
     def word_similarity(self, word1, word2):
-        w2v = list(self.w2v.values())[0]
+        w2v_filename = list(self.w2v.keys())[0]
+        fused = self.fused_vectors.get(w2v_filename)
+        if fused is not None:
+            row1 = self.word2row.get(word1)
+            row2 = self.word2row.get(word2)
+            if row1 is not None and row2 is not None:
+                norms = self.fused_w2v_norms[w2v_filename]
+                if norms[row1] > 0.0 and norms[row2] > 0.0:
+                    w2v_dims = self.w2v_dims[w2v_filename]
+                    v1 = np.asarray(fused[row1, :w2v_dims], dtype=np.float64)
+                    v2 = np.asarray(fused[row2, :w2v_dims], dtype=np.float64)
+                    cos = np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
+                    return 1.0 - abs(1.0 - float(cos))
+                else:
+                    return 0.0
+
+        w2v = self.w2v[w2v_filename]
         if word1 in w2v and word2 in w2v:
             return 1.0 - abs(scipy.spatial.distance.cosine(w2v[word1], w2v[word2]))
         else:
-            return 0.0
\ No newline at end of file
+            return 0.0
+
+    def find_similar_words(self, words, min_similarity):
+        """
+        Поиск всех слов словаря w2v, близких к заданным словам (та же мера, что в word_similarity).
+        :return: словарь слово => множество близких к нему слов, включая само слово
+        """
+        w2v = list(self.w2v.values())[0]
+        vocab = w2v.index_to_key if hasattr(w2v, 'index_to_key') else w2v.index2word
+
+        res = dict((word, {word}) for word in words)
+        known_words = [word for word in res if word in w2v]
+        if not known_words:
+            return res
+
+        q = np.array([w2v[word] for word in known_words], dtype=np.float32)
+        q /= np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-8)
+
+        # Словарь обрабатываем порциями, чтобы матрица близостей не занимала много памяти.
+        chunk_size = max(1, (1 << 24) // len(known_words))
+        for start in range(0, len(vocab), chunk_size):
+            v = np.asarray(w2v.vectors[start:start+chunk_size], dtype=np.float32)
+            v = v / np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-8)
+            sims = np.dot(v, q.T)
+            for iword, iknown in zip(*np.nonzero(sims >= min_similarity)):
+                res[known_words[iknown]].add(vocab[start+iword])
+
+        return res
\ No newline at end of file
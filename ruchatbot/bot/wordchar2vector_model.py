@@ -3,28 +3,48 @@
 Аппликатор модели wordchar2vector для чатбота.
 Используется для генерации векторов тех слов, которые заранее
 не обработаны (см. скрипт wordchar2vector.py в режиме --train 0 --vectorize 1)
+
+18-10-2026 Векторы всех новых слов батча строятся одним вызовом модели (build_vectors), кэш
+           векторов ограничен по размеру (LRU) и дополняется из файла, в который дописываются
+           векторы новых слов
 """
 
 from __future__ import print_function
 
 import numpy as np
 import os
+import io
 import json
 import logging
+import collections
+import threading
 
 # Для генерации символьных эмбеддингов новых слов нужна будет
 # обученная модель wordchar2vec.
 from keras.models import model_from_json
 
+from ruchatbot.utils.batch_predictor import BatchingPredictor
+
 
 class Wordchar2VectorModel:
-    def __init__(self):
+    def __init__(self, max_cached_words=100000):
+        """
+        :param max_cached_words: сколько векторов новых слов хранить в памяти
+        """
         self.logger = logging.getLogger('Wordchar2VectorModel')
         self.model = None
         self.model_config = None
-        self.word2vector = dict()
+        self.predictor = None
+        self.max_cached_words = max_cached_words
+        self.word2vector = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.oov_vectors_path = None
+        self.oov_vectors_fd = None
 
-    def load(self, models_folder):
+    def load(self, models_folder, oov_vectors_path=None):
+        """
+        :param oov_vectors_path: путь к файлу с ранее построенными векторами новых слов, None - не сохранять векторы
+        """
         self.logger.info('Loading Wordchar2VectorModel model files')
 
         with open(os.path.join(models_folder, 'wordchar2vector.config'), 'r') as f:
@@ -37,6 +57,7 @@ class Wordchar2VectorModel:
 
         weights_path = os.path.join(models_folder, os.path.basename(self.model_config['weights_path']))
         self.model.load_weights(weights_path)
+        self.predictor = BatchingPredictor(self.model)
 
         # прочие параметры
         self.vec_size = self.model_config['vec_size']
@@ -44,22 +65,113 @@ class Wordchar2VectorModel:
         self.char2index = self.model_config['char2index']
         self.nb_chars = len(self.char2index)
 
+        if oov_vectors_path:
+            self.open_oov_vectors(oov_vectors_path, weights_path)
+
+    def open_oov_vectors(self, oov_vectors_path, weights_path):
+        """
+        Файл векторов новых слов только дописывается, в том числе несколькими процессами бота.
+        Первая строка файла - сигнатура модели; если модель переобучена, файл создается заново.
+        """
+        st = os.stat(weights_path)
+        signature = u'# {} {} {} {}'.format(os.path.basename(weights_path), st.st_size, int(st.st_mtime), self.vec_size)
+
+        nb_loaded = 0
+        actual = False
+        if os.path.exists(oov_vectors_path):
+            with io.open(oov_vectors_path, 'r', encoding='utf-8') as rdr:
+                actual = rdr.readline().rstrip(u'\n') == signature
+                if actual:
+                    for line in rdr:
+                        if not line.endswith(u'\n'):
+                            # недописанная строка после аварийного завершения процесса
+                            continue
+
+                        tx = line[:-1].split(u'\t')
+                        if len(tx) != 2:
+                            # недописанная строка, закрытая при последующей дозаписи (см. store_vectors)
+                            continue
+
+                        try:
+                            v = np.array(tx[1].split(u' '), dtype=np.float32)
+                        except ValueError:
+                            continue
+
+                        if len(v) == self.vec_size:
+                            self.cache_vector(tx[0], v)
+                            nb_loaded += 1
+
+        if not actual:
+            self.logger.info(u'Creating OOV vectors file "%s"', oov_vectors_path)
+            with io.open(oov_vectors_path, 'w', encoding='utf-8') as wrt:
+                wrt.write(signature + u'\n')
+        else:
+            self.logger.info(u'%d OOV vectors loaded from "%s"', nb_loaded, oov_vectors_path)
+
+        self.oov_vectors_path = oov_vectors_path
+        self.oov_vectors_fd = os.open(oov_vectors_path, os.O_RDWR | os.O_APPEND)
+
+    def cache_vector(self, word, word_vect):
+        with self.lock:
+            self.word2vector[word] = word_vect
+            self.word2vector.move_to_end(word)
+            while len(self.word2vector) > self.max_cached_words:
+                self.word2vector.popitem(last=False)
+
+    def store_vectors(self, words, vectors):
+        lines = []
+        for word, v in zip(words, vectors):
+            if u'\t' not in word and u'\n' not in word:
+                lines.append(word + u'\t' + u' '.join('%.9g' % x for x in v) + u'\n')
+
+        # Все строки записываются одним вызовом write в режиме дозаписи,
+        # поэтому записи разных процессов не перемешиваются.
+        if lines:
+            data = u''.join(lines).encode('utf-8')
+
+            # Если процесс упал посреди записи, последняя строка файла не закончена. Закрываем ее
+            # лишним полем, чтобы при загрузке она была отброшена, а не склеилась с новой строкой.
+            size = os.fstat(self.oov_vectors_fd).st_size
+            if size > 0 and os.pread(self.oov_vectors_fd, 1, size - 1) != b'\n':
+                data = b'\t\n' + data
+
+            os.write(self.oov_vectors_fd, data)
+
     def vectorize_word(self, word, X_batch, irow):
-        for ich, ch in enumerate(word):
+        for ich, ch in enumerate(word[:X_batch.shape[1]]):
             if ch not in self.char2index:
                 self.logger.error(u'Char "{}" code={} word="{}" missing in char2index'.format(ch, ord(ch), word))
             else:
                 X_batch[irow, ich] = self.char2index[ch]
 
     def build_vector(self, word):
-        if word in self.word2vector:
-            return self.word2vector[word]
+        return self.build_vectors([word])[0]
+
+    def build_vectors(self, words):
+        """
+        Векторы для списка слов. Векторы слов, которых нет в кэше, строятся одним вызовом модели.
+        """
+        vectors = dict()
+        with self.lock:
+            for word in words:
+                v = self.word2vector.get(word)
+                if v is not None:
+                    self.word2vector.move_to_end(word)
+                    vectors[word] = v
+
+        new_words = [word for word in collections.OrderedDict.fromkeys(words) if word not in vectors]
+        if new_words:
+            X_data = np.zeros((len(new_words), self.max_word_len + 2), dtype=np.int32)
+            for iword, word in enumerate(new_words):
+                self.vectorize_word(word, X_data, iword)
+
+            y_pred = self.predictor.predict(X_data)
 
-        X_data = np.zeros((1, self.max_word_len + 2), dtype=np.int32)
-        self.vectorize_word(word, X_data, 0)
+            for word, word_vect in zip(new_words, y_pred):
+                vectors[word] = word_vect
+                self.cache_vector(word, word_vect)
 
-        y_pred = self.model.predict(x=X_data, verbose=0)
+            if self.oov_vectors_fd is not None:
+                self.store_vectors(new_words, y_pred)
 
-        word_vect = y_pred[0, :]
-        self.word2vector[word] = word_vect
-        return word_vect
+        return [vectors[word] for word in words]
@@ -4,5 +4,10 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 
 class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'ChatBot-service-key'
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, '../../tmp/kb.sqlite')
+    FACTS_DB_PATH = os.path.join(basedir, '../../tmp/kb.sqlite')
+    SESSIONS_DB_PATH = os.path.join(basedir, '../../tmp/sessions.sqlite')
+    OOV_VECTORS_PATH = os.path.join(basedir, '../../tmp/wc2v_oov.txt')
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + FACTS_DB_PATH
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    PREDICT_BATCH_WINDOW = 0.005  # сколько секунд собирать одновременные запросы к моделям в батч
+    PUSH_WORKERS = 16  # потоки для параллельной обработки реплик в POST /v1/push
@@ -3,6 +3,7 @@
 from __future__ import print_function
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from flask import Flask
 from flask import request
@@ -11,10 +12,86 @@ from flask import jsonify
 from sqlalchemy.sql import text
 
 from .config import Config
+from ruchatbot.utils.batch_predictor import BatchingPredictor
+from ruchatbot.bot.session_store import SessionLockTimeout
 
 flask_app = Flask(__name__)
 
 #flask_app.config['SECRET_KEY'] = 'ChatBot-service-key'
 flask_app.config.from_object(Config)
 
-# TODO ...
+# Реплики разных собеседников обрабатываются параллельно, а вызовы нейросетевых моделей
+# из параллельных потоков, пришедшие в пределах короткого окна, выполняются одним батчем.
+BatchingPredictor.window = Config.PREDICT_BATCH_WINDOW
+push_executor = ThreadPoolExecutor(max_workers=Config.PUSH_WORKERS)
+
+
+def process_push(bot, user_id, utterance):
+    """
+    Обработка реплики собеседника и выборка всех ответных реплик бота.
+    Если сессию собеседника долго не отпускает другой процесс, вместо ответов возвращается ошибка.
+    """
+    try:
+        with bot.get_engine().get_session_factory().lock_session(bot, user_id):
+            bot.push_phrase(user_id, utterance)
+
+            replies = []
+            while True:
+                answer = bot.pop_phrase(user_id)
+                if len(answer) == 0:
+                    break
+                replies.append(answer)
+    except SessionLockTimeout:
+        return {'user_id': user_id, 'error': 'session is busy'}
+
+    return {'user_id': user_id, 'replies': replies}
+
+
+def parse_push_item(item):
+    if not isinstance(item, dict):
+        raise ValueError('request item must be an object')
+
+    user_id = item.get('user_id')
+    utterance = item.get('utterance')
+    if not isinstance(user_id, str) or len(user_id) == 0:
+        raise ValueError('user_id must be a non-empty string')
+    if not isinstance(utterance, str):
+        raise ValueError('utterance must be a string')
+    return user_id, utterance
+
+
+@flask_app.route('/v1/push', methods=["POST"])
+def push_v1():
+    """
+    Запрос {"user_id": "...", "utterance": "..."} возвращает {"user_id": "...", "replies": [...]}.
+    Запрос {"requests": [{"user_id": ..., "utterance": ...}, ...]} с репликами нескольких
+    собеседников возвращает {"responses": [...]} в том же порядке.
+    Если сессию собеседника занимает другой процесс, вместо "replies" возвращается
+    "error": "session is busy", для одиночного запроса - с кодом 503.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'JSON object expected'}), 400
+
+    bot = flask_app.config['bot']
+    try:
+        if 'requests' in data:
+            if not isinstance(data['requests'], list):
+                raise ValueError('requests must be a list')
+            items = [parse_push_item(item) for item in data['requests']]
+        else:
+            items = [parse_push_item(data)]
+    except ValueError as ex:
+        return jsonify({'error': str(ex)}), 400
+
+    try:
+        if 'requests' in data:
+            futures = [push_executor.submit(process_push, bot, user_id, utterance) for user_id, utterance in items]
+            return jsonify({'responses': [future.result() for future in futures]})
+        else:
+            user_id, utterance = items[0]
+            response = process_push(bot, user_id, utterance)
+            return jsonify(response), 503 if 'error' in response else 200
+    except Exception as ex:
+        logging.getLogger('rest_service_core').error(u'Error while processing /v1/push: %s', ex)
+        return jsonify({'error': 'internal error'}), 500
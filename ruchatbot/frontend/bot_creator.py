@@ -5,19 +5,30 @@
 
 from ruchatbot.bot.bot_profile import BotProfile
 from ruchatbot.bot.profile_facts_reader import ProfileFactsReader
+from ruchatbot.bot.sqlite_facts_storage import SQLiteFactsStorage
 from ruchatbot.bot.text_utils import TextUtils
 from ruchatbot.bot.simple_answering_machine import SimpleAnsweringMachine
 from ruchatbot.bot.bot_scripting import BotScripting
 from ruchatbot.bot.bot_personality import BotPersonality
 from ruchatbot.bot.plain_file_faq_storage import PlainFileFaqStorage
+from ruchatbot.bot.session_store import SQLiteSessionStore
+from ruchatbot.bot.persistent_session_factory import PersistentDialogSessionFactory
 from ruchatbot.scenarios.scenario_who_am_i import Scenario_WhoAmI
 
 
-def create_chatbot(profile_path, models_folder, w2v_folder, data_folder, debugging, bot_id='test_bot'):
+def create_chatbot(profile_path, models_folder, w2v_folder, data_folder, debugging, bot_id='test_bot', facts_db_path=None,
+                   hot_reload=False, sessions_db_path=None, defer_nn_models=False, oov_vectors_path=None):
+    """
+    :param defer_nn_models: True - не загружать нейросетевые модели, их загрузит init_worker в
+     рабочем процессе после fork. Все остальные модели, словари и индексы загружаются сразу и
+     разделяются рабочими процессами (copy-on-write).
+    :param oov_vectors_path: файл для сохранения векторов новых слов между запусками бота
+    """
     # NLP pileline: содержит инструменты для работы с текстом, включая морфологию и таблицы словоформ,
     # part-of-speech tagger, NP chunker и прочее.
     text_utils = TextUtils()
-    text_utils.load_embeddings(w2v_dir=w2v_folder, wc2v_dir=models_folder)
+    text_utils.load_embeddings(w2v_dir=w2v_folder, wc2v_dir=models_folder, load_nn_models=not defer_nn_models,
+                               oov_vectors_path=oov_vectors_path)
     text_utils.load_dictionaries(data_folder, models_folder)
 
     # Настроечные параметры аватара собраны в профиле - файле в json формате.
@@ -27,9 +38,14 @@ def create_chatbot(profile_path, models_folder, w2v_folder, data_folder, debuggi
     # Инициализируем движок вопросно-ответной системы. Он может обслуживать несколько
     # ботов с разными провилями (базами фактов и правил), хотя тут у нас будет работать только один.
     machine = SimpleAnsweringMachine(text_utils=text_utils)
-    machine.load_models(data_folder, models_folder, profile.constants)
+    machine.load_models(data_folder, models_folder, profile.constants, load_nn_models=not defer_nn_models)
     machine.trace_enabled = debugging
 
+    # Если задан путь к базе сессий, то состояние диалогов хранится в ней и доступно
+    # всем процессам бота, работающим с этой базой.
+    if sessions_db_path:
+        machine.set_session_factory(PersistentDialogSessionFactory(SQLiteSessionStore(sessions_db_path)))
+
     # Контейнер для правил
     scripting = BotScripting(data_folder)
     scripting.load_rules(profile.rules_path, profile.smalltalk_generative_rules, profile.constants, text_utils)
@@ -37,16 +53,36 @@ def create_chatbot(profile_path, models_folder, w2v_folder, data_folder, debuggi
     # Добавляем скрипты на питоне
     scripting.add_scenario(Scenario_WhoAmI())
 
-    # Конкретная реализация хранилища фактов - плоские файлы в utf-8, с минимальным форматированием
-    profile_facts = ProfileFactsReader(text_utils=text_utils,
-                                       profile_path=profile.premises_path,
-                                       constants=profile.constants)
+    # Конкретная реализация хранилища фактов - плоские файлы в utf-8, с минимальным форматированием.
+    # Если задан путь к базе SQLite, то новые факты хранятся в ней отдельно для каждого собеседника.
+    if facts_db_path:
+        profile_facts = SQLiteFactsStorage(text_utils=text_utils,
+                                           profile_path=profile.premises_path,
+                                           constants=profile.constants,
+                                           db_path=facts_db_path,
+                                           models_folder=models_folder,
+                                           hot_reload=hot_reload)
+    else:
+        profile_facts = ProfileFactsReader(text_utils=text_utils,
+                                           profile_path=profile.premises_path,
+                                           constants=profile.constants,
+                                           models_folder=models_folder,
+                                           hot_reload=hot_reload)
+
+    # Если факты профиля скомпилированы (см. preparation/compile_facts.py), то модели берут
+    # готовые признаки фактов и не прогоняют их через NLP-конвейер.
+    compiled_facts = profile_facts.get_compiled_facts()
+    if compiled_facts is not None:
+        machine.relevancy_detector.preload_compiled_facts(compiled_facts)
+        machine.synonymy_detector.preload_compiled_facts(compiled_facts)
 
     # Подключем простое файловое хранилище с FAQ-правилами бота.
     # Движок бота сопоставляет вопрос пользователя с опорными вопросами в FAQ базе,
     # и если нашел хорошее соответствие (синонимичность выше порога), то
     # выдает ответную часть найденной записи.
-    faq_storage = PlainFileFaqStorage(profile.faq_path, constants=profile.constants, text_utils=text_utils)
+    # При hot_reload=True измененные файлы FAQ и фактов перечитываются на лету, без рестарта.
+    faq_storage = PlainFileFaqStorage(profile.faq_path, constants=profile.constants, text_utils=text_utils,
+                                      hot_reload=hot_reload)
 
     # Инициализируем аватара
     bot = BotPersonality(bot_id=bot_id,
@@ -56,4 +92,26 @@ def create_chatbot(profile_path, models_folder, w2v_folder, data_folder, debuggi
                          scripting=scripting,
                          profile=profile)
 
+    # Детектор синонимов может заранее подготовить векторы для статичных эталонных фраз:
+    # вопросов FAQ, ключевых фраз историй и эталонов в условиях правил.
+    story_rules = scripting.get_story_rules()
+    keyphrases = [phrase for phrase, _, _ in story_rules.get_keyphrases2() + story_rules.get_keyphrases3()]
+    etalons = scripting.get_text_etalons(text_utils)
+    for rule in machine.premise_not_found.get_noanswer_rules():
+        etalons.extend(text_utils.wordize_text(etalon) for etalon in rule.get_text_etalons())
+    machine.synonymy_detector.precompute(faq_storage.get_questions() + keyphrases + etalons, text_utils)
+
     return bot
+
+
+def init_worker(bot):
+    """
+    Подготовка бота, созданного с defer_nn_models=True, в рабочем процессе после fork:
+    загрузка нейросетевых моделей (tf-сессия создается уже в этом процессе) и
+    открытие собственных соединений с базами данных.
+    """
+    engine = bot.get_engine()
+    engine.get_text_utils().load_nn_models()
+    engine.load_nn_models()
+    bot.facts.after_fork()
+    engine.get_session_factory().after_fork()
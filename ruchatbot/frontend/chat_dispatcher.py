@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Диспетчер сообщений для фронтэндов, получающих реплики многих собеседников из одного потока
+(например, long polling в телеграмме).
+
+Сообщения разных чатов обрабатываются параллельно пулом рабочих потоков, а сообщения одного
+чата - строго по очереди и в порядке поступления, так как они меняют одну и ту же сессию.
+Медленный ответ в одном чате не задерживает остальные чаты.
+"""
+
+import collections
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ChatDispatcher(object):
+    def __init__(self, nb_workers=8, max_pending=1000):
+        """
+        :param nb_workers: число рабочих потоков
+        :param max_pending: максимальное число принятых, но еще не обработанных сообщений во всех чатах.
+         Когда очередь заполнена, submit ждет освобождения места, так что источник сообщений
+         притормаживает, а не копит их в памяти без ограничений.
+        """
+        self.logger = logging.getLogger('ChatDispatcher')
+        self.executor = ThreadPoolExecutor(max_workers=nb_workers)
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.chat_queues = dict()  # chat_id => очередь задач, ожидающих завершения текущей задачи чата
+
+    def submit(self, chat_id, task, timeout=None):
+        """
+        Постановка задачи в очередь чата.
+        :param task: функция без аргументов
+        :param timeout: сколько секунд ждать места в заполненной очереди, None - ждать без ограничения
+        :return: False, если за время timeout место в очереди не освободилось
+        """
+        if not self.pending.acquire(timeout=timeout):
+            self.logger.warning(u'Dispatcher queue is full, message for chat %s rejected', chat_id)
+            return False
+
+        with self.lock:
+            queue = self.chat_queues.get(chat_id)
+            if queue is not None:
+                # Чат уже обрабатывается, задача будет выполнена следом.
+                queue.append(task)
+                return True
+            self.chat_queues[chat_id] = collections.deque()
+
+        self.executor.submit(self.run_task, chat_id, task)
+        return True
+
+    def run_task(self, chat_id, task):
+        try:
+            task()
+        except Exception as ex:
+            self.logger.error(u'Error while processing message for chat %s: %s', chat_id, ex)
+        finally:
+            self.pending.release()
+
+        with self.lock:
+            queue = self.chat_queues[chat_id]
+            if not queue:
+                del self.chat_queues[chat_id]
+                self.idle.notify_all()
+                return
+            next_task = queue.popleft()
+
+        # Следующее сообщение чата ставим в общую очередь пула, чтобы активный чат
+        # не занимал рабочий поток, пока ждут сообщения других чатов.
+        self.executor.submit(self.run_task, chat_id, next_task)
+
+    def shutdown(self):
+        """Ожидание обработки всех принятых сообщений и остановка рабочих потоков"""
+        with self.lock:
+            while self.chat_queues:
+                self.idle.wait()
+        self.executor.shutdown(wait=True)
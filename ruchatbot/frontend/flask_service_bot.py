@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 """
 Простой web api для чатбота https://github.com/Koziev/chatbot на Flask.
+
+18-10-2026 Режим с несколькими рабочими процессами (--workers N): модели загружаются
+           в главном процессе и разделяются рабочими процессами, см. prefork_server.py
 """
 
 from __future__ import print_function
@@ -11,8 +14,10 @@ import logging
 
 from ruchatbot.utils.logging_helpers import init_trainer_logging
 from ruchatbot.bot_service import flask_app
+from ruchatbot.bot_service.config import Config
 from ruchatbot.bot_service.global_params import profile_path, models_folder, data_folder, w2v_folder
-from ruchatbot.frontend.bot_creator import create_chatbot
+from ruchatbot.frontend.bot_creator import create_chatbot, init_worker
+from ruchatbot.frontend.prefork_server import serve_prefork
 
 
 listen_ip = '127.0.0.1'
@@ -20,11 +25,14 @@ listen_port = 9001
 
 
 @flask_app.before_first_request
-def init_chatbot():
+def init_chatbot(defer_nn_models=False):
     if 'bot' not in flask_app.config:
         logging.info('init_chatbot: models_folder="%s"', models_folder)
 
-        bot = create_chatbot(profile_path, models_folder, w2v_folder, data_folder, debugging=True)
+        bot = create_chatbot(profile_path, models_folder, w2v_folder, data_folder, debugging=True,
+                             facts_db_path=Config.FACTS_DB_PATH, hot_reload=True,
+                             sessions_db_path=Config.SESSIONS_DB_PATH, defer_nn_models=defer_nn_models,
+                             oov_vectors_path=Config.OOV_VECTORS_PATH)
 
         def on_order(order_anchor_str, bot, session):
             bot.say(session, 'Выполняю команду "{}"'.format(order_anchor_str))
@@ -46,6 +54,7 @@ if __name__ == '__main__':
     parser.add_argument('--ip', help='listen to specified IP address', type=str, default=listen_ip)
     parser.add_argument('--port', type=str, default=listen_port)
     parser.add_argument('--preload', type=bool, default=True, help='Load all models and dictionary before service start-up')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes sharing preloaded models')
 
     args = parser.parse_args()
     profile_path = os.path.expanduser(args.profile)
@@ -59,11 +68,19 @@ if __name__ == '__main__':
     # настраиваем логирование в файл
     init_trainer_logging(os.path.join(tmp_folder, 'flask_service_bot.log'), debugging=True)
 
-    if args.preload:
-        init_chatbot()
-
-    logging.info('Going to run flask_app listening %s:%d profile_path="%s" models_folder="%s" data_folder="%s" w2v_folder="%s"', listen_ip, listen_port, profile_path, models_folder, data_folder, w2v_folder)
-    flask_app.run(debug=True, host=listen_ip, port=listen_port)
+    if args.workers > 1:
+        # Все, кроме нейросетевых моделей, загружаем до fork. Состояние диалогов рабочие
+        # процессы разделяют через базу сессий Config.SESSIONS_DB_PATH.
+        init_chatbot(defer_nn_models=True)
+        logging.info('Going to run %d workers listening %s:%s', args.workers, listen_ip, listen_port)
+        serve_prefork(flask_app, listen_ip, listen_port, args.workers,
+                      worker_init=lambda: init_worker(flask_app.config['bot']))
+    else:
+        if args.preload:
+            init_chatbot()
+
+        logging.info('Going to run flask_app listening %s:%d profile_path="%s" models_folder="%s" data_folder="%s" w2v_folder="%s"', listen_ip, listen_port, profile_path, models_folder, data_folder, w2v_folder)
+        flask_app.run(debug=True, host=listen_ip, port=listen_port)
 
 
 # https://stackoverflow.com/questions/8495367/using-additional-command-line-arguments-with-gunicorn?utm_medium=organic&utm_source=google_rich_qa&utm_campaign=google_rich_qa
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Запуск WSGI-приложения в нескольких рабочих процессах (pre-fork).
+
+Главный процесс загружает модели, словари и индексы, открывает слушающий сокет и создает
+рабочие процессы через fork. Загруженные данные разделяются процессами в режиме copy-on-write,
+отображенные в память файлы (KeyedVectors с mmap='r', скомпилированные факты, индексы фраз)
+разделяются через page cache. Данные, которые нельзя переносить через fork (tf-сессии,
+соединения с базами данных), рабочий процесс создает сам в функции worker_init.
+"""
+
+import gc
+import logging
+import os
+import signal
+import time
+
+from werkzeug.serving import make_server
+
+
+def run_worker(server, worker_init):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    try:
+        if worker_init:
+            worker_init()
+        server.serve_forever()
+    except Exception as ex:
+        logging.getLogger('prefork_server').error(u'Worker %d failed: %s', os.getpid(), ex)
+        os._exit(1)
+    os._exit(0)
+
+
+def serve_prefork(app, host, port, nb_workers, worker_init=None):
+    """
+    :param app: WSGI-приложение, полностью подготовленное в главном процессе
+    :param nb_workers: число рабочих процессов
+    :param worker_init: функция без аргументов, вызываемая в рабочем процессе после fork
+    """
+    logger = logging.getLogger('prefork_server')
+    server = make_server(host, int(port), app, threaded=True)
+
+    # Объекты, созданные до fork, исключаем из сборки мусора, чтобы сборщик в рабочих
+    # процессах не трогал их заголовки и не вызывал копирование разделяемых страниц памяти.
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+    workers = set()
+    shutting_down = [False]
+
+    def spawn_worker():
+        pid = os.fork()
+        if pid == 0:
+            run_worker(server, worker_init)
+        workers.add(pid)
+        logger.info(u'Worker %d started', pid)
+
+    def on_shutdown(signum, frame):
+        shutting_down[0] = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, on_shutdown)
+    signal.signal(signal.SIGINT, on_shutdown)
+
+    logger.info(u'Starting %d workers listening %s:%s', nb_workers, host, port)
+    for _ in range(nb_workers):
+        spawn_worker()
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        workers.discard(pid)
+        if not shutting_down[0]:
+            # Упавший рабочий процесс заменяем новым, не загружая модели заново.
+            logger.error(u'Worker %d exited with status %d, restarting', pid, status)
+            time.sleep(1.0)
+            spawn_worker()
+
+    server.server_close()
+    logger.info(u'All workers stopped')
@@ -2,6 +2,9 @@
 """
 Реализация чатбота для Телеграмма.
 Для вопросно-ответной системы https://github.com/Koziev/chatbot.
+18-10-2026 сообщения разных чатов обрабатываются параллельно (ChatDispatcher), сообщения одного
+           чата - по очереди; сессия собеседника определяется по chat_id, все ответы бота
+           на реплику отправляются одним сообщением
 """
 
 import logging
@@ -15,39 +18,58 @@ from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
 
 from ruchatbot.utils.logging_helpers import init_trainer_logging
 from ruchatbot.frontend.bot_creator import create_chatbot
+from ruchatbot.frontend.chat_dispatcher import ChatDispatcher
+from ruchatbot.utils.batch_predictor import BatchingPredictor
 
 
-def start(bot, update):
-    user_id = update.message.chat.first_name + u' ' + update.message.chat.last_name
-    chatbot.start_conversation(user_id)
+def get_user_id(update):
+    # Имя и фамилия собеседника не уникальны и могут отсутствовать, поэтому
+    # в качестве идентификатора сессии берем идентификатор чата.
+    return str(update.message.chat_id)
+
 
+def send_replies(bot, chat_id, user_id):
+    # Все накопившиеся ответы бота отправляем одним сообщением.
+    replies = []
     while True:
         answer = chatbot.pop_phrase(user_id)
         if len(answer) == 0:
             break
+        replies.append(answer)
 
-        bot.send_message(chat_id=update.message.chat_id, text=answer)
+    if replies:
+        bot.send_message(chat_id=chat_id, text=u'\n'.join(replies))
 
 
-def echo(bot, update):
-    # update.chat.first_name
-    # update.chat.last_name
-    try:
-        # В качестве идентификатора сессии собеседника берем его имя и фамилию
-        user_id = update.message.chat.first_name+u' '+update.message.chat.last_name
-        question = update.message.text
+def process_start(bot, chat_id, user_id):
+    with chatbot.get_engine().get_session_factory().lock_session(chatbot, user_id):
+        chatbot.start_conversation(user_id)
+        send_replies(bot, chat_id, user_id)
 
-        logging.info('Answering to "%s"', question)
 
+def process_message(bot, chat_id, user_id, question):
+    logging.info('Answering to "%s"', question)
+    with chatbot.get_engine().get_session_factory().lock_session(chatbot, user_id):
         chatbot.push_phrase(user_id, question)
-        while True:
-            answer = chatbot.pop_phrase(user_id)
-            if len(answer) == 0:
-                break
-            else:
-                bot.send_message(chat_id=update.message.chat_id, text=answer)
-    except Exception as ex:
-        logging.error(ex)  # sys.exc_info()[0]
+        send_replies(bot, chat_id, user_id)
+
+
+def dispatch(bot, chat_id, task):
+    if not dispatcher.submit(chat_id, task, timeout=queue_timeout):
+        bot.send_message(chat_id=chat_id, text=u'Сейчас слишком много вопросов, повторите, пожалуйста, позже.')
+
+
+def start(bot, update):
+    chat_id = update.message.chat_id
+    user_id = get_user_id(update)
+    dispatch(bot, chat_id, lambda: process_start(bot, chat_id, user_id))
+
+
+def echo(bot, update):
+    chat_id = update.message.chat_id
+    user_id = get_user_id(update)
+    question = update.message.text
+    dispatch(bot, chat_id, lambda: process_message(bot, chat_id, user_id, question))
 
 
 if __name__ == '__main__':
@@ -59,6 +81,10 @@ if __name__ == '__main__':
     parser.add_argument('--w2v_folder', type=str, default='../../tmp')
     parser.add_argument('--models_folder', type=str, default='../../tmp', help='path to folder with pretrained models')
     parser.add_argument('--tmp_folder', type=str, default='../../tmp', help='path to folder for logfile etc')
+    parser.add_argument('--workers', type=int, default=8, help='number of threads answering in parallel to different chats')
+    parser.add_argument('--max_pending', type=int, default=1000, help='max number of queued messages')
+    parser.add_argument('--queue_timeout', type=float, default=30.0, help='seconds to wait for a free place in the full queue')
+    parser.add_argument('--batch_window', type=float, default=0.005, help='seconds to collect concurrent model calls into a batch')
 
     args = parser.parse_args()
 
@@ -81,14 +107,18 @@ if __name__ == '__main__':
     logging.debug('Bot loading...')
     chatbot = create_chatbot(profile_path, models_folder, w2v_folder, data_folder, True, bot_id='telegram_bot')
 
+    # Вызовы нейросетевых моделей из параллельно обрабатываемых чатов выполняются батчами.
+    BatchingPredictor.window = args.batch_window
+    dispatcher = ChatDispatcher(nb_workers=args.workers, max_pending=args.max_pending)
+    queue_timeout = args.queue_timeout
+
     updater = Updater(token=telegram_token)
-    dispatcher = updater.dispatcher
 
     start_handler = CommandHandler('start', start)
-    dispatcher.add_handler(start_handler)
+    updater.dispatcher.add_handler(start_handler)
 
     echo_handler = MessageHandler(Filters.text, echo)
-    dispatcher.add_handler(echo_handler)
+    updater.dispatcher.add_handler(echo_handler)
 
     logging.info('Start polling messages for bot {}...'.format(tg_bot.getMe()))
     updater.start_polling()
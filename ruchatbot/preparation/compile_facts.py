@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Компиляция базы фактов профиля бота в бинарный файл (см. ruchatbot/bot/compiled_facts.py).
+
+Для каждого факта сохраняются канонический текст, токены, леммы, тегсеты и id шинглов
+для моделей lgb_relevancy и lgb_synonymy. Результат записывается рядом с файлом фактов
+с расширением .compiled и подхватывается ProfileFactsReader при старте бота, если
+контрольная сумма совпадает с текущими файлом фактов, константами профиля и конфигами моделей.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import os
+
+from ruchatbot.bot.bot_profile import BotProfile
+from ruchatbot.bot.text_utils import TextUtils
+from ruchatbot.bot.profile_facts_reader import ProfileFactsReader
+from ruchatbot.bot.gb_base_detector import GB_BaseDetector
+from ruchatbot.bot.compiled_facts import CompiledFactsBuilder, MODEL_CONFIGS, get_compiled_facts_path,\
+    calc_facts_checksum
+from ruchatbot.utils.logging_helpers import init_trainer_logging
+
+
+def compile_facts(facts_path, constants, text_utils, models_folder):
+    facts_reader = ProfileFactsReader(text_utils=text_utils, profile_path=facts_path, constants=constants)
+    facts = facts_reader.parse_profile()
+
+    builder = CompiledFactsBuilder()
+    for fact_text, person, fact_id in facts:
+        tokens = text_utils.tokenize(fact_text)
+        lemmas = text_utils.lemmatize(fact_text)
+        tags = [tagset for word, tagset in text_utils.tag(tokens)]
+        builder.add_fact((fact_text, person, fact_id), tokens, lemmas, tags)
+
+    # Признаки фактов для моделей считаем тем же кодом, что используется при ответе на вопросы.
+    for config_name in MODEL_CONFIGS:
+        config_path = os.path.join(models_folder, config_name)
+        if not os.path.exists(config_path):
+            continue
+
+        with open(config_path, 'r') as f:
+            model_config = json.load(f)
+
+        engine = GB_BaseDetector()
+        engine.init_model_params(model_config)
+        for fact_text, _, _ in facts:
+            builder.add_shingles(engine.model_id, engine.get_phrase_shingle_ids(fact_text, text_utils))
+
+    output_path = get_compiled_facts_path(facts_path)
+    builder.save(output_path, calc_facts_checksum(facts_path, constants, models_folder))
+    logging.info(u'%d facts compiled into "%s"', len(facts), output_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile bot profile facts into binary format')
+    parser.add_argument('--profile', type=str, default='../../data/profile_1.json', help='path to profile file')
+    parser.add_argument('--data_folder', type=str, default='../../data')
+    parser.add_argument('--models_folder', type=str, default='../../tmp', help='path to folder with pretrained models')
+    parser.add_argument('--tmp_folder', type=str, default='../../tmp', help='path to folder for logfile etc')
+
+    args = parser.parse_args()
+    profile_path = os.path.expanduser(args.profile)
+    data_folder = os.path.expanduser(args.data_folder)
+    models_folder = os.path.expanduser(args.models_folder)
+    tmp_folder = os.path.expanduser(args.tmp_folder)
+
+    init_trainer_logging(os.path.join(tmp_folder, 'compile_facts.log'))
+
+    text_utils = TextUtils()
+    text_utils.load_dictionaries(data_folder, models_folder)
+
+    profile = BotProfile()
+    profile.load(profile_path, data_folder, models_folder)
+
+    compile_facts(profile.premises_path, profile.constants, text_utils, models_folder)
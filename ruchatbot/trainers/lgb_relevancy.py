@@ -15,6 +15,7 @@
 27-10-2019 - добавлен расчет метрики mean reciprocal rank
 28-10-2019 - переделан сценарий eval, теперь это оценка через кроссвалидацию на полном датасете
 30-10-2019 - сценарий hyperopt для подбора метапараметров вынесен в отдельный режим, переделан на кроссвалидацию внутри objective
+18-10-2026 - режим prefilter_recall для оценки полноты отбора кандидатов по инвертированному индексу шинглов
 """
 
 from __future__ import division
@@ -51,6 +52,7 @@ from ruchatbot.utils.phrase_splitter import PhraseSplitter
 import ruchatbot.utils.console_helpers
 import ruchatbot.utils.logging_helpers
 from ruchatbot.utils.tokenizer import Tokenizer
+from ruchatbot.bot.shingle_index import ShingleIndex
 
 
 # алгоритм сэмплирования гиперпараметров
@@ -500,7 +502,7 @@ def get_best_params(task):
 
 
 parser = argparse.ArgumentParser(description='LightGBM classifier for text relevance estimation')
-parser.add_argument('--run_mode', type=str, default='train', choices='hyperopt train eval query query2 hardnegative', help='what to do')
+parser.add_argument('--run_mode', type=str, default='train', choices='hyperopt train eval query query2 hardnegative prefilter_recall'.split(), help='what to do')
 parser.add_argument('--hyperopt', type=int, default=1000, help='Number of objective calculations for hyperopt')
 parser.add_argument('--shingle_len', type=int, default=3, choices=[2, 3, 4, 5], help='shingle length')
 parser.add_argument('--input', type=str, default='../data/premise_question_relevancy.csv', help='path to input dataset')
@@ -508,6 +510,8 @@ parser.add_argument('--tmp', type=str, default='../tmp', help='folder to store r
 parser.add_argument('--data_dir', type=str, default='../data', help='folder containing some evaluation datasets')
 parser.add_argument('--lemmatize', type=int, default=1, help='canonize phrases before shingle extraction: 0 - none, 1 - lemmas, 2 - stems')
 parser.add_argument('--task', type=str, default='relevancy', choices='relevancy synonymy partial_relevancy'.split(), help='model filenames keyword')
+parser.add_argument('--nb_candidates', type=int, default=100, help='number of prefiltered candidates for prefilter_recall')
+parser.add_argument('--nb_probes', type=int, default=200, help='number of probe questions for prefilter_recall')
 
 args = parser.parse_args()
 
@@ -781,6 +785,66 @@ if run_mode == 'query2':
         for phrase, sim in phrase_rels[:30]:  # выводим топ ближайших фраз
             print(u'{:6.4f} {}'.format(sim, phrase))
 
+if run_mode == 'prefilter_recall':
+    # Проверка полноты двухстадийного поиска (параметр nb_prefilter_candidates в конфиге модели):
+    # для каждого пробного вопроса сравниваем top-k полного ранжирования всех предпосылок моделью
+    # с набором кандидатов, отобранных по инвертированному индексу шинглов.
+
+    # Загружаем данные обученной модели.
+    with open(os.path.join(tmp_folder, config_filename), 'r') as f:
+        model_config = json.load(f)
+
+    tokenizer = PhraseSplitter.create_splitter(model_config['lemmatize'])
+
+    lgb_relevancy = lightgbm.Booster(model_file=model_config['model_filename'])
+
+    xgb_relevancy_shingle2id = model_config['shingle2id']
+    xgb_relevancy_shingle_len = model_config['shingle_len']
+    xgb_relevancy_nb_features = model_config['nb_features']
+
+    def phrase2shingles(phrase):
+        return set(ngrams(words2str(tokenizer.tokenize(phrase)), xgb_relevancy_shingle_len))
+
+    def shingles2ids(shingles):
+        ids = set(xgb_relevancy_shingle2id[s] for s in shingles if s in xgb_relevancy_shingle2id)
+        return np.array(sorted(ids), dtype=np.int32)
+
+    # База предпосылок и пробные вопросы берутся из датасета
+    df = pd.read_csv(input_path, encoding='utf-8', delimiter='\t', quoting=3)
+    premises = list(df['premise'].unique())
+    probes = list(np.random.permutation(df['question'].unique())[:args.nb_probes])
+    nb_premises = len(premises)
+    logging.info('nb_premises=%d nb_probes=%d nb_candidates=%d', nb_premises, len(probes), args.nb_candidates)
+
+    premises_shingles = [phrase2shingles(premise) for premise in premises]
+    index = ShingleIndex([shingles2ids(shingles) for shingles in premises_shingles])
+
+    top_ks = [1, 3, 10]
+    k2recall = dict((k, 0.0) for k in top_ks)
+    for probe in tqdm.tqdm(probes, total=len(probes), desc='Prefilter recall'):
+        question_shingles = phrase2shingles(probe)
+
+        X_data = lil_matrix((nb_premises, xgb_relevancy_nb_features), dtype='float32')
+        for ipremise, premise_shingles in enumerate(premises_shingles):
+            vectorize_sample_x(X_data, ipremise, premise_shingles, question_shingles, xgb_relevancy_shingle2id)
+
+        y_pred = lgb_relevancy.predict(X_data)
+        ranking = np.argsort(-y_pred)
+
+        candidates = set(index.find_candidates(shingles2ids(question_shingles), args.nb_candidates).tolist())
+        if len(candidates) == 0:
+            # детектор в этом случае ранжирует все фразы
+            candidates = set(range(nb_premises))
+
+        for k in top_ks:
+            top = ranking[:k]
+            k2recall[k] += sum((i in candidates) for i in top) / float(len(top))
+
+    for k in top_ks:
+        recall = k2recall[k] / len(probes)
+        print('recall@{}={:6.4f}'.format(k, recall))
+        logging.info('nb_candidates=%d recall@%d=%6.4f', args.nb_candidates, k, recall)
+
 if run_mode == 'clusterize':
     # семантическая кластеризация предложений с использованием
     # обученной модели в качестве калькулятора метрики попарной близости.
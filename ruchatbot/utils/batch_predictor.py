@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Объединение одновременных вызовов model.predict из разных потоков в один батч.
+
+Когда сервис обрабатывает реплики нескольких собеседников параллельно, каждая нейросетевая
+модель получает много запросов с одним сэмплом. Вызов predict для одного сэмпла стоит почти
+столько же, сколько для нескольких десятков, поэтому запросы, пришедшие пока модель занята
+(и, опционально, в течение короткого окна ожидания), выполняются одним вызовом.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+
+class PendingPredict(object):
+    def __init__(self, x):
+        self.x = x
+        self.result = None
+        self.error = None
+        self.done = False
+        self.event = threading.Event()
+
+
+class BatchingPredictor(object):
+    """
+    Обертка для keras-модели с методом predict, совместимым с model.predict для входов вида
+    ndarray, список ndarray или словарь имя_входа => ndarray.
+
+    Вызов выполняется в потоке одного из ожидающих клиентов (лидера), так что модель работает
+    в тех же потоках, что и без батчинга. Лидер забирает из очереди накопившиеся запросы,
+    выполняет их одним вызовом predict, раздает результаты и передает роль лидера первому
+    из оставшихся в очереди запросов.
+    """
+
+    # Сколько секунд новый лидер ждет других запросов перед вызовом модели. При нулевом значении
+    # в батч попадают только запросы, пришедшие пока модель была занята.
+    window = 0.0
+
+    def __init__(self, model, graph=None, max_batch_size=64):
+        """
+        :param model: keras-модель
+        :param graph: tf граф, в контексте которого надо вызывать модель, или None
+        :param max_batch_size: максимальное число запросов в одном вызове модели
+        """
+        self.model = model
+        self.graph = graph
+        self.max_batch_size = max_batch_size
+        self.lock = threading.Lock()
+        self.queue = []
+        self.busy = False
+        self.nb_calls = 0
+        self.nb_requests = 0
+
+    def predict(self, x):
+        request = PendingPredict(x)
+        with self.lock:
+            self.queue.append(request)
+            is_leader = not self.busy
+            self.busy = True
+
+        if is_leader:
+            self.serve(BatchingPredictor.window)
+
+        while not request.done:
+            request.event.wait()
+            if not request.done:
+                # Запрос стал лидером.
+                request.event.clear()
+                self.serve(0.0)
+
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def serve(self, window):
+        if window > 0.0:
+            time.sleep(window)
+
+        with self.lock:
+            batch = self.queue[:self.max_batch_size]
+            del self.queue[:self.max_batch_size]
+
+        try:
+            self.run_batch(batch)
+        finally:
+            with self.lock:
+                if self.queue:
+                    self.queue[0].event.set()
+                else:
+                    self.busy = False
+
+    def run_batch(self, batch):
+        try:
+            sizes = [BatchingPredictor.get_batch_size(request.x) for request in batch]
+            try:
+                x = BatchingPredictor.concatenate([request.x for request in batch])
+            except ValueError:
+                # Входы разной формы объединить нельзя, выполняем запросы по отдельности.
+                for request in batch:
+                    request.result = self.call_model(request.x)
+            else:
+                y = self.call_model(x)
+                offset = 0
+                for request, size in zip(batch, sizes):
+                    request.result = BatchingPredictor.slice(y, offset, offset + size)
+                    offset += size
+
+            self.nb_calls += 1
+            self.nb_requests += len(batch)
+        except Exception as ex:
+            for request in batch:
+                request.error = ex
+
+        for request in batch:
+            request.done = True
+            request.event.set()
+
+    def call_model(self, x):
+        batch_size = BatchingPredictor.get_batch_size(x)
+        if self.graph is not None:
+            with self.graph.as_default():
+                return self.model.predict(x=x, batch_size=batch_size, verbose=0)
+        else:
+            return self.model.predict(x=x, batch_size=batch_size, verbose=0)
+
+    @staticmethod
+    def get_batch_size(x):
+        if isinstance(x, dict):
+            return len(next(iter(x.values())))
+        elif isinstance(x, (list, tuple)):
+            return len(x[0])
+        else:
+            return len(x)
+
+    @staticmethod
+    def concatenate(xs):
+        if len(xs) == 1:
+            return xs[0]
+
+        x0 = xs[0]
+        if isinstance(x0, dict):
+            return dict((name, np.concatenate([x[name] for x in xs])) for name in x0)
+        elif isinstance(x0, (list, tuple)):
+            return [np.concatenate([x[i] for x in xs]) for i in range(len(x0))]
+        else:
+            return np.concatenate(xs)
+
+    @staticmethod
+    def slice(y, start, end):
+        if isinstance(y, list):
+            return [z[start:end] for z in y]
+        else:
+            return y[start:end]
+
+    def get_stats(self):
+        return {'calls': self.nb_calls, 'requests': self.nb_requests}
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Отслеживание изменений файлов данных (FAQ, факты профиля) для перезагрузки без рестарта бота.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+
+class FileWatcher(object):
+    """
+    Файл считается измененным, если изменилось его содержимое. Дешевая проверка mtime и размера
+    выполняется не чаще раза в check_interval секунд, хэш содержимого считается только при
+    изменении mtime или размера, так что простое касание файла не вызывает перезагрузку.
+    """
+    def __init__(self, path, check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.last_check = 0.0
+        self.stat_key = None
+        self.content_hash = None
+        self.pending_state = None  # (stat_key, content_hash) изменения, которое сейчас перезагружается
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_stat_key(path):
+        st = os.stat(path)
+        return st.st_mtime, st.st_size
+
+    @staticmethod
+    def calc_hash(path):
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            h.update(f.read())
+        return h.hexdigest()
+
+    def mark_loaded(self):
+        """Запоминаем состояние файла в момент его загрузки"""
+        self.stat_key = FileWatcher.get_stat_key(self.path)
+        self.content_hash = FileWatcher.calc_hash(self.path)
+        self.last_check = time.time()
+
+    def try_acquire_change(self):
+        """
+        Вернет True, если содержимое файла изменилось с момента последней загрузки. В этом случае
+        вызывающий код должен перезагрузить файл и затем вызвать release_change(), передав в нем
+        признак успешной перезагрузки. Если файл в этот момент перезагружает другой поток, то
+        возвращается False и используются старые данные.
+        """
+        now = time.time()
+        if now - self.last_check < self.check_interval:
+            return False
+
+        if not self.lock.acquire(False):
+            return False
+
+        try:
+            self.last_check = now
+            stat_key = FileWatcher.get_stat_key(self.path)
+            if stat_key == self.stat_key:
+                self.lock.release()
+                return False
+
+            content_hash = FileWatcher.calc_hash(self.path)
+            if content_hash == self.content_hash:
+                # Файл только коснулись, содержимое прежнее.
+                self.stat_key = stat_key
+                self.lock.release()
+                return False
+
+            # Новое состояние файла запоминается только после успешной перезагрузки,
+            # иначе неудачная перезагрузка будет повторена при следующей проверке.
+            self.pending_state = (stat_key, content_hash)
+            return True
+        except OSError:
+            # Файл может отсутствовать в момент замены редактором, попробуем при следующей проверке.
+            self.lock.release()
+            return False
+
+    def release_change(self, reloaded=True):
+        """
+        :param reloaded: False - перезагрузка не удалась, файл будет перезагружаться снова
+        """
+        if reloaded:
+            self.stat_key, self.content_hash = self.pending_state
+        self.pending_state = None
+        self.lock.release()
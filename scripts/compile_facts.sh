@@ -0,0 +1,3 @@
+# Компиляция базы фактов профиля в бинарный формат, который бот загружает при старте без NLP-конвейера.
+# Перезапускать после изменения файла фактов, констант профиля или переобучения lgb моделей.
+PYTHONPATH=.. python3 ../ruchatbot/preparation/compile_facts.py --profile ../data/profile_1.json --data_folder ../data --models_folder ../tmp --tmp_folder ../tmp
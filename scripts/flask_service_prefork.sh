@@ -0,0 +1,3 @@
+# Веб-сервис чатбота в нескольких рабочих процессах, разделяющих загруженные модели.
+# OMP_NUM_THREADS=1: каждый процесс обслуживает свои запросы, потоки OpenMP в lightgbm только мешают друг другу.
+OMP_NUM_THREADS=1 PYTHONPATH=.. python3 ../ruchatbot/frontend/flask_service_bot.py --profile ../data/profile_1.json --data_folder ../data --models_folder ../tmp --w2v_folder ../tmp --tmp_folder ../tmp --workers 4
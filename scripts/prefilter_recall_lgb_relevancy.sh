@@ -0,0 +1 @@
+PYTHONPATH=.. python ../ruchatbot/trainers/lgb_relevancy.py --run_mode prefilter_recall --task relevancy --nb_candidates 100